@@ -0,0 +1,276 @@
+'''
+Benchmark the asset toolchain (img_utils and font_utils) on synthetic inputs.
+
+Images are generated at several sizes, frame counts and palette sizes, and
+fonts at several glyph sizes, so results don't depend on the assets in the
+tree. Every case reports its throughput (pixels, frames or glyphs per second)
+and the peak memory allocated while it runs, measured in a separate run with
+tracemalloc so tracing doesn't slow down the timed runs.
+
+Results can be saved as a baseline, and later runs compared against it: a
+case is flagged as a regression when its throughput drops, or its peak memory
+grows, by more than the given tolerance. Baselines are only meaningful on the
+machine they were recorded on.
+'''
+import os
+import re
+import sys
+import json
+import time
+import runpy
+import atexit
+import shutil
+import tempfile
+import platform
+import tracemalloc
+import contextlib
+from argparse import ArgumentParser
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'img_utils'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'font_utils'))
+
+# Palette lookup tables must be built by the benchmark, not read from the user cache
+os.environ['EBG_CACHE_DIR'] = tempfile.mkdtemp(prefix='ebg_benchmark_')
+atexit.register(shutil.rmtree, os.environ['EBG_CACHE_DIR'], ignore_errors=True)
+
+from ebg import EBG, Palette
+from font2bin import glyph2bytes
+from parse_string import Font, draw_string
+
+IMAGE_SIZES = [(64, 64), (160, 120), (320, 240)]
+FRAME_COUNTS = [1, 16]
+PALETTE_SIZES = [4, 16, 256]
+FONT_SIZES = [(8, 8), (16, 16), (24, 32)]
+GLYPH_COUNT = 95    # Printable ASCII
+TEXT = "The quick brown fox jumps over the lazy dog\n0123456789 !?@#$%&*()[]{}<>+-=/\\|~^_.,;:'\""
+
+
+def test_image(width, height, frame=0):
+    '''
+        BGR image with gradients, a moving circle and some noise, so every palette size has colors to spare
+    '''
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                    (x + y) * 255 // max(width + height - 2, 1)], axis=-1).astype(np.uint8)
+    cx = (width // 2 + frame * max(width // 32, 1)) % width
+    img[(x - cx) ** 2 + (y - height // 2) ** 2 < (min(width, height) // 4) ** 2] = (40, 40, 200)
+    noise = np.random.default_rng(frame).integers(0, 16, img.shape, dtype=np.uint8)
+    return img + np.minimum(noise, 255 - img)
+
+def test_font(width, height, seed=0):
+    '''
+        Variable-width Font with GLYPH_COUNT random glyphs, as parse_string.Font, and
+        the glyph images it was made from
+    '''
+    rng = np.random.default_rng(seed)
+    glyph_images = []
+    for i in range(GLYPH_COUNT):
+        glyph_width = int(rng.integers(max(width // 2, 1), width + 1))
+        glyph = np.zeros((height, width), dtype=np.uint8)
+        glyph[:, :glyph_width] = 255 * (rng.random((height, glyph_width)) < 0.4)
+        glyph_images.append(glyph)
+    glyphs = bytes(b for glyph in glyph_images for b in glyph2bytes(glyph))
+    return Font(monospace=False, width=width, height=height, ascii_offset=32, glyphs=glyphs), glyph_images
+
+def save_bmf(font, font_dir, name):
+    '''
+        Save a font in the font2bin .bmf layout, as FONT_DIR/NAME/NAME.bmf
+        (where bin2c.py looks for it)
+    '''
+    os.makedirs(os.path.join(font_dir, name), exist_ok=True)
+    with open(os.path.join(font_dir, name, f"{name}.bmf"), 'wb') as f:
+        f.write(bytes([font.width | (0 if font.monospace else 0x80), font.height, font.ascii_offset]))
+        f.write(font.glyphs)
+
+@contextlib.contextmanager
+def script_arguments(arguments):
+    '''
+        Run a script in-process with the given command line, without its output
+    '''
+    argv = sys.argv
+    sys.argv = arguments
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        sys.argv = argv
+
+def image_cases(directory):
+    '''
+        (name, function, items, unit) of every EBG and palette case
+    '''
+    cases = []
+    for width, height in IMAGE_SIZES:
+        size = f"{width}x{height}"
+        img = test_image(width, height)
+        pixels = width * height
+
+        for k in PALETTE_SIZES:
+            palette = Palette.from_img(img, k)
+            indices = palette.quantize(img)
+            palette.rgb565_lut()    # Tables are built once, the benchmark measures lookups
+            cases += [
+                (f"Palette.from_img {size} k={k}", lambda img=img, k=k: Palette.from_img(img, k), pixels, 'pixels'),
+                (f"Palette.quantize exact {size} k={k}", lambda p=palette, img=img: p.quantize(img), pixels, 'pixels'),
+                (f"Palette.quantize lut {size} k={k}", lambda p=palette, img=img: p.quantize(img, method='lut'),
+                 pixels, 'pixels'),
+                (f"Palette.apply {size} k={k}",
+                 lambda p=palette, i=indices, w=width, h=height: p.apply(i, w, h), pixels, 'pixels'),
+            ]
+
+            for count in FRAME_COUNTS:
+                bitmaps = [palette.quantize(test_image(width, height, frame)) for frame in range(count)]
+                ebg = EBG(width, height, bitmaps, palette=palette)
+                for encodings, label in [(None, 'raw'), (['rle', 'lz'], 'auto'), (['rle', 'lz', 'delta'], 'delta')]:
+                    if label == 'delta' and count == 1:
+                        continue
+                    filename = os.path.join(directory, f"{size}_{k}_{count}_{label}.ebg")
+                    ebg.save(filename, encodings=encodings)
+                    name = f"{size} k={k} frames={count} {label}"
+                    cases += [
+                        (f"EBG.save {name}", lambda e=ebg, f=filename, z=encodings: e.save(f, encodings=z),
+                         count, 'frames'),
+                        (f"EBG.load {name}", lambda f=filename: [np.array(frame) for frame in EBG.load(f)],
+                         count, 'frames'),
+                    ]
+    return cases
+
+def font_cases(directory):
+    '''
+        (name, function, items, unit) of every font case
+    '''
+    cases = []
+    for width, height in FONT_SIZES:
+        size = f"{width}x{height}"
+        name = f"font_{size}"
+        font, glyph_images = test_font(width, height)
+        save_bmf(font, directory, name)
+        output = os.path.join(directory, f"{name}.h")
+        bin2c = os.path.join(BENCHMARKS_DIR, '..', 'font_utils', 'bin2c.py')
+        text = [ord(c) for c in TEXT]
+        lines = TEXT.count('\n') + 1
+        canvas = np.zeros(((height + 1) * lines, (width + 1) * len(TEXT)), dtype=np.uint8)
+
+        def run_bin2c(name=name, output=output):
+            with script_arguments([bin2c, '-f', name, '-d', directory, '-o', output]):
+                runpy.run_path(bin2c, run_name='__main__')
+
+        cases += [
+            (f"glyph2bytes {size}", lambda g=glyph_images: [glyph2bytes(glyph) for glyph in g], GLYPH_COUNT, 'glyphs'),
+            (f"bin2c.py {size}", run_bin2c, GLYPH_COUNT, 'glyphs'),
+            (f"draw_string {size}", lambda c=canvas, f=font, t=text: draw_string(c, t, f),
+             sum(1 for c in TEXT if c != '\n'), 'glyphs'),
+        ]
+    return cases
+
+def measure(function, min_time):
+    '''
+        Seconds per call of FUNCTION, repeated for at least MIN_TIME seconds
+    '''
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+        calls = 2 * calls if elapsed < min_time / 10 else int(calls * min_time / elapsed) + 1
+
+def peak_memory(function):
+    '''
+        Peak memory allocated by a single call of FUNCTION, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - start
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    '''
+        {name: [reasons]} of the cases that regressed from the baseline results
+    '''
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        reasons = []
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            reasons.append(f"throughput {result['throughput'] / reference['throughput'] - 1:+.0%}")
+        if result['peak_memory'] > reference['peak_memory'] * (1 + memory_tolerance) + 4096:
+            reasons.append(f"peak memory {result['peak_memory'] / max(reference['peak_memory'], 1) - 1:+.0%}")
+        if reasons:
+            regressions[name] = reasons
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark the img_utils and font_utils asset toolchain")
+    parser.add_argument('-k', '--filter', type=str, default=None, help="Only run cases whose name matches this regex")
+    parser.add_argument('-t', '--min-time', type=float, default=0.2,
+                        help="Minimum time measured for each case, in seconds. Default: 0.2")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Save the results as JSON")
+    parser.add_argument('-b', '--baseline', type=str, default=DEFAULT_BASELINE,
+                        help="Baseline results compared against. Default: benchmarks/baseline.json, if it exists")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Save the results as the baseline (merged with it, when only some cases run)")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Throughput drop flagged as a regression, as a fraction. Default: 0.25")
+    parser.add_argument('--memory-tolerance', type=float, default=0.25,
+                        help="Peak memory growth flagged as a regression, as a fraction. Default: 0.25")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        cases = image_cases(directory) + font_cases(directory)
+        if args.filter:
+            cases = [case for case in cases if re.search(args.filter, case[0])]
+        if len(cases) == 0:
+            parser.error("No benchmark cases match the filter")
+
+        print(f"{'Case':44s} {'Throughput':>20s} {'Time (ms)':>10s} {'Peak (KiB)':>11s} {'vs baseline':>12s}")
+        for name, function, items, unit in cases:
+            function()  # Warm up caches and lazy imports
+            seconds = measure(function, args.min_time)
+            memory = peak_memory(function)
+            results[name] = {'seconds': seconds, 'items': items, 'unit': unit,
+                             'throughput': items / seconds, 'peak_memory': memory}
+
+            change = f"{items / seconds / baseline[name]['throughput'] - 1:+.1%}" if name in baseline else ''
+            print(f"{name:44s} {items / seconds:13.1f} {unit + '/s':>6s} {1000 * seconds:10.3f} "
+                  f"{memory / 1024:11.1f} {change:>12s}")
+
+    regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) from '{args.baseline}':")
+        for name, reasons in regressions.items():
+            print(f"    {name}: {', '.join(reasons)}")
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'processor': platform.processor(), 'numpy': np.__version__, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if args.save_baseline:
+        report['results'] = {**baseline, **results}
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline saved to '{args.baseline}'")
+
+    sys.exit(1 if regressions and not args.save_baseline else 0)
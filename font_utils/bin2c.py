@@ -1,10 +1,14 @@
 #!/usr/bin/python3
 
 import os
+import sys
 import math
 import json
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_utils'))
+import profiling
+
 HEADER = \
 "#include <font.h>\n\
 \n\
@@ -20,33 +24,21 @@ FOOTER = \
 };"
 
 
-if __name__ == '__main__':
-    parser = ArgumentParser(description=" -- Font binary to C file parser")
-    parser.add_argument('-f', '--font', dest="font_name",
-                        help="Font used to map string. "
-                             "Must match a folder within the FONT_DIR directory.",
-                        type=str, required=True)
-    parser.add_argument('-d', '--fontdir', dest="font_dir",
-                        help="Directory where fonts are stored. "
-                             "Default is ./fonts",
-                        type=str, default='fonts')
-    parser.add_argument('-o', '--output',
-                        help="Path where the generated C file will be saved. "
-                             "Default is '<font_dir>/<font_name>/<font_name>.c'",
-                        type=str, default=None)
-    args = parser.parse_args()
-
-
-    font_file = os.path.join(args.font_dir,
-                             args.font_name,
-                             f"{args.font_name.replace(' ', '_')}.bmf")
+def font_to_c(font_name, font_dir='fonts', output=None):
+    '''
+        Save the .bmf file of font FONT_NAME (in FONT_DIR/FONT_NAME) as a C header with a
+        g_font_t. OUTPUT defaults to FONT_DIR/FONT_NAME/FONT_NAME.h. Returns the header filename
+    '''
+    font_file = os.path.join(font_dir,
+                             font_name,
+                             f"{font_name.replace(' ', '_')}.bmf")
     if not os.path.isfile(font_file):
-        parser.error(f"Font file '{font_file}' not found. Make sure it is "
-                     f"in the '{os.path.join(args.font_dir, args.font_name)}' folder")
+        raise FileNotFoundError(f"Font file '{font_file}' not found. Make sure it is "
+                                f"in the '{os.path.join(font_dir, font_name)}' folder")
 
-    charmap_file = os.path.join(args.font_dir,
-                                args.font_name,
-                                f"{args.font_name.replace(' ', '_')}_map.json")
+    charmap_file = os.path.join(font_dir,
+                                font_name,
+                                f"{font_name.replace(' ', '_')}_map.json")
     if os.path.isfile(charmap_file):
         with open(charmap_file, 'r') as f:
             charmap = json.load(f)
@@ -54,20 +46,20 @@ if __name__ == '__main__':
     else:
         char_list = None
 
-    if args.output is None:
-        args.output = os.path.join(args.font_dir,
-                                   args.font_name,
-                                   f"{args.font_name.replace(' ', '_')}.h")
+    if output is None:
+        output = os.path.join(font_dir,
+                              font_name,
+                              f"{font_name.replace(' ', '_')}.h")
 
-    with open(font_file, 'rb') as f:
+    with profiling.stage('read', 1), open(font_file, 'rb') as f:
         font_width, font_height, ascii_offset = f.read(3)
         monospace = not font_width & 0x80
         font_width &= 0x7F
         glyphs = f.read()
 
-    with open(args.output, 'w') as c_file:
+    with profiling.stage('write') as stage, open(output, 'w') as c_file:
         c_file.write(HEADER.format(
-            name = args.font_name.replace(' ', '_').lower(),
+            name = font_name.replace(' ', '_').lower(),
             monospace = 'true' if monospace else 'false',
             width = font_width,
             height = font_height,
@@ -82,5 +74,35 @@ if __name__ == '__main__':
                 c_file.write(f", // '{char_list[i]}'\n")
             else:
                 c_file.write(",\n")
+            stage.add(1)
 
         c_file.write(FOOTER)
+
+    return output
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=" -- Font binary to C file parser")
+    parser.add_argument('-f', '--font', dest="font_name",
+                        help="Font used to map string. "
+                             "Must match a folder within the FONT_DIR directory.",
+                        type=str, required=True)
+    parser.add_argument('-d', '--fontdir', dest="font_dir",
+                        help="Directory where fonts are stored. "
+                             "Default is ./fonts",
+                        type=str, default='fonts')
+    parser.add_argument('-o', '--output',
+                        help="Path where the generated C file will be saved. "
+                             "Default is '<font_dir>/<font_name>/<font_name>.c'",
+                        type=str, default=None)
+    parser.add_argument('--profile',
+                        help="Save the time, CPU time, peak memory and item count of each stage "
+                             "to this JSON file, and a Chrome trace next to it",
+                        type=str, default=None)
+    args = parser.parse_args()
+    profiling.profile_until_exit(args.profile)
+
+    try:
+        font_to_c(args.font_name, args.font_dir, args.output)
+    except FileNotFoundError as e:
+        parser.error(e)
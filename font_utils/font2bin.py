@@ -3,9 +3,12 @@
 from argparse import ArgumentParser
 
 import os
+import sys
 import json
 import math
-import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_utils'))
+import profiling
 
 
 def parse_font_descriptor(font_dir, font_file):
@@ -66,52 +69,49 @@ def glyph2bytes(glyph_img):
 
     return _bytes
 
-if __name__ == '__main__':
-    parser = ArgumentParser(description=" -- Font to binary parser")
-    parser.add_argument('font',
-                        help="JSON file with font specification. "
-                             "A directory can also be provided if the JSON filename "
-                             "is the same as the folder.")
-    parser.add_argument('-o', '--output', dest='output_dir',
-                        help="Output directory where font files are saved. "
-                             "Defaults to same directory as JSON font description.",
-                        type=str, default=None)
-    args = parser.parse_args()
-
-    if os.path.isfile(args.font):
-        font_file = args.font
-        font_dir = os.path.dirname(os.path.realpath(args.font))
-    elif os.path.isdir(args.font):
+def build_font(font, output_dir=None):
+    '''
+        Convert a JSON font descriptor (or a directory with a descriptor named after it) to a
+        .bmf glyph file and a _map.json charmap, saved in OUTPUT_DIR (default: next to the
+        descriptor). Returns both filenames. Invalid fonts raise ValueError or FileNotFoundError
+    '''
+    import cv2
+
+    if os.path.isfile(font):
+        font_file = font
+        font_dir = os.path.dirname(os.path.realpath(font))
+    elif os.path.isdir(font):
         font_file = os.path.join(
-            args.font,
-            f"{os.path.basename(os.path.normpath(args.font))}.json")
-        font_dir = args.font
+            font,
+            f"{os.path.basename(os.path.normpath(font))}.json")
+        font_dir = font
     else:
-        parser.error(f"'{args.font}' is not a valid file or directory.")
+        raise FileNotFoundError(f"'{font}' is not a valid file or directory.")
 
-    font = parse_font_descriptor(font_dir, font_file)
+    with profiling.stage('parse', 1):
+        font = parse_font_descriptor(font_dir, font_file)
     if font is None:
-        exit(1)
+        raise ValueError(f"Invalid font descriptor '{font_file}'")
 
-    glyphs_img = cv2.imread(font['glyphs_file'], cv2.IMREAD_GRAYSCALE)
+    with profiling.stage('decode', 1):
+        glyphs_img = cv2.imread(font['glyphs_file'], cv2.IMREAD_GRAYSCALE)
     if glyphs_img is None:
-        print(f"Error: The bitmap file '{font['glyphs']}' is not supported.")
-        exit(1)
+        raise ValueError(f"The bitmap file '{font['glyphs']}' is not supported.")
 
-    if args.output_dir is None:
-        args.output_dir = font_dir
-    os.makedirs(args.output_dir, exist_ok=True)
+    if output_dir is None:
+        output_dir = font_dir
+    os.makedirs(output_dir, exist_ok=True)
 
     glyph_width = 8 * math.ceil(font['width'] / 8)
     glyph_height = font['height']
     glyphs_per_row = glyphs_img.shape[1] // glyph_width
     if glyphs_per_row * glyph_width != glyphs_img.shape[1]:
-        print("Error: Glyph width not aligned with bitmap width."
-              "Make sure glyph and bitmap widths are multiple of 8")
-        exit(1)
+        raise ValueError("Glyph width not aligned with bitmap width."
+                         "Make sure glyph and bitmap widths are multiple of 8")
 
     font_map = {}
-    with open(os.path.join(args.output_dir, f"{font['name'].replace(' ', '_').lower()}.bmf"), 'wb') as f:
+    bmf_file = os.path.join(output_dir, f"{font['name'].replace(' ', '_').lower()}.bmf")
+    with open(bmf_file, 'wb') as f:
         f.write(bytes([
             font['width'] | (0 if font['monospace'] else 0x80),
             font['height'],
@@ -131,9 +131,39 @@ if __name__ == '__main__':
             x = glyph_width * (glyph_index % glyphs_per_row)
             y = glyph_height * (glyph_index // glyphs_per_row)
             glyph_img = glyphs_img[y:y+font['height'], x:x+font['width']]
-            glyph_bytes = glyph2bytes(glyph_img)
+            with profiling.stage('glyph2bytes', 1):
+                glyph_bytes = glyph2bytes(glyph_img)
 
-            f.write(bytes(glyph_bytes))
+            with profiling.stage('write', 1):
+                f.write(bytes(glyph_bytes))
 
-    with open(os.path.join(args.output_dir, f"{font['name'].replace(' ', '_').lower()}_map.json"), 'w') as f:
+    map_file = os.path.join(output_dir, f"{font['name'].replace(' ', '_').lower()}_map.json")
+    with profiling.stage('write', 1), open(map_file, 'w') as f:
         json.dump(font_map, f, indent=4)
+
+    return bmf_file, map_file
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=" -- Font to binary parser")
+    parser.add_argument('font',
+                        help="JSON file with font specification. "
+                             "A directory can also be provided if the JSON filename "
+                             "is the same as the folder.")
+    parser.add_argument('-o', '--output', dest='output_dir',
+                        help="Output directory where font files are saved. "
+                             "Defaults to same directory as JSON font description.",
+                        type=str, default=None)
+    parser.add_argument('--profile',
+                        help="Save the time, CPU time, peak memory and item count of each stage "
+                             "to this JSON file, and a Chrome trace next to it",
+                        type=str, default=None)
+    args = parser.parse_args()
+    profiling.profile_until_exit(args.profile)
+
+    try:
+        build_font(args.font, args.output_dir)
+    except FileNotFoundError as e:
+        parser.error(e)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
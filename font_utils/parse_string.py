@@ -10,6 +10,9 @@ from string import hexdigits
 from argparse import ArgumentParser
 from dataclasses import dataclass, field
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_utils'))
+import profiling
+
 @dataclass
 class Font:
     monospace: bool
@@ -223,7 +226,12 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--no-image',
                         help="Don't draw the expected string to an image.",
                         action="store_true")
+    parser.add_argument('--profile',
+                        help="Save the time, CPU time, peak memory and item count of each stage "
+                             "to this JSON file, and a Chrome trace next to it",
+                        type=str, default=None)
     args = parser.parse_args()
+    profiling.profile_until_exit(args.profile)
 
 
     charmap_file = os.path.join(args.font_dir,
@@ -253,7 +261,8 @@ if __name__ == '__main__':
         with open(args.file, 'r', encoding='utf8') as f:
             string = f.read()
 
-    processed_string = preprocess_string(string, charmap)
+    with profiling.stage('preprocess', len(string)):
+        processed_string = preprocess_string(string, charmap)
 
     print('"', end='')
     for char, next_char in zip(processed_string, [*processed_string[1:], None]):
@@ -282,10 +291,12 @@ if __name__ == '__main__':
         img_height = (font.height + 1) * (string.count('\n') + 1)
         string_img = np.zeros((img_height, img_width, 1))
 
-        draw_string(string_img, processed_string, font)
+        with profiling.stage('draw', len(processed_string)):
+            draw_string(string_img, processed_string, font)
 
         if args.output:
-            cv2.imwrite(args.output, string_img)
+            with profiling.stage('write', 1):
+                cv2.imwrite(args.output, string_img)
         else:
             cv2.imshow('string',
                        cv2.resize(string_img, None, fx=2, fy=2, interpolation=cv2.INTER_NEAREST))
@@ -327,6 +327,65 @@ esp_err_t g_draw_bitmap_palette_transparent(g_coord_t x, g_coord_t y, const uint
     return ESP_OK;
 }
 
+esp_err_t g_draw_bitmap_palette_packed(g_coord_t x, g_coord_t y, const uint8_t* bitmap, g_size_t width, g_size_t height, uint8_t bits, g_color_t* palette) {
+    if(bits == 8) return g_draw_bitmap_palette(x, y, bitmap, width, height, palette);
+
+    size_t row_size = (width * bits + 7) / 8;
+    uint8_t mask = (1 << bits) - 1;
+    uint8_t index;
+    for(g_coord_t v = 0; v < height; v++) {
+        const uint8_t* row = &bitmap[v * row_size];
+        for(g_coord_t u = 0; u < width; u++) {
+            // Indices are packed most significant bits first
+            // index = (row[bit // 8] >> (8 - bits - bit % 8)) & mask, where bit = u * bits
+            index = (row[(u * bits) >> 3] >> (8 - bits - ((u * bits) & 7))) & mask;
+            g_draw_pixel(x + u, y + v, palette[index]);
+        }
+    }
+    return ESP_OK;
+}
+
+esp_err_t g_draw_bitmap_palette_packed_transparent(g_coord_t x, g_coord_t y, const uint8_t* bitmap, g_size_t width, g_size_t height, uint8_t bits, g_color_t* palette, const uint8_t transparent_index) {
+    if(bits == 8) return g_draw_bitmap_palette_transparent(x, y, bitmap, width, height, palette, transparent_index);
+
+    size_t row_size = (width * bits + 7) / 8;
+    uint8_t mask = (1 << bits) - 1;
+    uint8_t index;
+    for(g_coord_t v = 0; v < height; v++) {
+        const uint8_t* row = &bitmap[v * row_size];
+        for(g_coord_t u = 0; u < width; u++) {
+            index = (row[(u * bits) >> 3] >> (8 - bits - ((u * bits) & 7))) & mask;
+            if(index == transparent_index) continue;
+
+            g_draw_pixel(x + u, y + v, palette[index]);
+        }
+    }
+    return ESP_OK;
+}
+
+esp_err_t g_draw_bitmap_rgb565(g_coord_t x, g_coord_t y, const g_color_t* bitmap, g_size_t width, g_size_t height) {
+    g_vdb_t* vdb = _g_disp->vdb;
+
+    // Part of the bitmap inside the VDB region, in screen coordinates
+    int x0 = x > vdb->region.x0 ? x : vdb->region.x0;
+    int y0 = y > vdb->region.y0 ? y : vdb->region.y0;
+    int x1 = x + width - 1 < vdb->region.x1 ? x + width - 1 : vdb->region.x1;
+    int y1 = y + height - 1 < vdb->region.y1 ? y + height - 1 : vdb->region.y1;
+    if(x0 > x1 || y0 > y1) return ESP_OK;
+
+    // Pixels are stored in display byte order, so rows are copied as they are
+    size_t vdb_width = g_region_width(&vdb->region);
+    size_t row_bytes = (x1 - x0 + 1) * sizeof(g_color_t);
+    const g_color_t* src = &bitmap[(y0 - y) * width + (x0 - x)];
+    g_color_t* dst = &vdb->buf[(y0 - vdb->region.y0) * vdb_width + (x0 - vdb->region.x0)];
+    for(int v = y0; v <= y1; v++) {
+        memcpy(dst, src, row_bytes);
+        src += width;
+        dst += vdb_width;
+    }
+    return ESP_OK;
+}
+
 esp_err_t g_draw_char(g_coord_t x, g_coord_t y, char character, g_color_t color) {
     const uint8_t* glyph = &_g_font->glyphs[(character - _g_font->ascii_offset) * g_font_glyph_size(_g_font)];
     
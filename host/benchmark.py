@@ -0,0 +1,166 @@
+'''
+Benchmark the drawing primitives of the host build of graphics.c.
+
+Every primitive is drawn repeatedly into a full-screen VDB window, and its
+speed is reported in calls and pixels per second. Pixel counts come from the
+NumPy model of the pipeline (img_utils/graphics_model.py), which writes the
+same pixels as the C code. Images are EBG files made with img_utils (by
+default, a test image converted at several palette sizes) and text is drawn
+with the built-in font, generated with font_utils.
+'''
+import os
+import sys
+import json
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+
+from graphics import Graphics, G_FILLED, quiet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img_utils'))
+from ebg import EBG, EBGWriter, Palette, Utils
+from graphics_model import Display, Font, hex_to_color
+
+TEXT = "The quick brown fox\njumps over the lazy dog\n0123456789 !?@#$%&"
+
+
+def test_image(width, height):
+    '''
+        Test BGR image with gradients and shapes, so every palette size has colors to spare
+    '''
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([x * 255 // max(width - 1, 1), y * 255 // max(height - 1, 1),
+                    (x + y) * 255 // max(width + height - 2, 1)], axis=-1).astype(np.uint8)
+    img[(x - width // 2) ** 2 + (y - height // 2) ** 2 < (min(width, height) // 3) ** 2] = (40, 40, 200)
+    return img
+
+def make_images(directory, width, height):
+    '''
+        Convert the test image to EBG files: packed 1, 2 and 4-bit indices, byte indices,
+        transparent and RGB565 pixels
+    '''
+    img = test_image(width, height)
+    images = {}
+    for name, k, transparent in [('1-bit', 2, None), ('2-bit', 4, None), ('4-bit', 16, None),
+                                 ('8-bit', 64, None), ('4-bit transparent', 16, (40, 40, 200))]:
+        palette = Palette.from_img(img, k, transparent_color=None if transparent is None else transparent[::-1])
+        filename = os.path.join(directory, f"{name.replace(' ', '_')}.ebg")
+        with EBGWriter(filename, width, height, palette=palette) as writer:
+            writer.write_frame(palette.quantize(img))
+        images[name] = filename
+
+    filename = os.path.join(directory, 'rgb565.ebg')
+    with EBGWriter(filename, width, height) as writer:
+        writer.write_frame(Utils.bgr_to_rgb565(img))
+    images['rgb565'] = filename
+    return images
+
+def cases(width, height, images, font):
+    '''
+        (name, draw function) pairs. Draw functions take a Graphics or a graphics_model Display,
+        and the image to draw for image cases
+    '''
+    color = hex_to_color(0xF800)
+    glyph = font.glyph(ord('W'))
+    cx, cy = width // 2, height // 2
+    r = min(width, height) // 3
+    polygon = [(cx, cy - r), (cx + r, cy - r // 3), (cx + r // 2, cy + r), (cx - r // 2, cy + r), (cx - r, cy - r // 3)]
+    mono = np.tile(np.array([0xAA, 0x55], dtype=np.uint8), 8 * 64)
+    palette = np.array([hex_to_color(c) for c in (0x0000, 0xF800, 0x07E0, 0x001F)], dtype=np.uint16)
+    indices = np.tile(np.arange(4, dtype=np.uint8), 64 * 16)
+    packed = Utils.pack_indices(indices.reshape((64, 64)), 2)
+
+    primitives = [
+        ('pixel', lambda g, _: g.draw_pixel(cx, cy, color)),
+        ('rect filled', lambda g, _: g.draw_rect((0, 0, width - 1, height - 1), color, G_FILLED)),
+        ('rect outline', lambda g, _: g.draw_rect((10, 10, width - 11, height - 11), color, 1)),
+        ('hline', lambda g, _: g.draw_hline(0, cy, width, color, 1)),
+        ('vline', lambda g, _: g.draw_vline(cx, 0, height, color, 1)),
+        ('line', lambda g, _: g.draw_line(0, 0, width - 1, height - 1, color, 1)),
+        ('line thick', lambda g, _: g.draw_line(0, cy, width - 1, cy, color, 5)),
+        ('circle filled', lambda g, _: g.draw_circle(cx, cy, r, color, G_FILLED)),
+        ('circle outline', lambda g, _: g.draw_circle(cx, cy, r, color, 1)),
+        ('polygon filled', lambda g, _: g.draw_polygon(polygon, color, G_FILLED)),
+        ('polygon outline', lambda g, _: g.draw_polygon(polygon, color, 1)),
+        ('bitmap mono 128x64', lambda g, _: g.draw_bitmap_mono(0, 0, mono, 128, 64, color)),
+        ('bitmap palette 64x64', lambda g, _: g.draw_bitmap_palette(0, 0, indices, 64, 64, palette)),
+        ('bitmap packed 64x64', lambda g, _: g.draw_bitmap_palette_packed(0, 0, packed, 64, 64, 2, palette)),
+        ('char', lambda g, _: g.draw_bitmap_mono(cx, cy, glyph, font.width, font.height, color)),
+        ('string', lambda g, _: g.draw_string(0, 0, TEXT, color)),
+    ]
+    return primitives + [(f"img {name}", lambda g, img: g.draw_img(0, 0, img)) for name in images]
+
+def model_pixels(width, height, draw, img):
+    '''
+        Pixels written by a draw function, measured on the model with a full-screen VDB
+    '''
+    model = Display(width, height)
+    model.vdb.region = (0, 0, width - 1, height - 1)
+    draw(model, img)
+    return model.pixels_touched
+
+def benchmark(graphics, draw, img, min_time):
+    '''
+        Calls per second of a draw function, repeated within a single VDB window
+    '''
+    region = (0, 0, graphics.width - 1, graphics.height - 1)
+    calls = 1
+    while True:
+        elapsed = []
+        def window(_):
+            start = time.perf_counter()
+            for i in range(calls):
+                draw(graphics, img)
+            elapsed.append(time.perf_counter() - start)
+
+        graphics.refresh_region(region, window)
+        if sum(elapsed) >= min_time:
+            return calls / sum(elapsed)
+        calls *= 2 if sum(elapsed) < min_time / 10 else max(2, int(min_time / max(sum(elapsed), 1e-9)) + 1)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark graphics.c drawing primitives on the host build")
+    parser.add_argument('images', nargs='*', type=str,
+                        help="EBG images to draw. Default: a test image converted at several palette sizes")
+    parser.add_argument('-l', '--library', type=str, default=None, help="Host library. Default: build/libgraphics.so")
+    parser.add_argument('-t', '--min-time', type=float, default=0.2,
+                        help="Minimum time measured for each primitive, in seconds. Default: 0.2")
+    parser.add_argument('--font', type=str, default=os.path.join('..', 'fonts', 'base.h'),
+                        help="Font compiled in the library, to count pixels. Default: ../fonts/base.h")
+    parser.add_argument('-o', '--output', type=str, default=None, help="Save the results as JSON")
+    args = parser.parse_args()
+
+    graphics = Graphics(args.library) if args.library else Graphics()
+    if graphics.vdb_size < graphics.width * graphics.height:
+        parser.error("Benchmark requires a full-screen VDB (VDB_SIZE=0)")
+    font = Font.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), args.font)
+                     if not os.path.isabs(args.font) else args.font)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.images:
+            images = {os.path.splitext(os.path.basename(f))[0]: f for f in args.images}
+        else:
+            images = make_images(directory, min(graphics.width, 160), min(graphics.height, 120))
+        loaded = {name: (graphics.img_open(f), EBG.load(f)) for name, f in images.items()}
+
+        results = {}
+        print(f"Display {graphics.width}x{graphics.height}, VDB {graphics.vdb_size} pixels")
+        print(f"{'Primitive':28s} {'Calls/s':>12s} {'Pixels':>8s} {'Mpixels/s':>10s}")
+        for name, draw in cases(graphics.width, graphics.height, images, font):
+            c_img, model_img = loaded.get(name[4:], (None, None)) if name.startswith('img ') else (None, None)
+            pixels = model_pixels(graphics.width, graphics.height, draw, model_img)
+            with quiet():
+                rate = benchmark(graphics, draw, c_img, args.min_time)
+            results[name] = {'calls_per_second': rate, 'pixels': pixels, 'pixels_per_second': rate * pixels}
+            print(f"{name:28s} {rate:12.0f} {pixels:8d} {rate * pixels / 1e6:10.2f}")
+
+        for c_img, _ in loaded.values():
+            c_img.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'width': graphics.width, 'height': graphics.height, 'vdb_size': graphics.vdb_size,
+                       'results': results}, f, indent=4)
@@ -0,0 +1,42 @@
+#include "display_driver.h"
+#include "img.h"
+
+// Memory-backed display: flushed VDB regions are copied to a frame buffer, and transfers are counted
+static color16_t _frame_buffer[DISP_HEIGHT][DISP_WIDTH];
+static uint32_t _flushes = 0;
+static uint64_t _bytes_sent = 0;
+
+esp_err_t display_init() {
+    memset(_frame_buffer, 0, sizeof(_frame_buffer));
+    return ESP_OK;
+}
+
+void display_send_color16(int x0, int y0, int x1, int y1, color16_t* buf, size_t len) {
+    _flushes++;
+    _bytes_sent += len * sizeof(color16_t);
+
+    // Pixels outside the screen are sent, but don't show up
+    for(int y = y0; y <= y1; y++) {
+        for(int x = x0; x <= x1; x++, buf++) {
+            if(x >= 0 && y >= 0 && x < DISP_WIDTH && y < DISP_HEIGHT)
+                _frame_buffer[y][x] = *buf;
+        }
+    }
+}
+
+// Accessors for the ctypes wrapper (host/graphics.py)
+uint16_t host_display_width() { return DISP_WIDTH; }
+uint16_t host_display_height() { return DISP_HEIGHT; }
+size_t host_vdb_size() { return VDB_SIZE; }
+const color16_t* host_display_buffer() { return &_frame_buffer[0][0]; }
+uint32_t host_display_flushes() { return _flushes; }
+uint64_t host_display_bytes_sent() { return _bytes_sent; }
+
+void host_display_reset_counters() {
+    _flushes = 0;
+    _bytes_sent = 0;
+}
+
+const g_img_header_t* host_img_header(const g_img_t* img) { return &img->header; }
+uint16_t host_img_current_frame(const g_img_t* img) { return img->current_frame; }
+uint16_t host_pack_count(const g_img_pack_t* pack) { return pack->count; }
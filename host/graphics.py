@@ -0,0 +1,356 @@
+'''
+ctypes bindings of the host build of graphics.c and img.c (see Makefile).
+
+The library has a single display, so a process should only create one
+Graphics instance. Method names and arguments follow img_utils/graphics_model.py,
+so the same drawing code runs on the C library and on the NumPy model.
+'''
+import os
+import sys
+import ctypes
+import contextlib
+from ctypes import c_bool, c_char_p, c_float, c_int, c_int16, c_int32, c_size_t, c_uint8, c_uint16, c_uint32, c_uint64, c_void_p, POINTER
+
+import numpy as np
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LIBRARY = os.path.join(HOST_DIR, 'build', 'libgraphics.so')
+G_FILLED = 0
+G_IMG_MAX_DIRTY_REGIONS = 8
+
+
+class Region(ctypes.Structure):
+    _fields_ = [('x0', c_int16), ('y0', c_int16), ('x1', c_int16), ('y1', c_int16)]
+
+
+class Point(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [('x', c_float), ('y', c_float)]
+
+
+class ImgHeader(ctypes.Structure):
+    _fields_ = [('width', c_uint16), ('height', c_uint16), ('flags', c_uint8), ('palette_size', c_uint8),
+                ('transparent_index', c_uint8), ('frame_count', c_uint16)]
+
+
+DRAW_CALLBACK = ctypes.CFUNCTYPE(None, POINTER(Region))
+
+# Argument and return types of the library functions
+_FUNCTIONS = {
+    'g_init': ([], c_int),
+    'g_refresh_region': ([POINTER(Region), DRAW_CALLBACK], c_int),
+    'g_vdb_flush': ([], c_int),
+    'g_draw_pixel': ([c_int16, c_int16, c_uint16], c_int),
+    'g_draw_rect': ([POINTER(Region), c_uint16, c_uint16], c_int),
+    'g_draw_hline': ([c_int16, c_int16, c_uint16, c_uint16, c_uint16], c_int),
+    'g_draw_vline': ([c_int16, c_int16, c_uint16, c_uint16, c_uint16], c_int),
+    'g_draw_line': ([c_int16, c_int16, c_int16, c_int16, c_uint16, c_uint16], c_int),
+    'g_draw_circle': ([c_int16, c_int16, c_uint16, c_uint16, c_uint16], c_int),
+    'g_draw_polygon': ([POINTER(Point), c_uint16, c_uint16, c_uint16], None),
+    'g_draw_bitmap_mono': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16, c_uint16], c_int),
+    'g_draw_bitmap_palette': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16, c_void_p], c_int),
+    'g_draw_bitmap_palette_transparent': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16, c_void_p, c_uint8], c_int),
+    'g_draw_bitmap_palette_packed': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16, c_uint8, c_void_p], c_int),
+    'g_draw_bitmap_palette_packed_transparent': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16, c_uint8, c_void_p, c_uint8], c_int),
+    'g_draw_bitmap_rgb565': ([c_int16, c_int16, c_void_p, c_uint16, c_uint16], c_int),
+    'g_draw_char': ([c_int16, c_int16, ctypes.c_char, c_uint16], c_int),
+    'g_draw_string': ([c_int16, c_int16, c_char_p, c_uint16], c_int),
+    'g_img_open': ([c_char_p], c_void_p),
+    'g_img_from_memory': ([c_void_p, c_size_t], c_void_p),
+    'g_img_close': ([c_void_p], None),
+    'g_img_load_next': ([c_void_p], None),
+    'g_img_load_prev': ([c_void_p], None),
+    'g_img_load_first': ([c_void_p], None),
+    'g_img_load_frame': ([c_void_p, c_uint16], c_int),
+    'g_img_draw': ([c_int16, c_int16, c_void_p], c_int),
+    'g_img_frame_size': ([c_void_p], c_size_t),
+    'g_img_dirty_regions': ([c_void_p, c_int16, c_int16, POINTER(Region)], c_uint8),
+    'g_img_pack_open': ([c_char_p], c_void_p),
+    'g_img_pack_close': ([c_void_p], None),
+    'g_img_pack_hash': ([c_char_p], c_uint32),
+    'g_img_pack_find': ([c_void_p, c_char_p], c_int32),
+    'g_img_pack_get': ([c_void_p, c_uint16], c_void_p),
+    'host_display_width': ([], c_uint16),
+    'host_display_height': ([], c_uint16),
+    'host_vdb_size': ([], c_size_t),
+    'host_display_buffer': ([], POINTER(c_uint16)),
+    'host_display_flushes': ([], c_uint32),
+    'host_display_bytes_sent': ([], c_uint64),
+    'host_display_reset_counters': ([], None),
+    'host_img_header': ([c_void_p], POINTER(ImgHeader)),
+    'host_img_current_frame': ([c_void_p], c_uint16),
+    'host_pack_count': ([c_void_p], c_uint16),
+}
+
+
+@contextlib.contextmanager
+def quiet():
+    '''
+        Silence the library log output (img.c prints every frame it reads)
+    '''
+    libc = ctypes.CDLL(None)
+    sys.stdout.flush()
+    libc.fflush(None)
+    stdout = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        libc.fflush(None)
+        os.dup2(stdout, 1)
+        os.close(stdout)
+
+
+def _buffer(data, dtype):
+    # Contiguous array of the given type, kept alive by the caller while the library uses it
+    return np.ascontiguousarray(data, dtype=dtype)
+
+
+class Image:
+    '''
+        EBG image opened by the library (g_img_t)
+    '''
+    def __init__(self, lib, handle, data=None):
+        self._lib = lib
+        self.handle = handle
+        self._data = data   # Memory images must outlive the handle
+
+    @property
+    def header(self):
+        return self._lib.host_img_header(self.handle).contents
+
+    @property
+    def width(self):
+        return self.header.width
+
+    @property
+    def height(self):
+        return self.header.height
+
+    def __len__(self):
+        return self.header.frame_count
+
+    @property
+    def current_frame(self):
+        return self._lib.host_img_current_frame(self.handle)
+
+    def load_next(self):
+        self._lib.g_img_load_next(self.handle)
+
+    def load_prev(self):
+        self._lib.g_img_load_prev(self.handle)
+
+    def load_first(self):
+        self._lib.g_img_load_first(self.handle)
+
+    def load_frame(self, frame):
+        if self._lib.g_img_load_frame(self.handle, frame) != 0:
+            raise IndexError(f"Can't load frame {frame}")
+
+    def dirty_regions(self, x=0, y=0):
+        '''
+            Regions (x0, y0, x1, y1) changed by the last loaded frame, for the image drawn at (X, Y)
+        '''
+        regions = (Region * G_IMG_MAX_DIRTY_REGIONS)()
+        count = self._lib.g_img_dirty_regions(self.handle, x, y, regions)
+        return [(r.x0, r.y0, r.x1, r.y1) for r in regions[:count]]
+
+    def close(self):
+        if self.handle:
+            self._lib.g_img_close(self.handle)
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Pack:
+    '''
+        EBG pack opened by the library (g_img_pack_t). Its images must be closed before the pack
+    '''
+    def __init__(self, lib, handle):
+        self._lib = lib
+        self.handle = handle
+
+    def __len__(self):
+        return self._lib.host_pack_count(self.handle)
+
+    def find(self, name):
+        '''
+            Index of the entry called NAME
+        '''
+        index = self._lib.g_img_pack_find(self.handle, name.encode('utf-8'))
+        if index < 0:
+            raise KeyError(name)
+        return index
+
+    def get(self, index):
+        '''
+            Image of an entry, loading its first frame
+        '''
+        with quiet():
+            handle = self._lib.g_img_pack_get(self.handle, index)
+        if not handle:
+            raise ValueError(f"Unable to open pack entry {index}")
+        return Image(self._lib, handle)
+
+    def close(self):
+        if self.handle:
+            self._lib.g_img_pack_close(self.handle)
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Graphics:
+    '''
+        Display of the host library. Colors are g_color_t values, as in graphics.c
+    '''
+    def __init__(self, library=DEFAULT_LIBRARY):
+        if not os.path.isfile(library):
+            raise FileNotFoundError(f"Library '{library}' not found, build it with 'make -C {HOST_DIR}'")
+
+        self.lib = ctypes.CDLL(library)
+        for name, (argtypes, restype) in _FUNCTIONS.items():
+            function = getattr(self.lib, name)
+            function.argtypes = argtypes
+            function.restype = restype
+
+        self.width = self.lib.host_display_width()
+        self.height = self.lib.host_display_height()
+        self.vdb_size = self.lib.host_vdb_size()
+        if self.lib.g_init() != 0:
+            raise MemoryError("Unable to initialize graphics")
+
+    @property
+    def screen(self):
+        '''
+            Copy of the display contents, as a (height, width) array
+        '''
+        buffer = np.ctypeslib.as_array(self.lib.host_display_buffer(), shape=(self.height, self.width))
+        return buffer.copy()
+
+    @property
+    def flushes(self):
+        return self.lib.host_display_flushes()
+
+    @property
+    def bytes_sent(self):
+        return self.lib.host_display_bytes_sent()
+
+    def reset_counters(self):
+        self.lib.host_display_reset_counters()
+
+    def refresh_region(self, region, draw_cb):
+        '''
+            Redraw REGION (x0, y0, x1, y1), calling DRAW_CB(region) for every VDB window
+        '''
+        callback = DRAW_CALLBACK(lambda r: draw_cb((r.contents.x0, r.contents.y0, r.contents.x1, r.contents.y1)))
+        self.lib.g_refresh_region(ctypes.byref(Region(*region)), callback)
+
+    def vdb_flush(self):
+        self.lib.g_vdb_flush()
+
+    def draw_pixel(self, x, y, color):
+        self.lib.g_draw_pixel(x, y, color)
+
+    def draw_rect(self, region, color, thickness=G_FILLED):
+        self.lib.g_draw_rect(ctypes.byref(Region(*region)), color, thickness)
+
+    def draw_hline(self, x, y, width, color, thickness=1):
+        self.lib.g_draw_hline(x, y, width, color, thickness)
+
+    def draw_vline(self, x, y, height, color, thickness=1):
+        self.lib.g_draw_vline(x, y, height, color, thickness)
+
+    def draw_line(self, x0, y0, x1, y1, color, thickness=1):
+        self.lib.g_draw_line(x0, y0, x1, y1, color, thickness)
+
+    def draw_circle(self, cx, cy, r, color, thickness=G_FILLED):
+        self.lib.g_draw_circle(cx, cy, r, color, thickness)
+
+    def draw_polygon(self, points, color, thickness=G_FILLED):
+        points = (Point * len(points))(*(Point(x, y) for x, y in points))
+        self.lib.g_draw_polygon(points, len(points), color, thickness)
+
+    def draw_bitmap_mono(self, x, y, bitmap, width, height, color):
+        bitmap = _buffer(bitmap, np.uint8)
+        self.lib.g_draw_bitmap_mono(x, y, bitmap.ctypes.data, width, height, color)
+
+    def draw_bitmap_palette(self, x, y, bitmap, width, height, palette):
+        bitmap, palette = _buffer(bitmap, np.uint8), _buffer(palette, np.uint16)
+        self.lib.g_draw_bitmap_palette(x, y, bitmap.ctypes.data, width, height, palette.ctypes.data)
+
+    def draw_bitmap_palette_transparent(self, x, y, bitmap, width, height, palette, transparent_index):
+        bitmap, palette = _buffer(bitmap, np.uint8), _buffer(palette, np.uint16)
+        self.lib.g_draw_bitmap_palette_transparent(x, y, bitmap.ctypes.data, width, height, palette.ctypes.data,
+                                                   transparent_index)
+
+    def draw_bitmap_palette_packed(self, x, y, bitmap, width, height, bits, palette):
+        bitmap, palette = _buffer(bitmap, np.uint8), _buffer(palette, np.uint16)
+        self.lib.g_draw_bitmap_palette_packed(x, y, bitmap.ctypes.data, width, height, bits, palette.ctypes.data)
+
+    def draw_bitmap_palette_packed_transparent(self, x, y, bitmap, width, height, bits, palette, transparent_index):
+        bitmap, palette = _buffer(bitmap, np.uint8), _buffer(palette, np.uint16)
+        self.lib.g_draw_bitmap_palette_packed_transparent(x, y, bitmap.ctypes.data, width, height, bits,
+                                                          palette.ctypes.data, transparent_index)
+
+    def draw_bitmap_rgb565(self, x, y, bitmap, width, height):
+        bitmap = _buffer(bitmap, np.uint16)
+        self.lib.g_draw_bitmap_rgb565(x, y, bitmap.ctypes.data, width, height)
+
+    def draw_char(self, x, y, character, color):
+        if isinstance(character, str):
+            character = ord(character)
+        self.lib.g_draw_char(x, y, bytes([character]), color)
+
+    def draw_string(self, x, y, string, color):
+        self.lib.g_draw_string(x, y, string.encode('latin-1', 'replace'), color)
+
+    def img_open(self, filename):
+        '''
+            Open an EBG file, loading its first frame
+        '''
+        with quiet():
+            handle = self.lib.g_img_open(os.fsencode(filename))
+        if not handle:
+            raise ValueError(f"Unable to open image '{filename}'")
+        return Image(self.lib, handle)
+
+    def img_from_memory(self, data):
+        '''
+            Image from the contents of an EBG file
+        '''
+        data = _buffer(np.frombuffer(data, dtype=np.uint8), np.uint8)
+        with quiet():
+            handle = self.lib.g_img_from_memory(data.ctypes.data, len(data))
+        if not handle:
+            raise ValueError("Invalid EBG image")
+        return Image(self.lib, handle, data)
+
+    def img_pack_open(self, filename):
+        '''
+            Open a pack of EBG images (ebgpack.py)
+        '''
+        with quiet():
+            handle = self.lib.g_img_pack_open(os.fsencode(filename))
+        if not handle:
+            raise ValueError(f"Unable to open pack '{filename}'")
+        return Pack(self.lib, handle)
+
+    def img_pack_hash(self, name):
+        return self.lib.g_img_pack_hash(name.encode('utf-8'))
+
+    def draw_img(self, x, y, img):
+        '''
+            Draw the current frame of an image
+        '''
+        self.lib.g_img_draw(x, y, img.handle)
@@ -0,0 +1,36 @@
+#pragma once
+
+// Host stub of the display_driver component and the ESP-IDF definitions it brings in.
+// Pixels are sent to a frame buffer in memory (host/display.c)
+
+#include <stdint.h>
+#include <stdbool.h>
+#include <stddef.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdio.h>
+#include <unistd.h>
+
+#ifndef DISP_WIDTH
+#define DISP_WIDTH 320
+#endif
+#ifndef DISP_HEIGHT
+#define DISP_HEIGHT 240
+#endif
+
+typedef int esp_err_t;
+#define ESP_OK 0
+#define ESP_FAIL -1
+#define ESP_ERR_NO_MEM 0x101
+#define ESP_ERR_INVALID_ARG 0x102
+#define ESP_ERR_NOT_SUPPORTED 0x106
+
+#define ESP_LOGI(tag, fmt, ...) printf(fmt "\n", ##__VA_ARGS__)
+
+#define MALLOC_CAP_DMA 0
+#define heap_caps_malloc(size, caps) malloc(size)
+
+typedef uint16_t color16_t;
+
+esp_err_t display_init();
+void display_send_color16(int x0, int y0, int x1, int y1, color16_t* buf, size_t len);
@@ -0,0 +1,5 @@
+#pragma once
+
+// Files are read through the host libc
+#include <fcntl.h>
+#include <unistd.h>
@@ -0,0 +1,5 @@
+#pragma once
+
+#ifndef CONFIG_G_VDB_SIZE
+#define CONFIG_G_VDB_SIZE 0
+#endif
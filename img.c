@@ -4,9 +4,296 @@
 #include <esp_vfs.h>
 
 #define SIGNATURE_SIZE 4
-#define HEADER_SIZE 8
-#define PALETTE_OFFSET (SIGNATURE_SIZE + HEADER_SIZE)
-#define PALETTE_SIZE(img) ((img->header.flags & G_IMG_FLAG_INDEXED) ? (sizeof(g_color_t) * (img->header.palette_size + 1)) : 0)
+#define HEADER_V1_SIZE 8
+#define HEADER_V2_SIZE 16
+
+#define PACK_HEADER_SIZE 12
+#define PACK_VERSION 1
+
+#define READ_BUFFER_SIZE 64
+#define LZ_MIN_MATCH 3
+
+// Images are read from a file or straight from memory (e.g. a const array in flash). Files are read at
+// the image's own position, so images from a pack can share the pack file
+static ssize_t _source_read(g_img_t* img, void* dst, size_t size) {
+    if(!img->data) {
+        ssize_t read_bytes = pread(img->fd, dst, size, img->base + img->pos);
+        if(read_bytes > 0) img->pos += read_bytes;
+        return read_bytes;
+    }
+
+    if(size > img->data_size - img->pos) size = img->data_size - img->pos;
+    memcpy(dst, &img->data[img->pos], size);
+    img->pos += size;
+    return size;
+}
+
+static off_t _source_seek(g_img_t* img, off_t offset, int whence) {
+    if(whence == SEEK_CUR) offset += img->pos;
+    if(offset < 0 || (img->data && offset > img->data_size)) return -1;
+    img->pos = offset;
+    return offset;
+}
+
+// Next SIZE bytes of an image in memory, without copying them
+static const uint8_t* _source_map(g_img_t* img, size_t size) {
+    if(size > img->data_size - img->pos) return NULL;
+
+    const uint8_t* data = &img->data[img->pos];
+    img->pos += size;
+    return data;
+}
+
+typedef struct {
+    g_img_t* img;
+    size_t remaining;   // Payload bytes not read from the source yet
+    size_t pos;
+    size_t len;
+    const uint8_t* chunk;
+    uint8_t buf[READ_BUFFER_SIZE];
+} _payload_reader_t;
+
+static bool _payload_fill(_payload_reader_t* reader) {
+    if(reader->remaining == 0) return false;
+
+    if(reader->img->data) {
+        // Payloads in memory are read in place
+        if(!(reader->chunk = _source_map(reader->img, reader->remaining))) return false;
+        reader->len = reader->remaining;
+    } else {
+        ssize_t read_bytes = _source_read(reader->img, reader->buf, reader->remaining < READ_BUFFER_SIZE ? reader->remaining : READ_BUFFER_SIZE);
+        if(read_bytes <= 0) return false;
+        reader->chunk = reader->buf;
+        reader->len = read_bytes;
+    }
+
+    reader->remaining -= reader->len;
+    reader->pos = 0;
+    return true;
+}
+
+static int _payload_read_byte(_payload_reader_t* reader) {
+    if(reader->pos == reader->len && !_payload_fill(reader)) return -1;
+    return reader->chunk[reader->pos++];
+}
+
+static size_t _payload_read(_payload_reader_t* reader, uint8_t* dst, size_t size) {
+    size_t done = 0;
+    while(done < size) {
+        if(reader->pos == reader->len && !_payload_fill(reader)) break;
+
+        size_t chunk = reader->len - reader->pos;
+        if(chunk > size - done) chunk = size - done;
+        memcpy(&dst[done], &reader->chunk[reader->pos], chunk);
+        reader->pos += chunk;
+        done += chunk;
+    }
+    return done;
+}
+
+static void _set_dirty_full(g_img_t* img) {
+    img->dirty[0] = (g_region_t){ .x0 = 0, .y0 = 0, .x1 = img->header.width - 1, .y1 = img->header.height - 1 };
+    img->dirty_count = 1;
+}
+
+static void _add_dirty(g_img_t* img, g_coord_t x0, g_coord_t y0, g_coord_t x1, g_coord_t y1) {
+    if(img->dirty_count < G_IMG_MAX_DIRTY_REGIONS) {
+        img->dirty[img->dirty_count++] = (g_region_t){ .x0 = x0, .y0 = y0, .x1 = x1, .y1 = y1 };
+        return;
+    }
+
+    // Out of regions: grow the last one to cover the new one
+    g_region_t* last = &img->dirty[G_IMG_MAX_DIRTY_REGIONS - 1];
+    if(x0 < last->x0) last->x0 = x0;
+    if(y0 < last->y0) last->y0 = y0;
+    if(x1 > last->x1) last->x1 = x1;
+    if(y1 > last->y1) last->y1 = y1;
+}
+
+static ssize_t _decode_rle(_payload_reader_t* reader, uint8_t* bitmap, size_t frame_size) {
+    size_t out = 0;
+    int count, value;
+    while(out < frame_size) {
+        // (count, value) pairs
+        if((count = _payload_read_byte(reader)) < 0 || (value = _payload_read_byte(reader)) < 0) break;
+        if(out + count > frame_size) break;
+
+        memset(&bitmap[out], value, count);
+        out += count;
+    }
+    return out;
+}
+
+static ssize_t _decode_lz(_payload_reader_t* reader, uint8_t* bitmap, size_t frame_size) {
+    size_t out = 0;
+    int flags, b0, b1;
+    while(out < frame_size) {
+        // Each flags byte describes up to 8 tokens, LSB first (1: match, 0: literal)
+        if((flags = _payload_read_byte(reader)) < 0) return out;
+
+        for(uint8_t bit = 0; bit < 8 && out < frame_size; bit++) {
+            if(flags & (1 << bit)) {
+                if((b0 = _payload_read_byte(reader)) < 0 || (b1 = _payload_read_byte(reader)) < 0) return out;
+
+                // Match copied from already decoded data: 12-bit offset - 1, 4-bit length - 3
+                size_t offset = (b0 | ((b1 >> 4) << 8)) + 1;
+                size_t length = (b1 & 0x0F) + LZ_MIN_MATCH;
+                if(offset > out || out + length > frame_size) return out;
+
+                // Byte by byte, since source and destination may overlap
+                for(size_t i = 0; i < length; i++, out++)
+                    bitmap[out] = bitmap[out - offset];
+            } else {
+                if((b0 = _payload_read_byte(reader)) < 0) return out;
+                bitmap[out++] = b0;
+            }
+        }
+    }
+    return out;
+}
+
+static ssize_t _decode_delta(_payload_reader_t* reader, g_img_t* img) {
+    uint8_t bits = g_img_pixel_bits(img);
+    size_t row_size = (img->header.width * bits + 7) / 8;
+    size_t out = 0;
+
+    uint16_t count;
+    if(_payload_read(reader, (uint8_t*)&count, sizeof(count)) != sizeof(count)) return -1;
+
+    img->dirty_count = 0;
+    for(uint16_t i = 0; i < count; i++) {
+        // Rectangle in pixels (x, y, width, height), followed by the stored bytes of its rows
+        uint16_t rect[4];
+        if(_payload_read(reader, (uint8_t*)rect, sizeof(rect)) != sizeof(rect)) return -1;
+        if(rect[2] == 0 || rect[3] == 0 || rect[0] + rect[2] > img->header.width || rect[1] + rect[3] > img->header.height) return -1;
+
+        size_t start = (rect[0] * bits) / 8;
+        size_t length = ((rect[0] + rect[2]) * bits + 7) / 8 - start;
+        for(uint16_t row = rect[1]; row < rect[1] + rect[3]; row++) {
+            if(_payload_read(reader, &img->bitmap[row * row_size + start], length) != length) return -1;
+            out += length;
+        }
+
+        _add_dirty(img, rect[0], rect[1], rect[0] + rect[2] - 1, rect[1] + rect[3] - 1);
+    }
+    return out;
+}
+
+static uint8_t* _frame_buffer(g_img_t* img, bool keep_bitmap) {
+    // Decoded frames go to the frame buffer, which is only needed for images in memory if their frames are not raw
+    size_t frame_size = g_img_frame_size(img);
+    if(!img->buffer && !(img->buffer = malloc(frame_size))) return NULL;
+
+    // Delta frames are applied on top of the current bitmap
+    if(keep_bitmap && img->bitmap && img->bitmap != img->buffer) memcpy(img->buffer, img->bitmap, frame_size);
+    img->bitmap = img->buffer;
+    return img->buffer;
+}
+
+static ssize_t _read_raw_frame(g_img_t* img, size_t frame_size) {
+    _set_dirty_full(img);
+
+    // Raw frames in memory are used in place. RGB565 pixels must be 2-byte aligned
+    if(img->data && (g_img_pixel_bits(img) != 16 || ((uintptr_t)&img->data[img->pos] & 1) == 0)) {
+        const uint8_t* bitmap = _source_map(img, frame_size);
+        if(!bitmap) return -1;
+        img->bitmap = (uint8_t*)bitmap;
+        return frame_size;
+    }
+
+    if(!_frame_buffer(img, false)) return -1;
+    return _source_read(img, img->bitmap, frame_size);
+}
+
+static ssize_t _read_frame(g_img_t* img) {
+    size_t frame_size = g_img_frame_size(img);
+    if(!(img->header.flags & G_IMG_FLAG_ENCODED))
+        return _read_raw_frame(img, frame_size);
+
+    g_img_frame_header_t frame_header;
+    if(_source_read(img, &frame_header, sizeof(g_img_frame_header_t)) != sizeof(g_img_frame_header_t)) return -1;
+
+    frame_header.encoding &= G_IMG_ENCODING_MASK;
+    if(frame_header.encoding == G_IMG_ENCODING_RAW) {
+        if(frame_header.size != frame_size) return -1;
+        return _read_raw_frame(img, frame_size);
+    }
+
+    // Compressed frames are decoded straight into the frame buffer. Delta frames update it in place
+    if(!_frame_buffer(img, frame_header.encoding == G_IMG_ENCODING_DELTA)) return -1;
+    _payload_reader_t reader = { .img = img, .remaining = frame_header.size, .pos = 0, .len = 0 };
+    ssize_t decoded_bytes;
+    switch(frame_header.encoding) {
+        case G_IMG_ENCODING_RLE:
+            decoded_bytes = _decode_rle(&reader, img->bitmap, frame_size);
+            _set_dirty_full(img);
+            break;
+        case G_IMG_ENCODING_LZ:
+            decoded_bytes = _decode_lz(&reader, img->bitmap, frame_size);
+            _set_dirty_full(img);
+            break;
+        case G_IMG_ENCODING_DELTA:
+            decoded_bytes = _decode_delta(&reader, img);
+            break;
+        default:
+            decoded_bytes = -1;
+            break;
+    }
+
+    // Leave the source at the start of the next frame
+    if(reader.remaining > 0) _source_seek(img, reader.remaining, SEEK_CUR);
+    return decoded_bytes;
+}
+
+static bool _seek_frame(g_img_t* img, uint16_t frame) {
+    if(img->version == 1) {
+        // Only raw frames can be located without reading the previous ones
+        if(img->header.flags & G_IMG_FLAG_ENCODED) return false;
+        return _source_seek(img, img->bitmap_offset + (off_t)frame * g_img_frame_size(img), SEEK_SET) >= 0;
+    }
+
+    uint32_t offset;
+    if(_source_seek(img, img->frame_table_offset + (off_t)frame * sizeof(offset), SEEK_SET) < 0) return false;
+    if(_source_read(img, &offset, sizeof(offset)) != sizeof(offset)) return false;
+    return _source_seek(img, offset, SEEK_SET) >= 0;
+}
+
+static bool _is_delta_frame(g_img_t* img, uint16_t frame) {
+    uint8_t encoding;
+    if(img->version == 1 || !_seek_frame(img, frame)) return false;
+    if(_source_read(img, &encoding, sizeof(encoding)) != sizeof(encoding)) return false;
+    return (encoding & G_IMG_ENCODING_MASK) == G_IMG_ENCODING_DELTA;
+}
+
+uint8_t g_img_index_bits(const g_img_t* img) {
+    if(!(img->header.flags & G_IMG_FLAG_INDEXED)) return 0;
+    if((img->header.flags & G_IMG_FLAG_INDEXSIZE) == G_IMG_INDEXSIZE_BYTE) return 8;
+
+    // Packed indices use the smallest size that fits the palette: 1, 2 or 4 bits
+    if(img->header.palette_size < 2) return 1;
+    if(img->header.palette_size < 4) return 2;
+    return 4;
+}
+
+uint8_t g_img_pixel_bits(const g_img_t* img) {
+    if(img->header.flags & G_IMG_FLAG_INDEXED) return g_img_index_bits(img);
+    if((img->header.flags & G_IMG_FLAG_COLORMODE) == G_IMG_COLORMODE_RGB565) return 16;
+    return 0;
+}
+
+size_t g_img_frame_size(const g_img_t* img) {
+    return ((img->header.width * g_img_pixel_bits(img) + 7) / 8) * img->header.height;
+}
+
+uint8_t g_img_dirty_regions(const g_img_t* img, g_coord_t x, g_coord_t y, g_region_t* regions) {
+    for(uint8_t i = 0; i < img->dirty_count; i++) {
+        regions[i].x0 = x + img->dirty[i].x0;
+        regions[i].y0 = y + img->dirty[i].y0;
+        regions[i].x1 = x + img->dirty[i].x1;
+        regions[i].y1 = y + img->dirty[i].y1;
+    }
+    return img->dirty_count;
+}
 
 const char* colormode2str(g_img_colormode_t colormode) {
     switch(colormode) {
@@ -23,31 +310,61 @@ const char* colormode2str(g_img_colormode_t colormode) {
     }
 }
 
-g_img_t* g_img_open(const char* filename) {
+static g_img_t* _img_new() {
     g_img_t* img = malloc(sizeof(g_img_t));
     if(!img) return NULL;
-    img->bitmap = NULL;
 
-    img->fd = open(filename, O_RDONLY, 0);
-    if (img->fd == -1) {
-        printf("ERROR: Can't read file\n");
-        goto exit_free;
-    }
+    img->fd = -1;
+    img->fd_owned = false;
+    img->base = 0;
+    img->data = NULL;
+    img->data_size = 0;
+    img->pos = 0;
+    img->palette = NULL;
+    img->palette_owned = false;
+    img->bitmap = NULL;
+    img->buffer = NULL;
+    img->dirty_count = 0;
+    return img;
+}
 
+// Read header and palette, and load the first frame. Images with the shared palette flag use SHARED_PALETTE
+static bool _img_init(g_img_t* img, g_color_t* shared_palette, uint8_t shared_palette_size) {
     ssize_t read_bytes;
 
     char signature[SIGNATURE_SIZE];
-    read_bytes = read(img->fd, signature, SIGNATURE_SIZE);
+    read_bytes = _source_read(img, signature, SIGNATURE_SIZE);
+    if(read_bytes != SIGNATURE_SIZE) return false;
     printf("Reading file: %c%c%c (%d)\n", signature[0], signature[1], signature[2], signature[3]);
-    if(strncmp(signature, "EBG", 3) != 0 || signature[3] != 0x01) goto exit_close;
+    if(strncmp(signature, "EBG", 3) != 0 || (signature[3] != 0x01 && signature[3] != 0x02)) return false;
+    img->version = signature[3];
 
-    read_bytes = read(img->fd, &img->header, sizeof(g_img_header_t));
-    printf("Header size: %d/%d\n", read_bytes, sizeof(g_img_header_t));
+    // Little-endian header: width, height, flags, palette size - 1, transparent index and then
+    // frame count (1 byte) in version 1, or reserved (1 byte), frame count (2 bytes), reserved (2 bytes)
+    // and frame table offset (4 bytes) in version 2
+    uint8_t header[HEADER_V2_SIZE];
+    size_t header_size = img->version == 1 ? HEADER_V1_SIZE : HEADER_V2_SIZE;
+    read_bytes = _source_read(img, header, header_size);
+    printf("Header size: %d/%d\n", read_bytes, header_size);
+    if(read_bytes != header_size) return false;
     for(int i = 0; i < read_bytes; i++) {
-        printf("0x%02X ", ((uint8_t*)img)[i]);
+        printf("0x%02X ", header[i]);
     }
     printf("\n");
 
+    img->header.width = header[0] | (header[1] << 8);
+    img->header.height = header[2] | (header[3] << 8);
+    img->header.flags = header[4];
+    img->header.palette_size = header[5];
+    img->header.transparent_index = header[6];
+    if(img->version == 1) {
+        img->header.frame_count = header[7];
+        img->frame_table_offset = 0;
+    } else {
+        img->header.frame_count = header[8] | (header[9] << 8);
+        img->frame_table_offset = header[12] | (header[13] << 8) | (header[14] << 16) | ((uint32_t)header[15] << 24);
+    }
+
     printf("Width: %d\nHeight: %d\n", img->header.width, img->header.height);
     printf("Flags\n\t- Transparent: %s\n\t- Color mode: %s\n\t- Indexed: %s\n\t- Index size: %s\n",
         (img->header.flags & G_IMG_FLAG_TRANSPARENT) ? "YES": "NO",
@@ -57,14 +374,37 @@ g_img_t* g_img_open(const char* filename) {
     printf("Palette size: %d\n", img->header.palette_size + 1);
     printf("Transparent index: %d\n", img->header.transparent_index);
     printf("Frame count: %d\n", img->header.frame_count);
+    printf("Version: %d\n", img->version);
+
+    if((img->header.flags & G_IMG_FLAG_INDEXED) && (img->header.flags & G_IMG_FLAG_INDEXSIZE) == G_IMG_INDEXSIZE_BIT
+            && img->header.palette_size + 1 > 16) {
+        printf("ERROR: Packed indices require a palette of up to 16 colors\n");
+        return false;
+    }
 
-    // Read palette if required
+    if(g_img_pixel_bits(img) == 0) {
+        printf("ERROR: Unsupported color mode\n");
+        return false;
+    }
+
+    // Read palette if required. Palettes in memory are used in place
     if(img->header.flags & G_IMG_FLAG_INDEXED) {
-        img->palette = malloc((img->header.palette_size + 1) * sizeof(g_color_t));
-        if(!img->palette) {
-            goto exit_close;
+        size_t palette_size = (img->header.palette_size + 1) * sizeof(g_color_t);
+        if(img->header.flags & G_IMG_FLAG_SHARED_PALETTE) {
+            if(!shared_palette || shared_palette_size != img->header.palette_size) {
+                printf("ERROR: Image requires a shared palette of %d colors\n", img->header.palette_size + 1);
+                return false;
+            }
+            img->palette = shared_palette;
+        } else if(img->data) {
+            img->palette = (g_color_t*)_source_map(img, palette_size);
+            if(!img->palette) return false;
+        } else {
+            img->palette = malloc(palette_size);
+            if(!img->palette) return false;
+            img->palette_owned = true;
+            if(_source_read(img, img->palette, palette_size) != palette_size) return false;
         }
-        read(img->fd, img->palette, (img->header.palette_size + 1) * sizeof(g_color_t));
 
         printf("Palette:\n\t");
         for(int i = 0; i < img->header.palette_size + 1; i++) {
@@ -75,10 +415,27 @@ g_img_t* g_img_open(const char* filename) {
     }
 
     // Read first frame
-    img->bitmap = malloc(img->header.width * img->header.height);
-    read_bytes = read(img->fd, img->bitmap, img->header.width * img->header.height);
-    printf("Bitmap read: %d/%d\n", read_bytes, img->header.width * img->header.height);
-    img->current_frame = 1;
+    img->bitmap_offset = _source_seek(img, 0, SEEK_CUR);
+    img->current_frame = 0;
+    return g_img_load_frame(img, 0) == ESP_OK;
+}
+
+g_img_t* g_img_open(const char* filename) {
+    g_img_t* img = _img_new();
+    if(!img) return NULL;
+
+    img->fd = open(filename, O_RDONLY, 0);
+    if (img->fd == -1) {
+        printf("ERROR: Can't read file\n");
+        g_img_close(img);
+        return NULL;
+    }
+    img->fd_owned = true;
+
+    if(!_img_init(img, NULL, 0)) {
+        g_img_close(img);
+        return NULL;
+    }
 
     if(img->header.frame_count == 1) {
         // If there is only one frame in the image, file is not needed anymore
@@ -87,58 +444,193 @@ g_img_t* g_img_open(const char* filename) {
     }
 
     return img;
+}
 
-exit_close:
-    close(img->fd);
+g_img_t* g_img_from_memory(const uint8_t* data, size_t size) {
+    // Palette and RGB565 pixels are read in place as 16-bit values
+    if(!data || ((uintptr_t)data & 1)) return NULL;
 
-exit_free:
-    free(img->bitmap);
-    free(img);
-    return NULL;
+    g_img_t* img = _img_new();
+    if(!img) return NULL;
+
+    img->data = data;
+    img->data_size = size;
+    if(!_img_init(img, NULL, 0)) {
+        g_img_close(img);
+        return NULL;
+    }
+
+    return img;
 }
 
 void g_img_close(g_img_t* img) {
-    if(img->fd > -1) close(img->fd);
-    if(img->header.flags & G_IMG_FLAG_INDEXED) free(img->palette);
-    free(img->bitmap);
+    if(img->fd > -1 && img->fd_owned) close(img->fd);
+    if(img->palette_owned) free(img->palette);
+    free(img->buffer);
     free(img);
 }
 
+g_img_pack_t* g_img_pack_open(const char* filename) {
+    g_img_pack_t* pack = malloc(sizeof(g_img_pack_t));
+    if(!pack) return NULL;
+    pack->palette = NULL;
+
+    pack->fd = open(filename, O_RDONLY, 0);
+    if(pack->fd == -1) {
+        printf("ERROR: Can't read file\n");
+        free(pack);
+        return NULL;
+    }
+
+    // Signature, then little-endian entry count (2 bytes), flags, shared palette size - 1 and names table position (4 bytes)
+    uint8_t header[PACK_HEADER_SIZE];
+    if(pread(pack->fd, header, PACK_HEADER_SIZE, 0) != PACK_HEADER_SIZE
+            || strncmp((char*)header, "EBP", 3) != 0 || header[3] != PACK_VERSION) {
+        printf("ERROR: Invalid pack file\n");
+        g_img_pack_close(pack);
+        return NULL;
+    }
+
+    pack->count = header[4] | (header[5] << 8);
+    pack->flags = header[6];
+    pack->palette_size = header[7];
+    pack->directory_offset = PACK_HEADER_SIZE;
+
+    if(pack->flags & G_IMG_PACK_FLAG_SHARED_PALETTE) {
+        size_t palette_size = (pack->palette_size + 1) * sizeof(g_color_t);
+        pack->palette = malloc(palette_size);
+        if(!pack->palette || pread(pack->fd, pack->palette, palette_size, PACK_HEADER_SIZE) != palette_size) {
+            g_img_pack_close(pack);
+            return NULL;
+        }
+        pack->directory_offset += palette_size;
+    }
+
+    printf("Pack entries: %d\n", pack->count);
+    return pack;
+}
+
+void g_img_pack_close(g_img_pack_t* pack) {
+    if(pack->fd > -1) close(pack->fd);
+    free(pack->palette);
+    free(pack);
+}
+
+uint32_t g_img_pack_hash(const char* name) {
+    // 32-bit FNV-1a
+    uint32_t hash = 0x811C9DC5;
+    for(; *name; name++) {
+        hash ^= (uint8_t)*name;
+        hash *= 0x01000193;
+    }
+    return hash;
+}
+
+static bool _pack_entry(const g_img_pack_t* pack, uint16_t index, g_img_pack_entry_t* entry) {
+    off_t offset = pack->directory_offset + (off_t)index * sizeof(g_img_pack_entry_t);
+    return pread(pack->fd, entry, sizeof(g_img_pack_entry_t), offset) == sizeof(g_img_pack_entry_t);
+}
+
+int32_t g_img_pack_find(const g_img_pack_t* pack, const char* name) {
+    // Binary search in the directory, sorted by hash
+    uint32_t hash = g_img_pack_hash(name);
+    int32_t lo = 0, hi = (int32_t)pack->count - 1;
+    g_img_pack_entry_t entry;
+    while(lo <= hi) {
+        int32_t mid = (lo + hi) / 2;
+        if(!_pack_entry(pack, mid, &entry)) return -1;
+
+        if(entry.hash == hash) return mid;
+        if(entry.hash < hash) lo = mid + 1;
+        else hi = mid - 1;
+    }
+    return -1;
+}
+
+g_img_t* g_img_pack_get(g_img_pack_t* pack, uint16_t index) {
+    g_img_pack_entry_t entry;
+    if(index >= pack->count || !_pack_entry(pack, index, &entry)) return NULL;
+
+    g_img_t* img = _img_new();
+    if(!img) return NULL;
+
+    img->fd = pack->fd;
+    img->base = entry.offset;
+    if(!_img_init(img, pack->palette, pack->palette_size)) {
+        g_img_close(img);
+        return NULL;
+    }
+
+    // Single frame images are fully loaded and don't need the pack file anymore
+    if(img->header.frame_count == 1) img->fd = -1;
+
+    return img;
+}
+
 void g_img_load_next(g_img_t* img) {
     if(img->current_frame >= img->header.frame_count) return;
 
+    size_t frame_size = g_img_frame_size(img);
     ssize_t read_bytes;
-    read_bytes = read(img->fd, img->bitmap, img->header.width * img->header.height);
-    printf("[Next frame] Bitmap read: %d/%d\n", read_bytes, img->header.width * img->header.height);
+    read_bytes = _read_frame(img);
+    printf("[Next frame] Bitmap read: %d/%d\n", read_bytes, frame_size);
     img->current_frame++;
 }
 
 void g_img_load_prev(g_img_t* img){
     if(img->current_frame <= 1) return;
-
-    lseek(img->fd, -2 * (img->header.width * img->header.height), SEEK_CUR);
-    ssize_t read_bytes;
-    read_bytes = read(img->fd, img->bitmap, img->header.width * img->header.height);
-    printf("[Prev frame] Bitmap read: %d/%d\n", read_bytes, img->header.width * img->header.height);
+    g_img_load_frame(img, img->current_frame - 2);
 }
 
 void g_img_load_first(g_img_t* img) {
-    lseek(img->fd, PALETTE_OFFSET + PALETTE_SIZE(img), SEEK_SET);
+    g_img_load_frame(img, 0);
+}
 
-    ssize_t read_bytes;
-    read_bytes = read(img->fd, img->bitmap, img->header.width * img->header.height);
-    printf("[First frame] Bitmap read: %d/%d\n", read_bytes, img->header.width * img->header.height);
-    img->current_frame = 1;
+esp_err_t g_img_load_frame(g_img_t* img, uint16_t frame) {
+    if(frame >= img->header.frame_count) return ESP_ERR_INVALID_ARG;
+    if(img->fd < 0 && !img->data) return ESP_OK;  // Single frame images are fully loaded when opened
+
+    // Frames are read in order from START. The bitmap holds frame CURRENT_FRAME - 1 and the source is
+    // positioned at frame CURRENT_FRAME, so delta frames can be applied from there
+    uint16_t start;
+    if(img->version == 1 && (img->header.flags & G_IMG_FLAG_ENCODED)) {
+        // No frame table, decode again from the first frame unless seeking forward
+        start = (img->current_frame > 0 && frame >= img->current_frame) ? img->current_frame : 0;
+        if(start == 0 && _source_seek(img, img->bitmap_offset, SEEK_SET) < 0) return ESP_FAIL;
+    } else {
+        // Delta frames are applied on top of the previous frame: walk back to the closest keyframe,
+        // or to the frame after the one already loaded
+        start = frame;
+        while(start > 0 && start != img->current_frame && _is_delta_frame(img, start)) start--;
+        if(!_seek_frame(img, start)) return ESP_FAIL;
+    }
+
+    bool sequential = start == frame && start == img->current_frame;
+    for(uint16_t i = start; i <= frame; i++) {
+        if(_read_frame(img) < 0) {
+            printf("[Frame %d] Bitmap read failed\n", i);
+            img->current_frame = 0;
+            return ESP_FAIL;
+        }
+    }
+    img->current_frame = frame + 1;
+
+    // Only a single frame following the loaded one keeps its own dirty regions
+    if(!sequential) _set_dirty_full(img);
+    return ESP_OK;
 }
 
 esp_err_t g_img_draw(g_coord_t x, g_coord_t y, g_img_t* img) {
     if(img->header.flags & G_IMG_FLAG_INDEXED) {
+        uint8_t bits = g_img_index_bits(img);
         if(img->header.flags & G_IMG_FLAG_TRANSPARENT)
-            return g_draw_bitmap_palette_transparent(x, y, img->bitmap, img->header.width, img->header.height, img->palette, img->header.transparent_index);
+            return g_draw_bitmap_palette_packed_transparent(x, y, img->bitmap, img->header.width, img->header.height, bits, img->palette, img->header.transparent_index);
         else
-            return g_draw_bitmap_palette(x, y, img->bitmap, img->header.width, img->header.height, img->palette);
+            return g_draw_bitmap_palette_packed(x, y, img->bitmap, img->header.width, img->header.height, bits, img->palette);
     }
-        
-    
+
+    if((img->header.flags & G_IMG_FLAG_COLORMODE) == G_IMG_COLORMODE_RGB565)
+        return g_draw_bitmap_rgb565(x, y, (const g_color_t*)img->bitmap, img->header.width, img->header.height);
+
     return ESP_ERR_NOT_SUPPORTED;
 }
@@ -6,6 +6,10 @@
 #define G_IMG_FLAG_COLORMODE 0b01110000
 #define G_IMG_FLAG_INDEXED 0b00001000
 #define G_IMG_FLAG_INDEXSIZE 0b00000100
+#define G_IMG_FLAG_ENCODED 0b00000010
+#define G_IMG_FLAG_SHARED_PALETTE 0b00000001
+
+#define G_IMG_PACK_FLAG_SHARED_PALETTE 0b10000000
 
 typedef enum {
     G_IMG_COLORMODE_MONO = 0b00000000,
@@ -21,15 +25,31 @@ typedef enum {
     G_IMG_INDEXSIZE_BYTE = 0b00000100
 } g_img_indexsize_t;
 
+typedef enum {
+    G_IMG_ENCODING_RAW = 0,
+    G_IMG_ENCODING_RLE = 1,
+    G_IMG_ENCODING_LZ = 2,
+    G_IMG_ENCODING_DELTA = 3
+} g_img_encoding_t;
+
+#define G_IMG_ENCODING_MASK 0x0F   // High bits of the frame encoding are reserved for per-frame flags
+
+#define G_IMG_MAX_DIRTY_REGIONS 8
+
 typedef struct {
     g_size_t width;
     g_size_t height;
     uint8_t flags;
     uint8_t palette_size;
     uint8_t transparent_index;
-    uint8_t frame_count;
+    uint16_t frame_count;
 } g_img_header_t;
 
+typedef struct __attribute__((__packed__)) {
+    uint8_t encoding;
+    uint32_t size;
+} g_img_frame_header_t;
+
 /*typedef struct {
     uint8_t palette_size;
     g_color_t* palette;
@@ -37,18 +57,66 @@ typedef struct {
 
 typedef struct {
     int fd;
-    uint8_t current_frame;
+    bool fd_owned;              // False for images in a pack, which share the pack file
+    off_t base;                 // File position of the image (its offset in a pack)
+    const uint8_t* data;        // Image in memory (g_img_from_memory), NULL when read from a file
+    size_t data_size;
+    size_t pos;                 // Read position, relative to the start of the image
+    uint8_t version;
+    uint16_t current_frame;
+    off_t bitmap_offset;        // File position of the first frame
+    off_t frame_table_offset;   // File position of the frame offset table (version 2)
     g_img_header_t header;
     g_color_t* palette;
-    uint8_t* bitmap;
+    bool palette_owned;         // False for palettes in memory or shared by a pack
+    uint8_t* bitmap;            // Current frame: the frame buffer, or raw frame data in memory
+    uint8_t* buffer;            // Frame buffer for frames read from a file or decoded
+    g_region_t dirty[G_IMG_MAX_DIRTY_REGIONS];  // Regions of the bitmap changed by the last loaded frame
+    uint8_t dirty_count;
 } g_img_t;
 
+typedef struct __attribute__((__packed__)) {
+    uint32_t hash;              // FNV-1a hash of the entry name
+    uint32_t offset;
+    uint32_t size;
+} g_img_pack_entry_t;
+
+typedef struct {
+    int fd;
+    uint16_t count;
+    uint8_t flags;
+    uint8_t palette_size;       // Shared palette size - 1
+    g_color_t* palette;         // Shared palette, NULL if entries have their own
+    off_t directory_offset;
+} g_img_pack_t;
+
 
 g_img_t* g_img_open(const char* filename);
+// Image from an EBG file in memory, e.g. a const array from ebg.py save_c_header. DATA must be 2-byte aligned
+// and outlive the image. Palette and raw frames are used in place, only compressed frames are copied to RAM
+g_img_t* g_img_from_memory(const uint8_t* data, size_t size);
 void g_img_close(g_img_t* img);
 
+// Pack of images from ebgpack.py. The pack file stays open and entries are read from it, so every
+// image from a pack must be closed before the pack
+g_img_pack_t* g_img_pack_open(const char* filename);
+void g_img_pack_close(g_img_pack_t* pack);
+uint32_t g_img_pack_hash(const char* name);
+// Index of the entry called NAME, or -1 if there is none
+int32_t g_img_pack_find(const g_img_pack_t* pack, const char* name);
+g_img_t* g_img_pack_get(g_img_pack_t* pack, uint16_t index);
+
 void g_img_load_next(g_img_t* img);
 void g_img_load_prev(g_img_t* img);
 void g_img_load_first(g_img_t* img);
+esp_err_t g_img_load_frame(g_img_t* img, uint16_t frame);
+
+uint8_t g_img_index_bits(const g_img_t* img);
+uint8_t g_img_pixel_bits(const g_img_t* img);
+size_t g_img_frame_size(const g_img_t* img);
+
+// Regions changed by the last loaded frame, in screen coordinates for an image drawn at (x, y).
+// REGIONS must have room for G_IMG_MAX_DIRTY_REGIONS. Returns the number of regions
+uint8_t g_img_dirty_regions(const g_img_t* img, g_coord_t x, g_coord_t y, g_region_t* regions);
 
 esp_err_t g_img_draw(g_coord_t x, g_coord_t y, g_img_t* img);
@@ -0,0 +1,149 @@
+'''
+Convert many images to Embedded Bitmap Graphics (EBG) in a single run.
+
+Items are converted by a pool of warm worker processes, so interpreter startup
+and heavy imports are paid once per worker instead of once per image. Inputs
+can be glob patterns, directory trees (every image inside is converted) or
+list files prefixed with '@'. Each line of a list file is one item, with its
+input(s) followed by img2ebg options:
+
+    icons/wifi.png -k 4 -t 0,0,0
+    animations/loading -k 8 --lut
+'''
+import io
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import contextlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import img2ebg
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+def _output_option(options):
+    return any(o in ('-o', '--output') or o.startswith('--output=') for o in options)
+
+def _list_output(arguments):
+    '''
+        Output name of a list file item, from its first input. None if its arguments are invalid
+    '''
+    try:
+        # Errors are reported when the item is converted
+        with contextlib.redirect_stderr(io.StringIO()):
+            args, _ = img2ebg.build_parser().parse_known_args(arguments)
+    except SystemExit:
+        return None
+    return os.path.splitext(os.path.basename(os.path.normpath(args.image[0])))[0]
+
+def collect_items(inputs, output_dir=None):
+    '''
+        Expand batch inputs into (name, img2ebg arguments) items
+    '''
+    items = []
+
+    def add(name, arguments, output=None):
+        if output_dir is not None and output is not None and not _output_option(arguments):
+            arguments = [*arguments, '-o', os.path.join(output_dir, output)]
+        items.append((name, arguments))
+
+    for value in inputs:
+        if value.startswith('@'):
+            with open(value[1:], 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0 or line.startswith('#'):
+                        continue
+                    arguments = shlex.split(line)
+                    add(line, arguments, _list_output(arguments))
+
+        elif os.path.isdir(value):
+            for root, dirs, files in os.walk(value):
+                dirs.sort()
+                for filename in img2ebg.sorted_alphanumeric(files):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, filename)
+                        add(path, [path], os.path.splitext(os.path.relpath(path, value))[0])
+
+        else:
+            paths = sorted(glob.glob(value, recursive=True)) or [value]
+            for path in paths:
+                add(path, [path], os.path.splitext(os.path.basename(path))[0])
+
+    return items
+
+def convert_item(item, options=()):
+    '''
+        Convert a single batch item. Errors are reported in the result instead of raised
+    '''
+    name, arguments = item
+    result = {'name': name, 'output': None, 'size': None, 'time': None, 'error': None}
+
+    start = time.perf_counter()
+    try:
+        # Items already run in parallel, so each one converts its frames serially by default
+        args = img2ebg.build_parser().parse_args(['-j', '1', *options, *arguments])
+        output = img2ebg.convert(args, log=lambda *_: None)
+        result['output'] = output
+        result['size'] = os.path.getsize(output)
+    except SystemExit:
+        result['error'] = f"Invalid arguments: {' '.join(arguments)}"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['time'] = time.perf_counter() - start
+
+    return result
+
+def run_batch(items, options=(), jobs=None):
+    '''
+        Convert every item in a pool of worker processes. Returns the results in item order
+    '''
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(convert_item, item, options) for item in items]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Convert many images to EBG in a single run. "
+                                        "Per-item img2ebg options can be given in '@' list files.")
+    parser.add_argument('inputs', nargs='+', type=str,
+                        help="Glob patterns, directories (converted recursively) or '@' list files")
+    parser.add_argument('-o', '--output-dir', type=str, default=None,
+                        help="Directory where EBG files are saved. Default: next to each input")
+    parser.add_argument('--options', type=str, default='',
+                        help="img2ebg options applied to every item, e.g. \"-k 16 --lut\". "
+                             "Options in list files take precedence")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes. Default: number of CPUs")
+    parser.add_argument('--summary', type=str, default=None,
+                        help="Save the per-item summary as JSON")
+    args = parser.parse_args()
+
+    items = collect_items(args.inputs, args.output_dir)
+    if len(items) == 0:
+        parser.error("No input images found")
+
+    start = time.perf_counter()
+    results = run_batch(items, shlex.split(args.options), args.jobs)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if result['error'] is None:
+            print(f"{result['time']:8.3f} s  {result['size']:10d} B  {result['name']}")
+        else:
+            print(f"{result['time']:8.3f} s  {'FAILED':>12s}  {result['name']}: {result['error']}")
+
+    failed = sum(1 for r in results if r['error'] is not None)
+    total_size = sum(r['size'] for r in results if r['error'] is None)
+    print(f"{len(results) - failed}/{len(results)} converted in {elapsed:.3f} s, {total_size} B total")
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'time': elapsed, 'items': results}, f, indent=4)
+
+    sys.exit(1 if failed else 0)
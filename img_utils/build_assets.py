@@ -0,0 +1,439 @@
+'''
+Build the images and fonts listed in a manifest, reusing unchanged outputs from a cache.
+
+A manifest is a JSON file, with paths relative to its directory:
+
+    {
+        "output_dir": "build",
+        "options": "-k 16 -z auto",
+        "images": [
+            "icons/*.png",
+            {"input": "animations/loading", "output": "loading", "options": "-k 8 --lut -c"},
+            {"input": ["walk/0.png", "walk/1.png"], "output": "sprites/walk"}
+        ],
+        "fonts": [
+            "fonts",
+            {"font": "fonts/base", "output": "include"}
+        ]
+    }
+
+Image entries are either batch.py inputs (glob patterns or directory trees,
+one EBG per image) or single items with their input(s), img2ebg options added
+to the global ones and output name (relative to output_dir, if given). Font
+entries are font2bin directories or directories of them; their .bmf, charmap
+and C header are saved next to the descriptor unless an output is given.
+
+Every item is keyed by a hash of its input files, its options and the source
+of the tools that build it. Outputs are stored in the cache under that key,
+so an item whose key didn't change is restored by copying its files (only the
+ones that differ) instead of being built: a rebuild of an unchanged tree costs
+about as much as hashing its inputs. Items that changed are built in parallel
+worker processes, which also keep k-means palettes in the cache, keyed by the
+color histogram, so an image isn't clustered again when only options that
+don't affect its palette change. The least recently used entries and palettes are evicted
+once the cache grows over its maximum size.
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import filecmp
+import hashlib
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import img2ebg
+from ebg import Palette
+from batch import collect_items
+from watch import collect_fonts
+
+IMG_UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_UTILS_DIR = os.path.join(IMG_UTILS_DIR, '..', 'font_utils')
+sys.path.insert(0, FONT_UTILS_DIR)
+from font2bin import build_font
+from bin2c import font_to_c
+
+# Cached outputs are only reused while the tools that built them don't change
+CACHE_VERSION = 1
+IMAGE_TOOLS = [os.path.join(IMG_UTILS_DIR, f) for f in
+               ('img2ebg.py', 'ebg.py', 'compression.py', 'quantizers.py', 'palette_search.py', 'pipeline.py')]
+FONT_TOOLS = [os.path.join(FONT_UTILS_DIR, f) for f in ('font2bin.py', 'bin2c.py')]
+
+DEFAULT_CACHE_DIR = os.path.join(Palette.LUT_CACHE_DIR, 'build')
+DEFAULT_CACHE_SIZE = 512    # MiB
+
+# img2ebg arguments that don't change the outputs (or that are hashed as files)
+UNKEYED_OPTIONS = ('image', 'output', 'palette', 'jobs', 'frame_buffer', 'profile', 'compare_engines')
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def files_digest(files):
+    '''
+        SHA-256 of the contents of FILES, in order
+    '''
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, 'rb') as f:
+            digest.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'little'))
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Item:
+    '''
+        An image or font to build: BUILD(TARGET, directory) writes its outputs to a directory,
+        which are then copied to OUTPUT_DIR. Its key hashes the contents of the INPUTS files
+        and SALT, the options and tools the outputs depend on
+    '''
+    def __init__(self, name, inputs, output_dir, build, target, salt):
+        self.name = name
+        self.inputs = inputs
+        self.output_dir = output_dir
+        self.build = build
+        self.target = target
+        self.salt = salt
+
+    def key(self):
+        return hashlib.sha256(f"{self.salt}\0{files_digest(self.inputs)}".encode()).hexdigest()
+
+
+def _split(options):
+    return shlex.split(options) if isinstance(options, str) else [str(o) for o in options]
+
+def image_item(name, arguments, options, root, tools):
+    '''
+        Item of an image converted with img2ebg OPTIONS followed by its own ARGUMENTS. A palette
+        file is relative to ROOT, as inputs and outputs already are
+    '''
+    try:
+        # Items already build in parallel, so each one converts its frames serially by default
+        args = img2ebg.build_parser().parse_args(['-j', '1', *options, *arguments])
+    except SystemExit:
+        raise ValueError(f"Invalid img2ebg options for '{name}'")
+    if args.output is None:
+        args.output = os.path.splitext(args.image[0])[0]
+    if args.palette:
+        args.palette = os.path.join(root, args.palette)
+
+    inputs = list(args.image)
+    if len(inputs) == 1 and os.path.isdir(inputs[0]):
+        inputs = [os.path.join(inputs[0], f) for f in img2ebg.sorted_alphanumeric(os.listdir(inputs[0]))]
+    if args.palette:
+        inputs.append(args.palette)
+
+    # The output name is part of the key, C headers name their array after it
+    keyed = {option: value for option, value in vars(args).items() if option not in UNKEYED_OPTIONS}
+    salt = json.dumps(['image', CACHE_VERSION, tools, os.path.basename(args.output), keyed],
+                      sort_keys=True, default=str)
+    return Item(name, inputs, os.path.dirname(args.output), build_image, args, salt)
+
+def image_items(entry, root, output_dir, options, tools):
+    '''
+        Items of a manifest image entry
+    '''
+    if isinstance(entry, str):
+        # Expanded as batch.py inputs
+        return [image_item(name, arguments, options, root, tools)
+                for name, arguments in collect_items([os.path.join(root, entry)], output_dir)]
+
+    inputs = entry['input'] if isinstance(entry['input'], list) else [entry['input']]
+    inputs = [os.path.join(root, path) for path in inputs]
+    arguments = [*inputs, *_split(entry.get('options', []))]
+    if 'output' in entry or output_dir is not None:
+        output = entry.get('output', os.path.splitext(os.path.basename(os.path.normpath(inputs[0])))[0])
+        arguments += ['-o', os.path.join(root if output_dir is None else output_dir, output)]
+
+    return [image_item(' '.join(inputs), arguments, options, root, tools)]
+
+def font_items(entry, root, tools):
+    '''
+        Items of a manifest font entry
+    '''
+    if isinstance(entry, str):
+        entry = {'font': entry}
+
+    font_dirs = collect_fonts([os.path.join(root, entry['font'])])
+    if len(font_dirs) == 0:
+        raise ValueError(f"No font descriptor found in '{entry['font']}'")
+
+    items = []
+    for font_dir in font_dirs:
+        font_name = os.path.basename(os.path.normpath(font_dir))
+        descriptor = os.path.join(font_dir, f"{font_name}.json")
+        inputs = [descriptor]
+        try:
+            with open(descriptor, 'r') as f:
+                inputs.append(os.path.join(font_dir, json.load(f)['glyphs']))
+        except (OSError, ValueError, KeyError):
+            pass    # Reported when built
+
+        output_dir = os.path.join(root, entry['output']) if 'output' in entry else font_dir
+        salt = json.dumps(['font', CACHE_VERSION, tools, font_name])
+        items.append(Item(font_dir, inputs, output_dir, build_fonts, font_dir, salt))
+    return items
+
+def load_manifest(filename):
+    '''
+        Items of a manifest file. Invalid manifests raise ValueError
+    '''
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError(f"Invalid manifest '{filename}'")
+    unknown = set(manifest) - {'output_dir', 'options', 'images', 'fonts'}
+    if unknown:
+        raise ValueError(f"Unknown manifest keys: {', '.join(sorted(unknown))}")
+
+    root = os.path.dirname(filename)
+    output_dir = None if manifest.get('output_dir') is None else os.path.join(root, manifest['output_dir'])
+    options = _split(manifest.get('options', []))
+
+    items = []
+    image_tools = files_digest(IMAGE_TOOLS)
+    for entry in manifest.get('images', []):
+        try:
+            items += image_items(entry, root, output_dir, options, image_tools)
+        except (KeyError, TypeError):
+            raise ValueError(f"Invalid image entry: {json.dumps(entry)}")
+
+    font_tools = files_digest(FONT_TOOLS)
+    for entry in manifest.get('fonts', []):
+        try:
+            items += font_items(entry, root, font_tools)
+        except (KeyError, TypeError):
+            raise ValueError(f"Invalid font entry: {json.dumps(entry)}")
+
+    return items
+
+
+def build_image(args, directory):
+    '''
+        Convert an image with parsed img2ebg ARGS into DIRECTORY. Returns the directory
+    '''
+    args.output = os.path.join(directory, os.path.basename(args.output))
+    img2ebg.convert(args, log=lambda *_: None)
+    return directory
+
+def build_fonts(font_dir, directory):
+    '''
+        Build the .bmf, charmap and C header of a font into DIRECTORY. Returns the directory with them
+    '''
+    font_name = os.path.basename(os.path.normpath(font_dir))
+    build_font(font_dir, os.path.join(directory, font_name))
+    font_to_c(font_name, directory)
+    return os.path.join(directory, font_name)
+
+def _init_worker(palette_dir):
+    img2ebg.PALETTE_CACHE_DIR = palette_dir
+
+def _build(build, target, directory):
+    start = time.perf_counter()
+    return build(target, directory), time.perf_counter() - start
+
+
+class Cache:
+    '''
+        Outputs of built items in DIRECTORY, one entry (a directory of files) per item key, and
+        the palettes generated while building them. Past MAX_SIZE bytes, the least recently
+        used entries and palettes are evicted
+    '''
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.entries = os.path.join(directory, 'entries')
+        self.palettes = os.path.join(directory, 'palettes')
+        self.staging = os.path.join(directory, 'staging')
+
+    def get(self, key):
+        '''
+            Entry directory of KEY, marked as recently used, or None if not cached
+        '''
+        entry = os.path.join(self.entries, key)
+        try:
+            os.utime(entry)
+            return entry
+        except OSError:
+            return None
+
+    def stage(self):
+        '''
+            New directory to build outputs into, on the same file system as the entries
+        '''
+        os.makedirs(self.staging, exist_ok=True)
+        return tempfile.mkdtemp(dir=self.staging)
+
+    def put(self, key, directory):
+        '''
+            Move a directory of built outputs into the cache as the entry of KEY. Returns the entry directory
+        '''
+        entry = os.path.join(self.entries, key)
+        os.makedirs(self.entries, exist_ok=True)
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.replace(directory, entry)
+        except OSError:
+            # Stored by a concurrent run in the meantime, with the same outputs
+            shutil.rmtree(directory, ignore_errors=True)
+        return entry
+
+    def evict(self):
+        '''
+            Remove the least recently used entries and palettes until the cache fits in its
+            maximum size. Returns the number of bytes freed
+        '''
+        files = []
+        for directory in (self.entries, self.palettes):
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.isdir(path):
+                        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                    else:
+                        size = os.path.getsize(path)
+                    files.append((os.path.getmtime(path), size, path))
+                except OSError:
+                    pass    # Evicted by a concurrent run
+
+        excess = sum(size for _, size, _ in files) - self.max_size
+        freed = 0
+        for _, size, path in sorted(files):
+            if freed >= excess:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            freed += size
+        return freed
+
+
+def restore(entry, output_dir):
+    '''
+        Copy the files of a cache entry to OUTPUT_DIR, leaving identical files untouched
+        (and their modification time, for build systems downstream). Returns the number of files copied
+    '''
+    output_dir = output_dir or '.'
+    os.makedirs(output_dir, exist_ok=True)
+    copied = 0
+    for name in sorted(os.listdir(entry)):
+        source = os.path.join(entry, name)
+        destination = os.path.join(output_dir, name)
+        if os.path.isfile(destination) and filecmp.cmp(source, destination, shallow=False):
+            continue
+        shutil.copyfile(source, destination)
+        copied += 1
+    return copied
+
+def build(items, cache, jobs=None, rebuild=False, log=print):
+    '''
+        Build ITEMS, restoring the ones whose key is in CACHE (unless REBUILD) and building the rest
+        in JOBS worker processes. Results are logged as they come. Returns the hashing time and
+        a result per item, in completion order
+    '''
+    results = []
+
+    def report(item, status, elapsed, error=None):
+        results.append({'name': item.name, 'status': status, 'time': elapsed, 'error': error})
+        if error is None:
+            log(f"{elapsed:8.3f} s  {status:>6s}  {item.name}")
+        else:
+            log(f"{elapsed:8.3f} s  FAILED  {item.name}: {error}")
+
+    def hash_item(item):
+        try:
+            return item.key()
+        except OSError as e:
+            return e
+
+    # Hashing reads every input, spread over threads (hashlib releases the GIL on large buffers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        keys = list(executor.map(hash_item, items))
+    hash_time = time.perf_counter() - start
+
+    pending = {}    # {key: [items]}, items with the same key are built once
+    for item, item_key in zip(items, keys):
+        if isinstance(item_key, OSError):
+            report(item, 'failed', 0.0, f"{type(item_key).__name__}: {item_key}")
+            continue
+        entry = None if rebuild else cache.get(item_key)
+        if entry is None:
+            pending.setdefault(item_key, []).append(item)
+            continue
+        start = time.perf_counter()
+        try:
+            restore(entry, item.output_dir)
+            report(item, 'cached', time.perf_counter() - start)
+        except OSError as e:
+            report(item, 'failed', time.perf_counter() - start, f"{type(e).__name__}: {e}")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(cache.palettes,)) as executor:
+            futures = {}
+            for item_key, key_items in pending.items():
+                stage = cache.stage()
+                futures[executor.submit(_build, key_items[0].build, key_items[0].target, stage)] = \
+                    (item_key, key_items, stage)
+
+            for future in as_completed(futures):
+                item_key, key_items, stage = futures[future]
+                try:
+                    directory, elapsed = future.result()
+                    entry = cache.put(item_key, directory)
+                    for item in key_items:
+                        restore(entry, item.output_dir)
+                        report(item, 'built', elapsed)
+                except Exception as e:
+                    for item in key_items:
+                        report(item, 'failed', 0.0, f"{type(e).__name__}: {e}")
+                finally:
+                    shutil.rmtree(stage, ignore_errors=True)
+
+    return hash_time, results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Build the images and fonts of a manifest, reusing unchanged outputs "
+                                        "from a content-hash cache")
+    parser.add_argument('manifest', type=str, help="JSON manifest of the images and fonts to build")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes (and of hashing threads). Default: number of CPUs")
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR,
+                        help="Directory of the build cache. Default: build/ in $EBG_CACHE_DIR or ~/.cache/ebg")
+    parser.add_argument('--cache-size', type=float, default=DEFAULT_CACHE_SIZE,
+                        help=f"Maximum size of the build cache, in MiB. Default: {DEFAULT_CACHE_SIZE}")
+    parser.add_argument('-B', '--rebuild', action='store_true',
+                        help="Build every item instead of restoring cached outputs. Cached palettes are still used")
+    parser.add_argument('--summary', type=str, default=None, help="Save the per-item summary as JSON")
+    args = parser.parse_args()
+
+    try:
+        items = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        parser.error(e)
+    if len(items) == 0:
+        parser.error("Nothing to build in the manifest")
+
+    cache = Cache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    start = time.perf_counter()
+    hash_time, results = build(items, cache, args.jobs, args.rebuild)
+    freed = cache.evict()
+    elapsed = time.perf_counter() - start
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('built', 'cached', 'failed')}
+    print(f"{len(results)} items in {elapsed:.3f} s (hashing {hash_time:.3f} s): {counts['built']} built, "
+          f"{counts['cached']} cached, {counts['failed']} failed"
+          + (f", {freed / (1024 * 1024):.1f} MiB evicted from the cache" if freed else ''))
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'time': elapsed, 'hash_time': hash_time, 'items': results}, f, indent=4)
+
+    sys.exit(1 if counts['failed'] else 0)
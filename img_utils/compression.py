@@ -0,0 +1,257 @@
+'''
+Frame compression codecs for EBG bitmaps.
+
+- Row RLE: (count, value) byte pairs, count from 1 to 255. Runs never cross
+  row boundaries, so rows can be decoded independently.
+- LZ: LZSS with a small window. Each group of up to 8 tokens is preceded by
+  a flags byte (least significant bit first, 1 = match). Literals are a single
+  byte. Matches take 2 bytes: a 12-bit offset - 1 and a 4-bit length - 3, so
+  they reach back up to 4096 bytes and copy 3 to 18 bytes. Matches only refer
+  to data already decoded into the output buffer, so no extra window memory
+  is needed to decode them.
+- Delta: only the rectangles that changed from the previous frame. A 2-byte
+  rectangle count is followed by each rectangle (x, y, width, height as 2-byte
+  pixel values) and the stored bytes of its rows. Rectangles start at a byte
+  boundary, so their rows can be copied as whole bytes.
+'''
+import struct
+
+import numpy as np
+
+RLE_MAX_RUN = 255
+
+LZ_WINDOW = 4096
+LZ_MIN_MATCH = 3
+LZ_MAX_MATCH = 18
+LZ_DECODE_CHUNK = 4096
+
+DELTA_MAX_RECTS = 8
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int32)
+_FLAG_BITS = np.arange(8, dtype=np.uint8)
+
+
+def rle_encode(data, row_size):
+    '''
+        Encode bytes as row RLE (count, value) pairs
+    '''
+    data = np.asarray(data, dtype=np.uint8).reshape(-1)
+    if data.size == 0:
+        return b''
+
+    # A run starts wherever the value changes and at the beginning of every row
+    positions = np.arange(data.size)
+    starts = np.flatnonzero(np.concatenate(([True], data[1:] != data[:-1])) | (positions % row_size == 0))
+    lengths = np.diff(np.append(starts, data.size))
+
+    # Split runs longer than the maximum count
+    pieces = (lengths + RLE_MAX_RUN - 1) // RLE_MAX_RUN
+    counts = np.full(pieces.sum(), RLE_MAX_RUN)
+    counts[np.cumsum(pieces) - 1] = lengths - RLE_MAX_RUN * (pieces - 1)
+
+    return np.stack([counts, np.repeat(data[starts], pieces)], axis=1).astype(np.uint8).tobytes()
+
+def rle_decode(payload, size):
+    '''
+        Decode row RLE pairs into SIZE bytes
+    '''
+    pairs = np.frombuffer(payload, dtype=np.uint8).reshape((-1, 2))
+    data = np.repeat(pairs[:, 1], pairs[:, 0])
+    if data.size != size:
+        raise ValueError("Invalid RLE frame size")
+    return data
+
+def _match_lengths(data, offsets):
+    # Length of the match at every position for the given backwards offsets (0 = no candidate)
+    positions = np.arange(data.size)
+    sources = positions - offsets
+    alive = (offsets > 0) & (offsets <= LZ_WINDOW) & (sources >= 0)
+    lengths = np.zeros(data.size, dtype=np.int64)
+
+    for i in range(LZ_MAX_MATCH):
+        alive &= positions + i < data.size
+        alive[alive] = data[positions[alive] + i] == data[sources[alive] + i]
+        lengths += alive
+
+    return lengths
+
+def lz_encode(data):
+    '''
+        Encode bytes with small-window LZ
+    '''
+    data = np.asarray(data, dtype=np.uint8).reshape(-1)
+    size = data.size
+
+    # Candidate offsets: repeated bytes (runs) and the latest occurrence of the same 3-byte prefix
+    candidates = [np.ones(size, dtype=np.int64)]
+    if size >= LZ_MIN_MATCH:
+        prefixes = (data[:-2].astype(np.int64) << 16) | (data[1:-1].astype(np.int64) << 8) | data[2:]
+        order = np.argsort(prefixes, kind='stable')
+        previous = np.zeros(size, dtype=np.int64)
+        same = prefixes[order[1:]] == prefixes[order[:-1]]
+        previous[order[1:][same]] = order[1:][same] - order[:-1][same]
+        candidates.append(previous)
+
+    best_lengths = np.zeros(size, dtype=np.int64)
+    best_offsets = np.zeros(size, dtype=np.int64)
+    for offsets in candidates:
+        lengths = _match_lengths(data, offsets)
+        better = lengths > best_lengths
+        best_lengths[better] = lengths[better]
+        best_offsets[better] = offsets[better]
+
+    # Greedy parsing, using the best precomputed match at each position
+    best_lengths = best_lengths.tolist()
+    best_offsets = best_offsets.tolist()
+    out = bytearray()
+    position = 0
+    while position < size:
+        flags_position = len(out)
+        out.append(0)
+        flags = 0
+        for bit in range(8):
+            if position >= size:
+                break
+            length = best_lengths[position]
+            if length >= LZ_MIN_MATCH:
+                offset = best_offsets[position] - 1
+                flags |= 1 << bit
+                out.append(offset & 0xFF)
+                out.append(((offset >> 8) << 4) | (length - LZ_MIN_MATCH))
+                position += length
+            else:
+                out.append(data[position])
+                position += 1
+        out[flags_position] = flags
+
+    return bytes(out)
+
+def lz_decode(payload, size):
+    '''
+        Decode small-window LZ into SIZE bytes. Tokens are parsed and literals placed with array
+        operations, so only matches are copied one by one, as slices of the output
+    '''
+    payload = np.frombuffer(bytes(payload), dtype=np.uint8)
+    if size == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    # Groups: a flags byte, then one byte per literal and two per match
+    group_sizes = (1 + 8 + _POPCOUNT[payload]).tolist()
+    groups = []
+    position = 0
+    while position < len(payload):
+        groups.append(position)
+        position += group_sizes[position]
+    groups = np.array(groups, dtype=np.int32)
+
+    # First payload byte of every token, in order. The last group may end early
+    matches = ((payload[groups, np.newaxis] >> _FLAG_BITS) & 1).astype(bool)
+    token_sizes = 1 + matches.astype(np.int32)
+    starts = (groups[:, np.newaxis] + 1 + np.cumsum(token_sizes, axis=1) - token_sizes).reshape(-1)
+    matches = matches.reshape(-1)
+    inside = starts + matches < len(payload)
+    starts, matches = starts[inside], matches[inside]
+
+    first = payload[starts].astype(np.int32)
+    second = payload[np.minimum(starts + 1, len(payload) - 1)].astype(np.int32)
+    offsets = np.where(matches, (first | ((second >> 4) << 8)) + 1, 0)
+    lengths = np.where(matches, (second & 0x0F) + LZ_MIN_MATCH, 1)
+
+    # Decoding stops at the token that reaches SIZE bytes
+    ends = np.cumsum(lengths)
+    count = int(np.searchsorted(ends, size)) + 1
+    if count > len(ends) or ends[count - 1] != size:
+        raise ValueError("Invalid LZ frame size")
+    matches, first, offsets, lengths = matches[:count], first[:count], offsets[:count], lengths[:count]
+    positions = ends[:count] - lengths
+    if np.any(offsets > positions):
+        raise ValueError("Invalid LZ match offset")
+
+    # Literals are placed at once, then matches copy earlier output in order
+    out = np.zeros(size, dtype=np.uint8)
+    out[positions[~matches]] = first[~matches]
+    out = bytearray(out.tobytes())
+    positions, offsets, lengths = positions[matches], offsets[matches], lengths[matches]
+    for chunk in range(0, len(positions), LZ_DECODE_CHUNK):
+        # Matches are converted to Python ints in chunks, to bound memory
+        for position, offset, length in zip(positions[chunk:chunk+LZ_DECODE_CHUNK].tolist(),
+                                            offsets[chunk:chunk+LZ_DECODE_CHUNK].tolist(),
+                                            lengths[chunk:chunk+LZ_DECODE_CHUNK].tolist()):
+            start = position - offset
+            if offset >= length:
+                out[position:position+length] = out[start:start+length]
+            else:
+                # Overlapping match: repeat the last OFFSET bytes
+                out[position:position+length] = (out[start:position] * (length // offset + 1))[:length]
+
+    return np.frombuffer(bytes(out), dtype=np.uint8)
+
+def _byte_span(x, width, bits):
+    # First and last (excluded) bytes of the pixel span [x, x + width) in a stored row
+    return (x * bits) // 8, ((x + width) * bits + 7) // 8
+
+def dirty_rects(previous, current, width, bits):
+    '''
+        Pixel rectangles (x, y, width, height) covering every difference between
+        two stored frames of shape (height, row size)
+    '''
+    diff = np.asarray(previous) != np.asarray(current)
+    rows = np.flatnonzero(diff.any(axis=1))
+    if len(rows) == 0:
+        return []
+
+    # Bands of consecutive changed rows. Closest bands are merged until they fit DELTA_MAX_RECTS
+    bands = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1)
+    bands = [[band[0], band[-1]] for band in bands]
+    while len(bands) > DELTA_MAX_RECTS:
+        gaps = [bands[i+1][0] - bands[i][1] for i in range(len(bands) - 1)]
+        i = int(np.argmin(gaps))
+        bands[i:i+2] = [[bands[i][0], bands[i+1][1]]]
+
+    rects = []
+    for y0, y1 in bands:
+        columns = np.flatnonzero(diff[y0:y1+1].any(axis=0))
+        # Stored bytes to pixels, aligned so the rectangle starts at a byte boundary
+        x0 = (columns[0] * 8) // bits
+        x1 = min(width, ((columns[-1] + 1) * 8 + bits - 1) // bits)
+        rects.append((x0, y0, x1 - x0, y1 - y0 + 1))
+
+    return rects
+
+def delta_encode(previous, current, width, bits):
+    '''
+        Encode a stored frame as the rectangles that changed from the previous one
+    '''
+    current = np.asarray(current, dtype=np.uint8)
+    rects = dirty_rects(previous, current, width, bits)
+
+    out = [struct.pack("<H", len(rects))]
+    for x, y, w, h in rects:
+        start, end = _byte_span(x, w, bits)
+        out.append(struct.pack("<HHHH", x, y, w, h))
+        out.append(np.ascontiguousarray(current[y:y+h, start:end]).tobytes())
+
+    return b''.join(out)
+
+def delta_decode(payload, previous, width, bits):
+    '''
+        Rebuild a stored frame from a delta payload and the previous stored frame
+    '''
+    payload = np.frombuffer(payload, dtype=np.uint8)
+    frame = np.array(previous, dtype=np.uint8)
+
+    count, = struct.unpack("<H", payload[:2].tobytes())
+    position = 2
+    for i in range(count):
+        x, y, w, h = struct.unpack("<HHHH", payload[position:position+8].tobytes())
+        position += 8
+
+        start, end = _byte_span(x, w, bits)
+        if x + w > width or y + h > frame.shape[0]:
+            raise ValueError("Invalid delta rectangle")
+
+        size = h * (end - start)
+        frame[y:y+h, start:end] = payload[position:position+size].reshape((h, end - start))
+        position += size
+
+    return frame
@@ -1,23 +1,31 @@
+import io
 import os
+import re
 import math
 import json
 import struct
+import hashlib
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import cv2
-import imageio
 import numpy as np
-from sklearn.cluster import MiniBatchKMeans
-from sklearn.metrics import pairwise_distances_argmin
+
+from quantizers import QUANTIZERS
+import compression
+import profiling
+
+# OpenCV, imageio and scikit-learn are imported by the functions that need them, so reading
+# and writing EBG files only loads NumPy
 
 class Utils:
     @staticmethod
     def bgr_to_rgb(colors):
-        length, channels = colors.shape
-        colors = colors.reshape((1, length, channels))
-        return cv2.cvtColor(colors, cv2.COLOR_BGR2RGB).reshape((length, channels))
+        return np.ascontiguousarray(colors[:, ::-1])
     
     @staticmethod
     def rgb_to_lab(colors):
+        import cv2
         length, channels = colors.shape
         colors = colors.reshape((1, length, channels))
         return cv2.cvtColor(colors, cv2.COLOR_RGB2LAB).reshape((length, channels))
@@ -30,8 +38,107 @@ class Utils:
     def rgb565_to_rgb(color):
         return (color & 0xF800) >> 8, (color & 0x07E0) >> 3, (color & 0x1F) << 3
 
+    @staticmethod
+    def bgr_to_rgb565(img):
+        img = img.astype(np.uint16)
+        return Utils.rgb_to_rgb565(img[..., 2], img[..., 1], img[..., 0])
+
+    @staticmethod
+    def rgb565_histogram(img):
+        return np.bincount(Utils.bgr_to_rgb565(img).reshape(-1), minlength=0x10000)
+
+    @staticmethod
+    def frames_histogram(frames):
+        histogram = np.zeros(0x10000, dtype=np.int64)
+        for frame in frames:
+            with profiling.stage('histogram', 1):
+                histogram += Utils.rgb565_histogram(frame)
+        return histogram
+
+    @staticmethod
+    def histogram_colors(histogram):
+        '''
+            Distinct colors of an RGB565 histogram as RGB and LAB arrays, along with their pixel counts
+        '''
+        with profiling.stage('lab') as stage:
+            histogram = np.asarray(histogram)
+            codes = np.flatnonzero(histogram)
+            rgb_colors = np.stack(Utils.rgb565_to_rgb(codes), axis=1).astype(np.uint8)
+            stage.add(len(codes))
+            return rgb_colors, Utils.rgb_to_lab(rgb_colors), histogram[codes]
+
+    @staticmethod
+    def add_transparent(histogram, transparent_color):
+        '''
+            Count the transparent color once in a copy of the histogram, so it is always
+            part of the clustered colors. Returns the histogram and the transparent LAB color
+        '''
+        histogram = np.array(histogram, dtype=np.int64)
+        code = Utils.rgb_to_rgb565(*(int(c) for c in transparent_color))
+        histogram[code] += 1
+        return histogram, Utils.rgb_to_lab(np.uint8([Utils.rgb565_to_rgb(code)]))
+
+    @staticmethod
+    def index_bits(palette_size):
+        '''
+            Smallest index size (1, 2, 4 or 8 bits) able to address every palette color
+        '''
+        for bits in (1, 2, 4):
+            if palette_size <= 1 << bits:
+                return bits
+        return 8
+
+    @staticmethod
+    def row_size(width, bits):
+        return (width * bits + 7) // 8
+
+    @staticmethod
+    def pack_indices(indices, bits):
+        '''
+            Pack rows of palette indices (last axis) into BITS per index, most significant
+            bits first. Rows are padded to a whole number of bytes
+        '''
+        indices = np.asarray(indices, dtype=np.uint8)
+        if bits == 8:
+            return indices
+
+        per_byte = 8 // bits
+        width = indices.shape[-1]
+        row_size = Utils.row_size(width, bits)
+
+        padded = np.zeros((*indices.shape[:-1], row_size * per_byte), dtype=np.uint8)
+        padded[..., :width] = indices
+        padded = padded.reshape((*indices.shape[:-1], row_size, per_byte))
+
+        shifts = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+        return np.bitwise_or.reduce(padded << shifts, axis=-1).astype(np.uint8)
+
+    @staticmethod
+    def unpack_indices(packed, width, bits):
+        '''
+            Unpack rows of packed palette indices (last axis) back to one index per byte
+        '''
+        packed = np.asarray(packed, dtype=np.uint8)
+        if bits == 8:
+            return packed[..., :width]
+
+        shifts = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+        indices = (packed[..., np.newaxis] >> shifts) & ((1 << bits) - 1)
+        return indices.reshape((*packed.shape[:-1], -1))[..., :width]
+
+    @staticmethod
+    def delta_e(lab1, lab2):
+        '''
+            CIE76 color difference between 8-bit (OpenCV scaled) LAB colors
+        '''
+        scale = np.array([100 / 255, 1, 1])
+        return np.linalg.norm((lab1.astype(np.float64) - lab2.astype(np.float64)) * scale, axis=-1)
+
 
 class Palette:
+    LUT_CACHE_DIR = os.environ.get('EBG_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ebg'))
+    LUT_CACHE_SIZE = 8    # Tables kept in memory, 64 KiB each
+
     def __init__(self, colors, colormode='RGB', transparent=None):
         if colormode == 'RGB':
             self.rgb_colors = colors
@@ -63,42 +170,109 @@ class Palette:
                        transparent=None if transparent_color is None else transparent_index)
 
     @staticmethod
-    def from_img(img, k, transparent_color=None):
+    def from_img(img, k, transparent_color=None, engine='kmeans'):
         '''
             Generate a palette of K colors from a given image
         '''
+        import cv2
         (h, w, c) = img.shape
-        pixels = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).reshape((h * w, c))
+        with profiling.stage('lab', h * w):
+            pixels = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).reshape((h * w, c))
+        lab_transparent = None
+        if transparent_color is not None:
+            lab_transparent = Utils.rgb_to_lab(np.array([transparent_color], dtype=np.uint8))
+            pixels = np.insert(pixels, 0, lab_transparent, axis=0)
+
+        palette = Palette.from_lab(pixels, k, transparent_color=lab_transparent, engine=engine)
+        return palette.set_transparent_color(transparent_color)
+
+    @staticmethod
+    def from_histogram(histogram, k, transparent_color=None, engine='kmeans'):
+        '''
+            Generate a palette of K colors from an RGB565 color histogram.
+            Each distinct color is clustered once, weighted by its pixel count
+        '''
+        lab_transparent = None
         if transparent_color is not None:
-            transparent_color = Utils.rgb_to_lab(np.array([transparent_color], dtype=np.uint8))
-            pixels = np.insert(pixels, 0, transparent_color, axis=0)
-            transparent_index = 0
+            histogram, lab_transparent = Utils.add_transparent(histogram, transparent_color)
+
+        _, lab_colors, counts = Utils.histogram_colors(histogram)
+
+        palette = Palette.from_lab(lab_colors, k, weights=counts,
+                                   transparent_color=lab_transparent, engine=engine)
+        return palette.set_transparent_color(transparent_color)
+
+    @staticmethod
+    def from_frames(frames, k, transparent_color=None, engine='kmeans'):
+        '''
+            Generate a palette of K colors from a sequence of frames. Frames are
+            accumulated one by one into an RGB565 histogram, so memory use does
+            not grow with the number of frames
+        '''
+        return Palette.from_histogram(Utils.frames_histogram(frames), k,
+                                      transparent_color=transparent_color, engine=engine)
+
+    @staticmethod
+    def from_lab(pixels, k, weights=None, transparent_color=None, engine='kmeans'):
+        '''
+            Generate a palette of K colors from (optionally weighted) LAB pixels.
+            The transparent color must already be included in the pixels
+        '''
+        if engine not in QUANTIZERS:
+            raise ValueError(f"Unsupported quantizer engine '{engine}'")
+        quantizer = QUANTIZERS[engine]()
 
         # Check number of colors in the image. If it's less than K, those colors are the palette
-        colors = np.unique(pixels, axis=0)
+        colors, inverse = np.unique(pixels, axis=0, return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1), weights=weights, minlength=len(colors))
+        unique_colors = colors
+
+        def fit(colors, k, weights):
+            # Centers may coincide once rounded, only distinct ones are kept (in order)
+            if len(colors) <= k:
+                return colors
+            centers = quantizer.fit(colors, k, weights=weights)
+            _, first = np.unique(centers, axis=0, return_index=True)
+            return centers[np.sort(first)]
 
         if len(colors) > k:
-            clt = MiniBatchKMeans(n_clusters = k)#, verbose=True)
-            clt.fit(pixels)
-            colors = np.uint8(clt.cluster_centers_)
-
-            if transparent_color is not None:
-                color_matches = np.equal(colors, transparent_color).all(axis=1)
-
-                if any(color_matches):
-                    # Transparent color found in cluster centers, take as transparent index
-                    transparent_index = np.where(color_matches)[0][0]
-                
-                elif k > 1:
-                    # Transparent color not found, quantize with one color less and add it manually
-                    clt = MiniBatchKMeans(n_clusters = k-1)#, verbose=True)
-                    clt.fit(colors)
-                    colors = np.uint8(clt.cluster_centers_)
-                    colors = np.insert(colors, 0, transparent_color, axis=0)
-                    transparent_index = 0
-
-        return Palette(colors, colormode='LAB',
-                       transparent=None if transparent_color is None else transparent_index)
+            with profiling.stage(engine, len(pixels)):
+                colors = fit(pixels, k, weights)
+
+        transparent_index = None
+        if transparent_color is not None:
+            color_matches = np.equal(colors, transparent_color).all(axis=1)
+
+            if any(color_matches):
+                # Transparent color found in palette colors, take as transparent index
+                transparent_index = np.where(color_matches)[0][0]
+
+            elif k > 1:
+                # Transparent color not found, quantize the other colors into one color less and add it manually
+                others = ~np.equal(unique_colors, transparent_color).all(axis=1)
+                with profiling.stage(engine, np.count_nonzero(others)):
+                    colors = fit(unique_colors[others], k-1, counts[others])
+                colors = np.insert(colors, 0, transparent_color, axis=0)
+                transparent_index = 0
+
+            else:
+                # No color left besides the transparent one
+                colors = np.asarray(transparent_color, dtype=colors.dtype).reshape((1, -1))
+                transparent_index = 0
+
+        return Palette(colors, colormode='LAB', transparent=transparent_index)
+
+    def set_transparent_color(self, color):
+        '''
+            Store the exact transparent COLOR (RGB) at the transparent index. Generated palettes
+            otherwise hold its round trip through RGB565 and LAB, which Palette.load wouldn't
+            match with the same color again. Returns the palette
+        '''
+        if color is not None and self.transparent is not None:
+            colors = np.array(self._colors, dtype=np.uint8)
+            colors[self.transparent] = [int(c) for c in color]
+            self.rgb_colors = colors
+        return self
 
     def __len__(self):
         return self._length
@@ -116,19 +290,19 @@ class Palette:
         self._length, self._channels = colors.shape
         self._colors = colors
     
+    def _with_alpha(self, colors):
+        alpha = np.full((len(colors), 1), 255, dtype=np.uint8)
+        if self.transparent is not None:
+            alpha[self.transparent] = 0
+        return np.concatenate([colors, alpha], axis=1)
+
     @property
     def rgba_colors(self):
-        return np.uint8([
-            [*c, 0]
-            if self.transparent is not None and i == self.transparent
-            else [*c, 255]
-            for i, c in enumerate(self.rgb_colors)
-        ])
+        return self._with_alpha(self.rgb_colors)
 
     @property
     def bgr_colors(self):
-        colors = self._colors.reshape((1, self._length, self._channels))
-        return cv2.cvtColor(colors, cv2.COLOR_RGB2BGR).reshape((self._length, self._channels))
+        return np.ascontiguousarray(self._colors[:, ::-1])
 
     @bgr_colors.setter
     def bgr_colors(self, colors):
@@ -137,12 +311,7 @@ class Palette:
     
     @property
     def bgra_colors(self):
-        return np.uint8([
-            [*c, 0]
-            if self.transparent is not None and i == self.transparent
-            else [*c, 255]
-            for i, c in enumerate(self.bgr_colors)
-        ])
+        return self._with_alpha(self.bgr_colors)
 
     @property
     def lab_colors(self):
@@ -150,6 +319,7 @@ class Palette:
 
     @lab_colors.setter
     def lab_colors(self, colors):
+        import cv2
         self._length, self._channels = colors.shape
         colors = colors.reshape((1, self._length, self._channels))
         self._colors = cv2.cvtColor(colors, cv2.COLOR_LAB2RGB).reshape((self._length, self._channels))
@@ -165,6 +335,7 @@ class Palette:
         '''
             Create and save a visual representation of the palette
         '''
+        import cv2
         columns = min(columns, len(self._colors))
         rows = math.ceil(len(self._colors) / columns)
         width = size * columns
@@ -182,16 +353,97 @@ class Palette:
 
         cv2.imwrite(filename, img)
 
-    def quantize(self, img):
+    def color_error(self, lab_colors, rgb_colors, weights=None):
         '''
-            Quantize an image using the palette. Returns the palette index per pixel
+            Mean color difference (delta E) and PSNR (dB) of a set of colors when
+            mapped to their nearest palette color
         '''
-        (h, w, c) = img.shape
-        pixels = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).reshape((h * w, c))
+        from sklearn.metrics import pairwise_distances_argmin
+        palette_lab = self.lab_colors
+        nearest = pairwise_distances_argmin(palette_lab, lab_colors, axis=0)
+
+        delta_e = np.average(Utils.delta_e(lab_colors, palette_lab[nearest]), weights=weights)
+        squared_error = (rgb_colors.astype(np.float64) - self.rgb_colors[nearest]) ** 2
+        mse = np.average(squared_error.mean(axis=1), weights=weights)
+        psnr = math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+        return delta_e, psnr
+
+    def histogram_error(self, histogram):
+        '''
+            Mean color difference (delta E) and PSNR (dB) of the pixels counted in an
+            RGB565 histogram when mapped to the palette
+        '''
+        rgb_colors, lab_colors, counts = Utils.histogram_colors(histogram)
+        return self.color_error(lab_colors, rgb_colors, weights=counts)
+
+    @property
+    def hash(self):
+        return hashlib.sha1(np.ascontiguousarray(self._colors, dtype=np.uint8).tobytes()).hexdigest()
+
+    def rgb565_lut(self):
+        '''
+            Lookup table with the nearest palette index (in LAB) for every RGB565 color.
+            Tables are cached on disk, keyed by the palette hash, and the most recently
+            used ones in memory
+        '''
+        return Palette._rgb565_lut(np.ascontiguousarray(self._colors, dtype=np.uint8).tobytes())
+
+    @staticmethod
+    @functools.lru_cache(maxsize=LUT_CACHE_SIZE)
+    def _rgb565_lut(colors):
+        '''
+            Lookup table of the palette with RGB COLORS (bytes), see rgb565_lut
+        '''
+        key = hashlib.sha1(colors).hexdigest()
+        filename = os.path.join(Palette.LUT_CACHE_DIR, f"lut_{key}.npy")
+        try:
+            lut = np.load(filename)
+            if lut.shape != (0x10000,):
+                raise ValueError("Invalid lookup table")
+        except (OSError, ValueError):
+            from sklearn.metrics import pairwise_distances_argmin
+            with profiling.stage('lut', 0x10000):
+                codes = np.arange(0x10000, dtype=np.uint16)
+                rgb_colors = np.stack(Utils.rgb565_to_rgb(codes), axis=1).astype(np.uint8)
+                palette_lab = Utils.rgb_to_lab(np.frombuffer(colors, dtype=np.uint8).reshape((-1, 3)))
+                lut = pairwise_distances_argmin(palette_lab, Utils.rgb_to_lab(rgb_colors), axis=0).astype(np.uint8)
+
+            try:
+                # Write to a temporary file first, so concurrent runs never read a partial table
+                os.makedirs(Palette.LUT_CACHE_DIR, exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=Palette.LUT_CACHE_DIR, suffix='.npy', delete=False) as f:
+                    np.save(f, lut)
+                os.replace(f.name, filename)
+            except OSError:
+                pass
 
-        pixel_labels = pairwise_distances_argmin(self.lab_colors, pixels, axis=0)
+        return lut
 
-        return pixel_labels
+    def quantize(self, img, method='exact'):
+        '''
+            Quantize an image using the palette. Returns the palette index per pixel.
+            Method 'lut' maps pixels through the cached RGB565 lookup table instead
+            of comparing every pixel against every palette color
+        '''
+        if method == 'lut':
+            lut = self.rgb565_lut()
+            with profiling.stage('quantize', 1):
+                return lut[Utils.bgr_to_rgb565(img).reshape(-1)]
+
+        elif method == 'exact':
+            import cv2
+            from sklearn.metrics import pairwise_distances_argmin
+            with profiling.stage('quantize', 1):
+                (h, w, c) = img.shape
+                pixels = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).reshape((h * w, c))
+
+                pixel_labels = pairwise_distances_argmin(self.lab_colors, pixels, axis=0)
+
+                return pixel_labels
+
+        else:
+            raise ValueError("Unsupported quantization method")
 
     def apply(self, indices, width, height, colormode='BGR'):
         '''
@@ -214,6 +466,57 @@ class Palette:
             raise ValueError("Unsupported color mode")
 
 
+class EBGFrames:
+    '''
+        Read-only sequence of frames stored in an EBG file. Frames are decoded
+        (decompressed and unpacked to one palette index or RGB565 color per pixel) only when accessed.
+        Delta frames are rebuilt from the closest keyframe, or from the last decoded
+        frame when reading in order
+    '''
+    def __init__(self, data, frames, width, height, bits):
+        self.data = data
+        self.frames = frames    # (encoding, offset, size) of each frame in data
+        self.width = width
+        self.height = height
+        self.bits = bits
+        self._last = None       # (index, stored bytes) of the last decoded frame
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _stored(self, index):
+        if self._last is not None and self._last[0] == index:
+            return self._last[1]
+
+        start = index
+        previous = None
+        while self.frames[start][0] == EBG.ENCODING_DELTA:
+            if self._last is not None and self._last[0] == start - 1:
+                previous = self._last[1]
+                break
+            if start == 0:
+                raise ValueError("The first frame can't be a delta frame")
+            start -= 1
+
+        for i in range(start, index + 1):
+            encoding, offset, size = self.frames[i]
+            with profiling.stage('decode', 1):
+                previous = EBG.decode_frame(self.data[offset:offset+size], encoding,
+                                            self.width, self.height, self.bits, previous)
+        self._last = (index, previous)
+        return previous
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Frame index out of range")
+
+        if self.bits == 16:
+            return self._stored(index).view('>u2').astype(np.uint16).reshape(-1)
+        return Utils.unpack_indices(self._stored(index), self.width, self.bits).reshape(-1)
+
+
 class EBG:
     FLAGS_TRANSPARENT = 0b10000000
     FLAGS_COLORMODE = 0b01110000
@@ -227,49 +530,198 @@ class EBG:
     FLAGS_INDEXSIZE = 0b00000100
     FLAGS_INDEXSIZE_BIT = 0b00000000
     FLAGS_INDEXSIZE_BYTE = 0b00000100
+    FLAGS_ENCODED = 0b00000010
+    FLAGS_SHARED_PALETTE = 0b00000001
+
+    ENCODING_RAW = 0
+    ENCODING_RLE = 1
+    ENCODING_LZ = 2
+    ENCODING_DELTA = 3
+    ENCODINGS = {
+        'raw': ENCODING_RAW,
+        'rle': ENCODING_RLE,
+        'lz': ENCODING_LZ,
+        'delta': ENCODING_DELTA
+    }
+    ENCODING_MASK = 0x0F    # High bits of the frame encoding are reserved for per-frame flags
+    FRAME_HEADER_SIZE = 5
 
-    def __init__(self, width, height, bitmaps, palette=None, transparent=None):
+    VERSIONS = (1, 2)
+    HEADER_SIZE = {1: 8, 2: 16}
+
+    C_HEX_BYTES = [f"0x{i:02X}" for i in range(256)]
+    C_BYTES_PER_ROW = 16
+
+    RENDER_CHUNK_FRAMES = 32    # Frames rendered at once when previewing, to bound memory use
+    _rgb565_colors = None
+
+    def __init__(self, width, height, bitmaps, palette=None, transparent=None, version=1):
         self.width = width
         self.height = height
         self.bitmaps = bitmaps
         self.palette = palette
         self.trasparent = transparent
+        self.version = version
 
     @staticmethod
-    def load(filename):
+    def load(filename, offset=0, palette=None):
+        '''
+            Load an EBG file, or an EBG image stored at OFFSET in a larger file (e.g. a pack).
+            Images without their own palette use the shared PALETTE.
+            Bitmaps are memory-mapped, so frame data is only read from disk when accessed
+        '''
         with open(filename, 'rb') as f:
+            f.seek(offset)
             signature = f.read(4)
             assert signature[:3] == "EBG".encode(), "Invalid EBG file"
-            assert signature[3] == 0x01, "Invalid EBG version"
+            version = signature[3]
+            assert version in EBG.VERSIONS, "Invalid EBG version"
 
-            header = f.read(8)
-            width, height, flags, k, transparent_index, frame_count = struct.unpack("<HHBBBB", header)
+            header = f.read(EBG.HEADER_SIZE[version])
+            if version == 1:
+                width, height, flags, k, transparent_index, frame_count = struct.unpack("<HHBBBB", header)
+            else:
+                width, height, flags, k, transparent_index, _, frame_count, _, table_offset = \
+                    struct.unpack("<HHBBBBHHI", header)
 
-            palette = None
-            if flags & EBG.FLAGS_INDEXED:
-                palette = []
-                for i in range(k+1):
-                    palette.append(Utils.rgb565_to_rgb(*struct.unpack("!H", f.read(2))))
-                colors = np.array(palette, dtype=np.uint8)
-                palette = Palette(colors, transparent=transparent_index if flags & EBG.FLAGS_TRANSPARENT else None)
+            transparent = transparent_index if flags & EBG.FLAGS_TRANSPARENT else None
+            if flags & EBG.FLAGS_INDEXED and flags & EBG.FLAGS_SHARED_PALETTE:
+                if palette is None or len(palette) != k + 1:
+                    raise ValueError(f"Image requires a shared palette of {k + 1} colors")
+                palette = Palette(palette.rgb_colors, transparent=transparent)
+            elif flags & EBG.FLAGS_INDEXED:
+                colors = np.frombuffer(f.read(2 * (k+1)), dtype='>u2')
+                colors = np.stack(Utils.rgb565_to_rgb(colors), axis=1).astype(np.uint8)
+                palette = Palette(colors, transparent=transparent)
+            else:
+                palette = None
 
-            if flags & EBG.FLAGS_INDEXED and flags & EBG.FLAGS_INDEXSIZE_BYTE:
-                pixel_size = 1
+            if not flags & EBG.FLAGS_INDEXED:
+                if flags & EBG.FLAGS_COLORMODE != EBG.FLAGS_COLORMODE_RGB565:
+                    raise NotImplementedError
+                index_bits = 16     # RGB565 pixels
+            elif flags & EBG.FLAGS_INDEXSIZE_BYTE:
+                index_bits = 8
             else:
-                raise NotImplementedError
+                index_bits = Utils.index_bits(k + 1)
+                if index_bits == 8:
+                    raise ValueError("Packed indices are only supported for palettes of up to 16 colors")
 
-            bitmaps = []
-            for i in range(frame_count):
-                bitmap_bytes = f.read(width * height)
-                bitmap = []
-                for i in range(0, len(bitmap_bytes), pixel_size):
-                    bitmap.append(struct.unpack("!B", bitmap_bytes[i:i+pixel_size]))
-                bitmaps.append(np.array(bitmap, dtype=np.uint8).reshape(-1))
+            bitmap_offset = f.tell()
+            frame_size = height * Utils.row_size(width, index_bits)
 
-        return EBG(width, height, bitmaps, palette=palette)
+            if version == 2:
+                # Frame headers are located through the frame offset table
+                f.seek(offset + table_offset)
+                offsets = offset + np.frombuffer(f.read(4 * frame_count), dtype='<u4').astype(np.int64)
+                headers = np.memmap(filename, dtype=np.uint8, mode='r')[offsets[:, None] + np.arange(EBG.FRAME_HEADER_SIZE)]
+                encodings = headers[:, 0] & EBG.ENCODING_MASK
+                sizes = np.ascontiguousarray(headers[:, 1:]).view('<u4').reshape(-1)
+                frames = list(zip(encodings.tolist(), (offsets + EBG.FRAME_HEADER_SIZE).tolist(), sizes.tolist()))
+            elif flags & EBG.FLAGS_ENCODED:
+                # Frames have different sizes, walk their headers to locate them
+                frames = []
+                position = bitmap_offset
+                for i in range(frame_count):
+                    f.seek(position)
+                    encoding, size = struct.unpack("<BI", f.read(EBG.FRAME_HEADER_SIZE))
+                    frames.append((encoding & EBG.ENCODING_MASK, position + EBG.FRAME_HEADER_SIZE, size))
+                    position += EBG.FRAME_HEADER_SIZE + size
+            else:
+                frames = [(EBG.ENCODING_RAW, bitmap_offset + i * frame_size, frame_size) for i in range(frame_count)]
 
-    def save(self, filename):
-        '''- ['E', 'B', 'G', '1'] (4 bytes) (???)
+        if version == 1 and index_bits in (8, 16) and not flags & EBG.FLAGS_ENCODED:
+            # Raw byte indices and RGB565 pixels can be used straight from the file
+            dtype = np.uint8 if index_bits == 8 else np.dtype('>u2')
+            if frame_count > 0:
+                bitmaps = np.memmap(filename, dtype=dtype, mode='r', offset=bitmap_offset,
+                                    shape=(frame_count, width * height))
+            else:
+                bitmaps = np.empty((0, width * height), dtype=dtype)
+        else:
+            bitmaps = EBGFrames(np.memmap(filename, dtype=np.uint8, mode='r'), frames, width, height, index_bits)
+
+        return EBG(width, height, bitmaps, palette=palette, version=version)
+
+    @staticmethod
+    def encode_frame(data, encoding, width, bits, previous=None):
+        '''
+            Encode the stored bytes of a frame, with shape (height, row size).
+            Delta frames are encoded against the PREVIOUS stored frame
+        '''
+        if encoding == EBG.ENCODING_RAW:
+            return np.ascontiguousarray(data, dtype=np.uint8).tobytes()
+        elif encoding == EBG.ENCODING_RLE:
+            return compression.rle_encode(data, Utils.row_size(width, bits))
+        elif encoding == EBG.ENCODING_LZ:
+            return compression.lz_encode(data)
+        elif encoding == EBG.ENCODING_DELTA:
+            if previous is None:
+                raise ValueError("Delta frames need a previous frame")
+            return compression.delta_encode(previous, data, width, bits)
+        else:
+            raise ValueError(f"Unsupported frame encoding: {encoding}")
+
+    @staticmethod
+    def decode_frame(payload, encoding, width, height, bits, previous=None):
+        '''
+            Decode a frame payload back to its stored bytes, with shape (height, row size).
+            Delta frames are applied on top of the PREVIOUS stored frame
+        '''
+        row_size = Utils.row_size(width, bits)
+        size = height * row_size
+
+        if encoding == EBG.ENCODING_RAW:
+            if len(payload) != size:
+                raise ValueError("Invalid raw frame size")
+            data = np.asarray(payload, dtype=np.uint8)
+        elif encoding == EBG.ENCODING_RLE:
+            data = compression.rle_decode(payload, size)
+        elif encoding == EBG.ENCODING_LZ:
+            data = compression.lz_decode(payload, size)
+        elif encoding == EBG.ENCODING_DELTA:
+            if previous is None:
+                raise ValueError("Delta frames need a previous frame")
+            data = compression.delta_decode(payload, previous, width, bits)
+        else:
+            raise ValueError(f"Unsupported frame encoding: {encoding}")
+
+        return data.reshape((height, row_size))
+
+    def __len__(self):
+        return len(self.bitmaps)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    @staticmethod
+    def _native(bitmap):
+        # RGB565 pixels are big-endian in files, frames have the native uint16 of converted images
+        bitmap = np.asarray(bitmap)
+        return bitmap if bitmap.dtype.isnative else bitmap.astype(bitmap.dtype.newbyteorder('='))
+
+    def frame(self, index):
+        '''
+            Get a single frame as a (height, width) array of palette indices, or RGB565 colors
+            (native uint16) for images without a palette
+        '''
+        return EBG._native(self.bitmaps[index]).reshape((self.height, self.width))
+
+    @property
+    def frames(self):
+        '''
+            All frames as a (frames, height, width) array. Memory-mapped index bitmaps are not copied
+        '''
+        if isinstance(self.bitmaps, np.ndarray):
+            return EBG._native(self.bitmaps).reshape((len(self.bitmaps), self.height, self.width))
+        if len(self.bitmaps) == 0:
+            return np.empty((0, self.height, self.width), dtype=np.uint8)
+        return np.stack([self.frame(i) for i in range(len(self))])
+
+    def save(self, filename, index_bits=None, encodings=None, version=None, keyframe_interval=None,
+             shared_palette=False):
+        '''- ['E', 'B', 'G', version] (4 bytes), version 1 or 2
         - Width (2 bytes)
         - Height (2 bytes)
         - Flags (1 byte)
@@ -277,76 +729,426 @@ class EBG:
             + Color mode [mono, gray, RGB565, RGB888, RGBA...] (3-bit)
             + Indexed [enable palette] (1-bit)
             + Index size [bit, byte] (1-bit)
-            + Reserved (2-bit)
+            + Encoded frames [enable frame headers] (1-bit)
+            + Shared palette [palette not stored, provided by the pack file] (1-bit)
         - Palette size - 1 (1 byte, 1-256)
         - Transparent index (1 byte)
-        - Frame count (1 byte)
+        - Version 1:
+            + Frame count (1 byte)
+        - Version 2:
+            + Reserved (1 byte)
+            + Frame count (2 bytes)
+            + Reserved (2 bytes)
+            + Frame offset table position in the file (4 bytes)
         - Palette (1-256 * sizeof(color)), includes transparent color if transparent is enabled
-        - Bitmap'''
+        - Bitmap
+            + No palette: one RGB565 color per pixel (2 bytes, big-endian: the display byte order)
+            + Byte index size: one palette index per byte
+            + Bit index size: 1, 2 or 4 bits per index (smallest that fits the palette size),
+              most significant bits first. Each row is padded to a whole byte
+            + Encoded frames: each frame is preceded by its encoding [raw, RLE, LZ, delta] (1 byte)
+              and its size in bytes (4 bytes). Delta frames only store the rectangles that
+              changed from the previous frame. The first frame is never a delta frame.
+              The high 4 bits of the encoding are reserved for per-frame flags
+            + Version 2: every frame has an encoding and size header
+        - Version 2: frame offset table, with the file position of each frame header (4 bytes each)
 
-        with open(filename, 'wb') as f:
-            f.write(struct.pack("!BBBB", *[ord(c) for c in "EBG"], 1))
-            flags = 0
-            flags |= EBG.FLAGS_COLORMODE_RGB565
-            flags |= EBG.FLAGS_INDEXED
-            flags |= EBG.FLAGS_INDEXSIZE_BYTE
-            if self.palette.transparent is not None:
-                flags |= EBG.FLAGS_TRANSPARENT
-            # Header
-            f.write(struct.pack("<HHBBBB",
-                                self.width,
-                                self.height,
-                                flags,
-                                0 if self.palette is None else len(self.palette) - 1,
-                                0 if self.palette.transparent is None else self.palette.transparent,
-                                len(self.bitmaps)))
-
-            # Palette
-            if self.palette is not None:
-                for color in self.palette.rgb_colors:
-                    f.write(struct.pack("!H", Utils.rgb_to_rgb565(*color)))
-
-            # Bitmap indices
+        Integers are little-endian. Version 1 stores up to 255 frames and version 2 up to 65535.
+        Index size defaults to the smallest one for the palette, unless INDEX_BITS is given.
+        ENCODINGS lists the frame encodings allowed (e.g. ['rle', 'lz']). Each frame is
+        stored with whichever of them (or raw) is smallest. Every KEYFRAME_INTERVAL frames,
+        a frame is stored without delta encoding, to bound the cost of seeking.
+        Version defaults to the version the file was loaded from. With SHARED_PALETTE, the
+        palette is left out, for images in a pack file with a shared palette'''
+
+        with EBGWriter(filename, self.width, self.height, palette=self.palette,
+                       index_bits=index_bits, encodings=encodings,
+                       version=self.version if version is None else version,
+                       keyframe_interval=keyframe_interval, shared_palette=shared_palette) as writer:
             for bitmap in self.bitmaps:
-                for index in bitmap:
-                    f.write(struct.pack("!B", index))
+                writer.write_frame(bitmap)
 
-    def save_img(self, filename, mode='image'):
+    def color_table(self, colormode='BGR'):
+        '''
+            Color of every stored pixel value, as a (values, channels) table: the palette
+            colors, or every RGB565 color for images without a palette
+        '''
         if self.palette is not None:
-            if len(self.bitmaps) < 2:
-                img = self.palette.apply(self.bitmaps[0], self.width, self.height, 'BGR' if self.palette.transparent is None else 'BGRA')
-                cv2.imwrite(f"{filename}.png", img)
-
-            else:
-                if mode == 'image':
-                    images = [self.palette.apply(bmp, self.width, self.height, 'BGR' if self.palette.transparent is None else 'BGRA') for bmp in self.bitmaps]
-                    cv2.imwrite(f"{filename}.png", np.hstack(images))
+            return getattr(self.palette, f"{colormode.lower()}_colors")
 
-                elif mode == 'gif':
-                    images = [self.palette.apply(bmp, self.width, self.height, 'RGB' if self.palette.transparent is None else 'RGBA') for bmp in self.bitmaps]
-                    imageio.mimsave(f"{filename}.gif", images)
+        if EBG._rgb565_colors is None:
+            EBG._rgb565_colors = np.stack(Utils.rgb565_to_rgb(np.arange(0x10000)), axis=1).astype(np.uint8)
+        colors = EBG._rgb565_colors if colormode[:3] == 'RGB' else EBG._rgb565_colors[:, ::-1]
+        if len(colormode) == 4:
+            colors = np.concatenate([colors, np.full((len(colors), 1), 255, dtype=np.uint8)], axis=1)
+        return colors
 
-                else:   # 'folder'
-                    images = [self.palette.apply(bmp, self.width, self.height, 'BGR' if self.palette.transparent is None else 'BGRA') for bmp in self.bitmaps]
+    def apply(self, bitmap, colormode='BGR'):
+        '''
+            Convert a frame to a (height, width, channels) image
+        '''
+        if self.palette is not None:
+            return self.palette.apply(np.asarray(bitmap).reshape(-1), self.width, self.height, colormode)
+        return self.color_table(colormode)[np.asarray(bitmap).reshape((self.height, self.width))]
 
-                    os.makedirs(filename, exist_ok=True)
-                    for i, image in enumerate(images):
-                        cv2.imwrite(os.path.join(filename, f'frame_{i}.png'), image)
+    def render(self, start=0, stop=None, colormode='BGR', table=None):
+        '''
+            Frames from START to STOP (excluded) as a (frames, height, width, channels) array,
+            with a single lookup of every pixel in the color TABLE (default: color_table(colormode))
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        if table is None:
+            table = self.color_table(colormode)
 
+        if isinstance(self.bitmaps, np.ndarray):
+            indices = self.bitmaps[start:stop]
         else:
-            raise NotImplementedError
+            indices = np.stack([np.asarray(self.bitmaps[i]).reshape(-1) for i in range(start, stop)]) \
+                if stop > start else np.empty((0, self.width * self.height), dtype=np.uint8)
+        with profiling.stage('render', max(stop - start, 0)):
+            return table[np.asarray(indices).reshape((-1, self.height, self.width))]
+
+    def render_chunks(self, colormode='BGR', chunk_frames=None):
+        '''
+            Render every frame in chunks of CHUNK_FRAMES, yielding (first frame, images)
+        '''
+        chunk_frames = chunk_frames or EBG.RENDER_CHUNK_FRAMES
+        table = self.color_table(colormode)
+        for start in range(0, len(self), chunk_frames):
+            yield start, self.render(start, start + chunk_frames, table=table)
+
+    def save_img(self, filename, mode='image', jobs=None):
+        '''
+            Save a preview of the frames: a PNG strip (image), an animated GIF (gif) or a PNG
+            per frame (folder). Frames are rendered in chunks, so GIF and folder previews use
+            bounded memory. Folder PNGs are written by JOBS threads (default: number of CPUs)
+        '''
+        import cv2
+        alpha = self.palette is not None and self.palette.transparent is not None
+        bgr = 'BGRA' if alpha else 'BGR'
+
+        if len(self.bitmaps) < 2:
+            image = self.render(0, 1, bgr)[0]
+            with profiling.stage('write', 1):
+                cv2.imwrite(f"{filename}.png", image)
+
+        elif mode == 'image':
+            strip = np.empty((self.height, len(self), self.width, len(bgr)), dtype=np.uint8)
+            for start, images in self.render_chunks(bgr):
+                strip[:, start:start+len(images)] = images.transpose((1, 0, 2, 3))
+            with profiling.stage('write', len(self)):
+                cv2.imwrite(f"{filename}.png", strip.reshape((self.height, -1, len(bgr))))
+
+        elif mode == 'gif':
+            # Frames are appended one at a time, instead of collecting the whole animation first
+            import imageio
+            with imageio.get_writer(f"{filename}.gif", mode='I') as writer:
+                for _, images in self.render_chunks('RGBA' if alpha else 'RGB'):
+                    for image in images:
+                        with profiling.stage('write', 1):
+                            writer.append_data(image)
+
+        else:   # 'folder'
+            os.makedirs(filename, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = []
+                for start, images in self.render_chunks(bgr):
+                    # Render the next chunk while the previous one is written, keeping at most two in memory
+                    for future in pending:
+                        future.result()
+                    pending = [executor.submit(EBG._write_png, os.path.join(filename, f'frame_{start + i}.png'), image)
+                               for i, image in enumerate(images)]
+                for future in pending:
+                    future.result()
   
-    def save_c_header(self, filename):
-        raise NotImplementedError
+    @staticmethod
+    def _write_png(filename, image):
+        import cv2
+        with profiling.stage('write', 1):
+            return cv2.imwrite(filename, image)
+
+    def to_bytes(self, **options):
+        '''
+            EBG file contents, with the same OPTIONS as save
+        '''
+        with io.BytesIO() as f:
+            self.save(f, **options)
+            return f.getvalue()
+
+    def save_c_header(self, filename, name=None, **options):
+        '''
+            Save the EBG file contents as a const byte array, to be loaded from flash
+            with g_img_from_memory. NAME defaults to the file name. OPTIONS are the same as save
+        '''
+        EBG.save_c_array(filename, self.to_bytes(**options), name)
+
+    @staticmethod
+    def save_c_array(filename, data, name=None):
+        '''
+            Save EBG file contents (bytes) as a C header with a const byte array
+        '''
+        if name is None:
+            name = re.sub(r'\W', '_', os.path.splitext(os.path.basename(filename))[0])
+            if name[:1].isdigit():
+                name = f"_{name}"
+
+        # Bytes are formatted through a lookup table, one row at a time
+        rows = (', '.join(map(EBG.C_HEX_BYTES.__getitem__, data[i:i+EBG.C_BYTES_PER_ROW]))
+                for i in range(0, len(data), EBG.C_BYTES_PER_ROW))
 
         with open(filename, 'w') as f:
-            f.write('#include "graphics.h"\n\nconst uint8_t palette[] = {\n\t')
-            f.write(', '.join(
-                f"0x{hex_repr[0:2]},0x{hex_repr[2:4]}"
-                for hex_repr in [
-                f"{rgb_to_rgb565(*color):04X}"
-                for color in palette
-                ]))
-            f.write('\n};\n\nconst uint8_t bitmap[] = {\n\t')
-            f.write(','.join(f"0x{i:02X}" for i in indices))
-            f.write('\n};\n')
+            f.write('#include "img.h"\n\n')
+            f.write(f"// EBG image, load with g_img_from_memory({name}, {name}_size)\n")
+            f.write(f"const uint8_t {name}[] __attribute__((aligned(4))) = {{\n\t")
+            f.write(',\n\t'.join(rows))
+            f.write(f"\n}};\nconst size_t {name}_size = {len(data)};\n")
+
+
+class EBGWriter:
+    '''
+        Write an EBG file one frame at a time. Header and palette are written
+        up front and the frame count (and frame offset table in version 2) is
+        written when the writer is closed. FILENAME can also be a seekable binary
+        file object, which is left open
+    '''
+    FRAME_COUNT_OFFSET = {1: 11, 2: 12}
+    FRAME_TABLE_OFFSET = 16
+    MAX_FRAMES = {1: 255, 2: 65535}
+
+    def __init__(self, filename, width, height, palette=None, index_bits=None, encodings=None,
+                 version=1, keyframe_interval=None, shared_palette=False):
+        if version not in EBG.VERSIONS:
+            raise ValueError(f"Unsupported EBG version: {version}")
+        if keyframe_interval is not None and keyframe_interval < 1:
+            raise ValueError("Keyframe interval must be at least 1")
+
+        if encodings is not None:
+            if any(e not in EBG.ENCODINGS for e in encodings):
+                raise ValueError(f"Unsupported frame encodings: {encodings}")
+            encodings = sorted({EBG.ENCODING_RAW, *(EBG.ENCODINGS[e] for e in encodings)})
+        elif version == 2:
+            # Version 2 frames always have a header
+            encodings = [EBG.ENCODING_RAW]
+
+        if palette is None:
+            # Full-color RGB565 pixels
+            if index_bits is not None or shared_palette:
+                raise ValueError("Index size and shared palettes require a palette")
+            index_bits = 16
+        elif index_bits is None:
+            index_bits = Utils.index_bits(len(palette))
+        elif index_bits not in (1, 2, 4, 8) or (index_bits < 8 and index_bits != Utils.index_bits(len(palette))):
+            raise ValueError(f"Invalid index size for a palette of {len(palette)} colors: {index_bits} bits")
+
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.index_bits = index_bits    # Bits per stored pixel: 1, 2, 4 or 8-bit indices, or 16-bit RGB565
+        self.encodings = encodings
+        self.version = version
+        self.keyframe_interval = keyframe_interval
+        self.shared_palette = shared_palette
+        self.frame_count = 0
+        self._previous = None   # Stored bytes of the last frame, for delta frames
+        self._offsets = []      # File position of every frame, for the version 2 frame table
+
+        self._owns_file = not hasattr(filename, 'write')
+        self._file = open(filename, 'wb') if self._owns_file else filename
+        self._start = self._file.tell()
+        self._closed = False
+        try:
+            self._write_header()
+        except:
+            self._closed = True
+            if self._owns_file:
+                self._file.close()
+            raise
+
+    def _write_header(self):
+        flags = 0
+        flags |= EBG.FLAGS_COLORMODE_RGB565
+        if self.palette is not None:
+            flags |= EBG.FLAGS_INDEXED
+            flags |= EBG.FLAGS_INDEXSIZE_BYTE if self.index_bits == 8 else EBG.FLAGS_INDEXSIZE_BIT
+            if self.palette.transparent is not None:
+                flags |= EBG.FLAGS_TRANSPARENT
+            if self.shared_palette:
+                flags |= EBG.FLAGS_SHARED_PALETTE
+        if self.encodings is not None:
+            flags |= EBG.FLAGS_ENCODED
+
+        palette_size = 1 if self.palette is None else len(self.palette)
+        transparent_index = 0 if self.palette is None or self.palette.transparent is None else self.palette.transparent
+        self._file.write(struct.pack("!BBBB", *[ord(c) for c in "EBG"], self.version))
+        if self.version == 1:
+            self._file.write(struct.pack("<HHBBBB", self.width, self.height, flags,
+                                         palette_size - 1, transparent_index, 0))
+        else:
+            self._file.write(struct.pack("<HHBBBBHHI", self.width, self.height, flags,
+                                         palette_size - 1, transparent_index, 0, 0, 0, 0))
+
+        if self.palette is None or self.shared_palette:
+            return
+        colors = self.palette.rgb_colors.astype(np.uint16)
+        colors = Utils.rgb_to_rgb565(colors[:, 0], colors[:, 1], colors[:, 2])
+        self._file.write(colors.astype('>u2').tobytes())
+
+    def write_frame(self, bitmap):
+        '''
+            Append a frame of palette indices (packed if needed), or RGB565 colors
+            for images without a palette, with a single write
+        '''
+        with profiling.stage('write', 1):
+            bitmap = np.asarray(bitmap)
+            if bitmap.size != self.width * self.height:
+                raise ValueError("Width and height do not match number of palette indices")
+            if self.frame_count >= EBGWriter.MAX_FRAMES[self.version]:
+                raise ValueError(f"EBG version {self.version} files can't store more than "
+                                 f"{EBGWriter.MAX_FRAMES[self.version]} frames")
+
+            bitmap = bitmap.reshape((self.height, self.width))
+            if self.index_bits == 16:
+                # Big-endian, so the device can copy rows straight to the display buffer
+                bitmap = bitmap.astype('>u2').view(np.uint8)
+            elif self.index_bits < 8:
+                bitmap = Utils.pack_indices(bitmap.astype(np.uint8), self.index_bits)
+            else:
+                bitmap = np.ascontiguousarray(bitmap, dtype=np.uint8)
+
+            if self.encodings is None:
+                self._file.write(bitmap.data)
+            else:
+                # Keep the smallest encoding for this frame. Delta frames need the previous one
+                keyframe = self._previous is None or \
+                    (self.keyframe_interval is not None and self.frame_count % self.keyframe_interval == 0)
+                encodings = [e for e in self.encodings if e != EBG.ENCODING_DELTA or not keyframe]
+                encoding, payload = min(
+                    ((e, EBG.encode_frame(bitmap, e, self.width, self.index_bits, self._previous)) for e in encodings),
+                    key=lambda encoded: len(encoded[1]))
+                self._offsets.append(self._file.tell() - self._start)
+                self._file.write(struct.pack("<BI", encoding, len(payload)) + payload)
+                self._previous = bitmap
+
+            self.frame_count += 1
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            end = self._file.tell()
+            if self.version == 1:
+                self._file.seek(self._start + EBGWriter.FRAME_COUNT_OFFSET[1])
+                self._file.write(struct.pack("<B", self.frame_count))
+            else:
+                # Frame offset table goes after the frames, so frames can be streamed
+                self._file.write(np.array(self._offsets, dtype='<u4').tobytes())
+                self._file.seek(self._start + EBGWriter.FRAME_COUNT_OFFSET[2])
+                self._file.write(struct.pack("<H", self.frame_count))
+                self._file.seek(self._start + EBGWriter.FRAME_TABLE_OFFSET)
+                self._file.write(struct.pack("<I", end - self._start))
+            self._file.seek(0, io.SEEK_END)
+        finally:
+            if self._owns_file:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class EBGPack:
+    '''
+        Read-only pack of EBG images, looked up by index or by name.
+
+        - ['E', 'B', 'P', 1] (4 bytes)
+        - Entry count (2 bytes)
+        - Flags (1 byte)
+            + Shared palette [entries use the pack palette] (1-bit)
+            + Reserved (7-bit)
+        - Shared palette size - 1 (1 byte)
+        - Name table position in the file (4 bytes)
+        - Shared palette (RGB565, 2 bytes per color), if enabled
+        - Directory, sorted by name hash: FNV-1a hash of the name, position in the file and
+          size of every entry (4 bytes each)
+        - Entries: EBG images. With a shared palette, indexed images leave their palette out
+        - Name table: length (1 byte) and UTF-8 name of every entry, in directory order
+    '''
+    SIGNATURE = b"EBP"
+    VERSION = 1
+    HEADER_SIZE = 12
+    ENTRY_SIZE = 12
+    FLAGS_SHARED_PALETTE = 0b10000000
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            signature = f.read(4)
+            assert signature[:3] == EBGPack.SIGNATURE, "Invalid EBG pack file"
+            assert signature[3] == EBGPack.VERSION, "Invalid EBG pack version"
+
+            count, flags, k, names_offset = struct.unpack("<HBBI", f.read(EBGPack.HEADER_SIZE - 4))
+
+            self.palette = None
+            if flags & EBGPack.FLAGS_SHARED_PALETTE:
+                colors = np.frombuffer(f.read(2 * (k+1)), dtype='>u2')
+                self.palette = Palette(np.stack(Utils.rgb565_to_rgb(colors), axis=1).astype(np.uint8))
+
+            directory = np.frombuffer(f.read(EBGPack.ENTRY_SIZE * count), dtype='<u4').reshape((count, 3))
+            self.hashes, self.offsets, self.sizes = (directory[:, i].astype(np.int64) for i in range(3))
+
+            f.seek(names_offset)
+            names = f.read()
+            self.names = []
+            position = 0
+            for i in range(count):
+                length = names[position]
+                self.names.append(names[position+1:position+1+length].decode('utf-8'))
+                position += 1 + length
+
+    @staticmethod
+    def hash(name):
+        '''
+            32-bit FNV-1a hash of an entry name
+        '''
+        h = 0x811C9DC5
+        for byte in name.encode('utf-8'):
+            h = ((h ^ byte) * 0x01000193) & 0xFFFFFFFF
+        return h
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        '''
+            Index of the entry called NAME
+        '''
+        h = EBGPack.hash(name)
+        i = int(np.searchsorted(self.hashes, h))
+        if i == len(self) or self.hashes[i] != h:
+            raise KeyError(name)
+        return i
+
+    def __getitem__(self, key):
+        '''
+            Entry by index or name, as an EBG
+        '''
+        index = self.index(key) if isinstance(key, str) else key
+        return EBG.load(self.filename, offset=int(self.offsets[index]), palette=self.palette)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def data(self, key):
+        '''
+            EBG file contents of an entry
+        '''
+        index = self.index(key) if isinstance(key, str) else key
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offsets[index])
+            return f.read(self.sizes[index])
@@ -2,6 +2,7 @@ import os
 from argparse import ArgumentParser
 from enum import Enum
 from ebg import EBG
+import profiling
 
 class OutputFormat(Enum):
     IMAGE = 'image'
@@ -12,6 +13,23 @@ class OutputFormat(Enum):
         return self.value
 
 
+def render_ebg(image, output=None, format=OutputFormat.IMAGE, jobs=None):
+    '''
+        Save a preview of an EBG file: a PNG strip (image), an animated GIF (gif) or a folder with
+        a PNG per frame (folder). OUTPUT defaults to {image}_preview. Returns the output filename
+    '''
+    format = OutputFormat(str(format))
+    output = output if output else f"{os.path.splitext(image)[0]}_preview"
+
+    with profiling.stage('load', 1):
+        img = EBG.load(image)
+    img.save_img(output, mode=str(format), jobs=jobs)
+
+    if format == OutputFormat.FOLDER and len(img) >= 2:
+        return output
+    return f"{output}.gif" if format == OutputFormat.GIF and len(img) >= 2 else f"{output}.png"
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
 
@@ -19,10 +37,13 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--format', type=OutputFormat, choices=list(OutputFormat), help="Output format. Default=image", default=OutputFormat.IMAGE)
     parser.add_argument('-o', '--output', type=str,
                         help="Saved image filename. Default: {input}_preview", default=None)
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="Number of threads writing PNG files in folder format. Default: number of CPUs", default=None)
+    parser.add_argument('--profile', type=str, default=None,
+                        help="Save the time, CPU time, peak memory and item count of each stage to this JSON file, "
+                             "and a Chrome trace next to it")
 
     args = parser.parse_args()
 
-    output_filename = args.output if args.output else f"{os.path.splitext(args.image)[0]}_preview"
-
-    img = EBG.load(args.image)
-    img.save_img(output_filename, mode=str(args.format))
+    with profiling.profile(args.profile):
+        render_ebg(args.image, args.output, args.format, args.jobs)
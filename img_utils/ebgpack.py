@@ -0,0 +1,152 @@
+'''
+Combine many EBG images into a single pack file.
+
+Entries are looked up by name through a directory sorted by name hash, so the
+device can keep one file open and fetch any entry by index without walking
+the pack. Names are the paths of the inputs relative to their directory,
+without extension. With a shared palette, the palettes of every indexed image
+are merged into one, stored once in the pack.
+'''
+import os
+import re
+import glob
+import struct
+from argparse import ArgumentParser
+
+import numpy as np
+
+from ebg import EBG, EBGPack, Palette, Utils
+
+MAX_SHARED_COLORS = 256
+
+
+def collect_entries(inputs):
+    '''
+        Expand pack inputs (EBG files, directories or glob patterns) into (name, filename) entries
+    '''
+    entries = []
+    for value in inputs:
+        if os.path.isdir(value):
+            for root, dirs, files in os.walk(value):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.lower().endswith('.ebg'):
+                        path = os.path.join(root, filename)
+                        name = os.path.splitext(os.path.relpath(path, value))[0]
+                        entries.append((name.replace(os.sep, '/'), path))
+        else:
+            for path in sorted(glob.glob(value, recursive=True)) or [value]:
+                entries.append((os.path.splitext(os.path.basename(path))[0], path))
+    return entries
+
+def shared_palette(images):
+    '''
+        Union of the palettes of every indexed image, as a palette and the
+        index remapping table of every image (None for RGB565 images)
+    '''
+    colors = [Utils.rgb_to_rgb565(*img.palette.rgb_colors.astype(np.uint16).T)
+              if img.palette is not None else None for img in images]
+    indexed = [c for c in colors if c is not None]
+    if len(indexed) == 0:
+        raise ValueError("A shared palette needs at least one indexed image")
+
+    union = np.unique(np.concatenate(indexed))
+    if len(union) > MAX_SHARED_COLORS:
+        raise ValueError(f"Shared palette would have {len(union)} colors, at most {MAX_SHARED_COLORS} are supported")
+
+    palette = Palette(np.stack(Utils.rgb565_to_rgb(union), axis=1).astype(np.uint8))
+    remaps = [None if c is None else np.searchsorted(union, c).astype(np.uint8) for c in colors]
+    return palette, remaps
+
+def build_pack(filename, entries, share_palette=False, encodings=None):
+    '''
+        Write a pack file with (name, EBG filename) ENTRIES. With SHARE_PALETTE,
+        indexed images are re-encoded against a single palette with ENCODINGS
+    '''
+    entries = sorted(entries, key=lambda entry: EBGPack.hash(entry[0]))
+    hashes = [EBGPack.hash(name) for name, _ in entries]
+    for i in range(1, len(entries)):
+        if hashes[i] == hashes[i-1]:
+            raise ValueError(f"Duplicate pack entry name (or hash): '{entries[i-1][0]}', '{entries[i][0]}'")
+    if len(entries) > 0xFFFF:
+        raise ValueError("Packs can't store more than 65535 entries")
+
+    names = [name.encode('utf-8') for name, _ in entries]
+    if any(len(name) > 255 for name in names):
+        raise ValueError("Pack entry names can't be longer than 255 bytes")
+
+    palette = None
+    if share_palette:
+        images = [EBG.load(path) for _, path in entries]
+        palette, remaps = shared_palette(images)
+
+    with open(filename, 'wb') as f:
+        # Header and directory are rewritten once the entry positions are known
+        directory_offset = EBGPack.HEADER_SIZE + (0 if palette is None else 2 * len(palette))
+        f.seek(directory_offset + EBGPack.ENTRY_SIZE * len(entries))
+
+        directory = []
+        for i, (name, path) in enumerate(entries):
+            offset = f.tell()
+            if palette is None or remaps[i] is None:
+                with open(path, 'rb') as entry:
+                    f.write(entry.read())
+            else:
+                img = images[i]
+                transparent = img.palette.transparent
+                img = EBG(img.width, img.height, remaps[i][img.frames],
+                          palette=Palette(palette.rgb_colors,
+                                          transparent=None if transparent is None else int(remaps[i][transparent])),
+                          version=img.version)
+                img.save(f, encodings=encodings, shared_palette=True)
+            directory.append((hashes[i], offset, f.tell() - offset))
+
+        names_offset = f.tell()
+        f.write(b''.join(struct.pack("<B", len(name)) + name for name in names))
+
+        f.seek(0)
+        f.write(EBGPack.SIGNATURE + struct.pack("<BHBBI", EBGPack.VERSION, len(entries),
+                                                0 if palette is None else EBGPack.FLAGS_SHARED_PALETTE,
+                                                0 if palette is None else len(palette) - 1, names_offset))
+        if palette is not None:
+            colors = palette.rgb_colors.astype(np.uint16)
+            f.write(Utils.rgb_to_rgb565(colors[:, 0], colors[:, 1], colors[:, 2]).astype('>u2').tobytes())
+        f.write(np.array(directory, dtype='<u4').tobytes())
+
+    return entries
+
+def save_index_header(filename, entries, prefix):
+    '''
+        Save a C header with the pack index of every entry, in directory order
+    '''
+    with open(filename, 'w') as f:
+        f.write("#pragma once\n\n")
+        for i, (name, _) in enumerate(entries):
+            define = re.sub(r'\W', '_', name).upper()
+            f.write(f"#define {prefix}{define} {i}\n")
+        f.write(f"\n#define {prefix}COUNT {len(entries)}\n")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Combine EBG images into a pack file")
+    parser.add_argument('inputs', nargs='+', type=str,
+                        help="EBG files, glob patterns or directories (packed recursively)")
+    parser.add_argument('-o', '--output', type=str, required=True, help="Pack filename")
+    parser.add_argument('-p', '--shared-palette', action='store_true',
+                        help="Merge the palettes of indexed images into a single palette stored once in the pack")
+    parser.add_argument('-z', '--encodings', type=str, nargs='+', choices=list(EBG.ENCODINGS), default=None,
+                        help="Frame encodings for images re-encoded with the shared palette")
+    parser.add_argument('--index-header', type=str, default=None,
+                        help="Save a C header with #define entry indices")
+    parser.add_argument('--prefix', type=str, default='PACK_',
+                        help="Prefix of the entry index defines. Default: PACK_")
+    args = parser.parse_args()
+
+    if args.encodings is not None and not args.shared_palette:
+        parser.error("Encodings only apply to images re-encoded with --shared-palette")
+
+    entries = build_pack(args.output, collect_entries(args.inputs), args.shared_palette, args.encodings)
+    print(f"{len(entries)} entries packed into '{args.output}' ({os.path.getsize(args.output)} B)")
+
+    if args.index_header:
+        save_index_header(args.index_header, entries, args.prefix)
@@ -0,0 +1,537 @@
+'''
+Host-side model of the graphics.c drawing pipeline.
+
+Drawing happens in a Virtual Display Buffer (VDB) that slides down the refresh
+region, as in g_refresh_region, and is sent to the display on every flush
+while the other buffer takes its place. Primitives are vectorized versions of
+the g_draw_* functions, with the same clipping and rounding, so previews match
+the device. Colors are g_color_t values: RGB565 in display byte order (see
+HEX_TO_COLOR). The model counts flushes, bytes sent to display_send_color16 and
+the pixels each draw call writes into the VDB, to compare VDB sizes, refresh
+regions and assets without flashing hardware.
+'''
+import os
+import re
+import time
+import functools
+from argparse import ArgumentParser
+
+import numpy as np
+
+from ebg import EBG, Utils
+
+DEFAULT_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fonts', 'base.h')
+G_FILLED = 0
+
+
+def hex_to_color(value):
+    '''
+        RGB565 color to g_color_t (HEX_TO_COLOR)
+    '''
+    return ((value & 0xFF) << 8) | ((value >> 8) & 0xFF)
+
+def rgb_to_color(r, g, b):
+    return hex_to_color(Utils.rgb_to_rgb565(r, g, b))
+
+def color_to_rgb(colors):
+    '''
+        g_color_t values to an array of RGB colors
+    '''
+    colors = np.asarray(colors, dtype=np.uint16).byteswap()
+    return np.stack(Utils.rgb565_to_rgb(colors), axis=-1).astype(np.uint8)
+
+def _trunc_div(a, b):
+    # C integer division, rounding towards zero
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b >= 0) else -q
+
+def _ctz(byte):
+    # Trailing zeros of a byte, 8 for 0 (_rightmost_bit)
+    return 8 if byte == 0 else (byte & -byte).bit_length() - 1
+
+
+class Font:
+    '''
+        Bitmap font, as a g_font_t
+    '''
+    def __init__(self, width, height, ascii_offset, glyphs, monospace=False):
+        self.width = width
+        self.height = height
+        self.ascii_offset = ascii_offset
+        self.monospace = monospace
+        self.width_bytes = (width + 7) // 8
+        self.glyph_size = self.width_bytes * height
+        self.glyphs = np.frombuffer(bytes(glyphs), dtype=np.uint8)
+
+    @staticmethod
+    def load(filename=DEFAULT_FONT):
+        '''
+            Load a font from a C header (like fonts/base.h) or a font2bin.py .bmf file
+        '''
+        if filename.endswith('.bmf'):
+            with open(filename, 'rb') as f:
+                width, height, ascii_offset = f.read(3)
+                return Font(width & 0x7F, height, ascii_offset, f.read(), monospace=not width & 0x80)
+
+        with open(filename, 'r') as f:
+            source = f.read()
+        fields = dict(re.findall(r'\.(monospace|width|height|ascii_offset)\s*=\s*(\w+)', source))
+        glyphs = [int(b, 16) for b in re.findall(r'0x([0-9a-fA-F]{2})\b', source.split('.glyphs', 1)[1])]
+        return Font(int(fields['width']), int(fields['height']), int(fields['ascii_offset']), glyphs,
+                    monospace=fields['monospace'] == 'true')
+
+    def glyph(self, character):
+        '''
+            Glyph bytes of a character code, empty if the font doesn't have it
+        '''
+        start = (character - self.ascii_offset) * self.glyph_size
+        glyph = self.glyphs[start:start + self.glyph_size]
+        return glyph if len(glyph) == self.glyph_size else np.zeros(self.glyph_size, dtype=np.uint8)
+
+    def glyph_width(self, character):
+        '''
+            Width of a glyph up to its rightmost pixel (_glyph_width)
+        '''
+        columns = np.bitwise_or.reduce(self.glyph(character).reshape((self.height, self.width_bytes)), axis=0)
+        for b in range(self.width_bytes - 1, -1, -1):
+            bit = _ctz(int(columns[b]))
+            if bit < 8:
+                return 8 * b + 8 - bit
+        return 0
+
+
+class VDB:
+    '''
+        Virtual Display Buffer: a buffer mapped to a region of the screen
+    '''
+    def __init__(self, size, fill):
+        self.region = (0, 0, 0, 0)
+        self.buf = np.full(size, fill, dtype=np.uint16)
+
+    @property
+    def width(self):
+        return self.region[2] - self.region[0] + 1
+
+    @property
+    def height(self):
+        return self.region[3] - self.region[1] + 1
+
+    @property
+    def window(self):
+        '''
+            Buffer as a (height, width) view of its region
+        '''
+        size = self.width * self.height
+        if size > len(self.buf):
+            raise ValueError(f"VDB region of {size} pixels doesn't fit the buffer ({len(self.buf)} pixels)")
+        return self.buf[:size].reshape((self.height, self.width))
+
+
+def _draw_call(method):
+    # Count calls and pixels written by public draw functions. Nested calls count for the outermost one
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._depth > 0:
+            return method(self, *args, **kwargs)
+
+        start = self.pixels_touched
+        self._depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            stats = self.draw_calls.setdefault(method.__name__, {'calls': 0, 'pixels': 0})
+            stats['calls'] += 1
+            stats['pixels'] += self.pixels_touched - start
+    return wrapper
+
+
+class Display:
+    '''
+        Model of the g_disp_t display and the drawing functions of graphics.c.
+        A VDB_SIZE of 0 uses a full screen buffer, as CONFIG_G_VDB_SIZE
+    '''
+    def __init__(self, width, height, vdb_size=0, font=None):
+        self.width = width
+        self.height = height
+        self.vdb_size = width * height if vdb_size == 0 else vdb_size
+        self.font = font or Font.load()
+
+        # Same initial contents as g_init
+        self.vdb1 = VDB(self.vdb_size, 0x0000)
+        self.vdb2 = VDB(self.vdb_size, 0xFFFF)
+        self.vdb = self.vdb1
+
+        self.screen = np.zeros((height, width), dtype=np.uint16)
+        self._depth = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.flushes = 0
+        self.bytes_sent = 0
+        self.pixels_touched = 0
+        self.draw_calls = {}
+
+    @property
+    def counters(self):
+        return {
+            'flushes': self.flushes,
+            'bytes_sent': self.bytes_sent,
+            'pixels_touched': self.pixels_touched,
+            'draw_calls': {name: dict(stats) for name, stats in self.draw_calls.items()}
+        }
+
+    def screenshot(self, colormode='BGR'):
+        '''
+            Screen contents as a (height, width, 3) image
+        '''
+        img = color_to_rgb(self.screen)
+        return img[..., ::-1] if colormode == 'BGR' else img
+
+    def save(self, filename):
+        import cv2
+        cv2.imwrite(filename, self.screenshot('BGR'))
+
+    def display_send_color16(self, x0, y0, x1, y1, buf):
+        # Pixels outside the screen are sent, but don't show up
+        self.bytes_sent += 2 * len(buf)
+        window = buf.reshape((y1 - y0 + 1, x1 - x0 + 1))
+        sx0, sy0 = max(x0, 0), max(y0, 0)
+        sx1, sy1 = min(x1, self.width - 1), min(y1, self.height - 1)
+        if sx0 <= sx1 and sy0 <= sy1:
+            self.screen[sy0:sy1+1, sx0:sx1+1] = window[sy0-y0:sy1-y0+1, sx0-x0:sx1-x0+1]
+
+    def refresh_region(self, region, draw_cb):
+        '''
+            Redraw REGION (x0, y0, x1, y1) by sliding the VDB along it, calling DRAW_CB(region)
+            and flushing once per window. Windows are the same as in g_refresh_region
+        '''
+        x0, y0, x1, y1 = region
+        y_step = self.vdb_size // (x1 - x0 + 1)
+        y_step = min(y_step, y1 - y0 + 1)
+        if y_step < 1:
+            raise ValueError("Refresh region is wider than the VDB")
+
+        for y in range(y0, y1 - 1, y_step):
+            self.vdb.region = (x0, y, x1, y + y_step - 1)
+            draw_cb(region)
+            self.vdb_flush()
+
+    def vdb_flush(self):
+        vdb = self.vdb
+        x0, y0, x1, y1 = vdb.region
+        self.display_send_color16(x0, y0, x1, y1, vdb.window.reshape(-1))
+        self.flushes += 1
+
+        # Swap buffers
+        self.vdb = self.vdb1 if vdb is self.vdb2 else self.vdb2
+
+    def _plot(self, xs, ys, colors):
+        # Write pixels at screen coordinates, skipping the ones outside the VDB
+        x0, y0, x1, y1 = self.vdb.region
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        inside = (xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)
+        colors = np.broadcast_to(np.asarray(colors, dtype=np.uint16), inside.shape)
+        self.vdb.window[ys[inside] - y0, xs[inside] - x0] = colors[inside]
+        self.pixels_touched += int(np.count_nonzero(inside))
+
+    def _fill(self, window_slice, color):
+        window = self.vdb.window
+        area = window[window_slice]
+        area[...] = color
+        self.pixels_touched += area.size
+
+    @_draw_call
+    def draw_pixel(self, x, y, color):
+        self._plot(x, y, color)
+
+    @_draw_call
+    def draw_rect(self, region, color, thickness=G_FILLED):
+        x0, y0, x1, y1 = region
+        vx0, vy0, vx1, vy1 = self.vdb.region
+
+        # Same clipping as g_draw_rect, relative to the VDB
+        fx0 = 0 if x0 <= vx0 else x0 - vx0
+        fy0 = 0 if y0 <= vy0 else y0 - vy0
+        fx1 = self.vdb.width - 1 if x1 > vx1 else x1 - vx0
+        fy1 = self.vdb.height - 1 if y1 > vy1 else y1 - vy0
+        if fx1 <= 0 or fy1 <= 0 or fy0 > fy1 or fx0 > fx1:
+            return
+
+        if thickness == G_FILLED:
+            self._fill((slice(fy0, fy1 + 1), slice(fx0, fx1 + 1)), color)
+        else:
+            self.draw_hline(x0, y0, x1 - x0 + 1, color, thickness)
+            self.draw_hline(x0, y1, x1 - x0 + 1, color, thickness)
+            self.draw_vline(x0, y0, y1 - y0 + 1, color, thickness)
+            self.draw_vline(x1, y0, y1 - y0 + 1, color, thickness)
+
+    @_draw_call
+    def draw_hline(self, x, y, width, color, thickness=1):
+        if thickness < 1:
+            return
+        if thickness > 1:
+            return self.draw_rect((x, y - thickness // 2, x + width - 1, y + thickness // 2), color, G_FILLED)
+
+        vx0, vy0, vx1, vy1 = self.vdb.region
+        if y < vy0 or y > vy1:
+            return
+        start = 0 if x < vx0 else x - vx0
+        end = self.vdb.width if x + width - 1 > vx1 else x + width - vx0
+        if end > start:
+            self._fill((y - vy0, slice(start, end)), color)
+
+    @_draw_call
+    def draw_vline(self, x, y, height, color, thickness=1):
+        if thickness < 1:
+            return
+        if thickness > 1:
+            return self.draw_rect((x - thickness // 2, y, x + thickness // 2, y + height - 1), color, G_FILLED)
+
+        vx0, vy0, vx1, vy1 = self.vdb.region
+        if x < vx0 or x > vx1:
+            return
+        start = 0 if y < vy0 else y - vy0
+        end = self.vdb.height if y + height - 1 > vy1 else y + height - vy0
+        if end > start:
+            self._fill((slice(start, end), x - vx0), color)
+
+    @_draw_call
+    def draw_line(self, x0, y0, x1, y1, color, thickness=1):
+        if x0 == x1:
+            return self.draw_vline(min(x0, x1), min(y0, y1), abs(y1 - y0) + 1, color, thickness)
+        if y0 == y1:
+            return self.draw_hline(min(x0, x1), min(y0, y1), abs(x1 - x0) + 1, color, thickness)
+
+        # Bresenham, as g_draw_line. Thickness only applies to straight lines
+        dx, sx = abs(x1 - x0), 1 if x0 < x1 else -1
+        dy, sy = abs(y1 - y0), 1 if y0 < y1 else -1
+        e_xy = _trunc_div(dx if dx > dy else -dy, 2)
+        xs, ys = [], []
+        while True:
+            xs.append(x0)
+            ys.append(y0)
+            if x0 == x1 and y0 == y1:
+                break
+            e = e_xy
+            if e > -dx:
+                e_xy -= dy
+                x0 += sx
+            if e < dy:
+                e_xy += dx
+                y0 += sy
+        self._plot(xs, ys, color)
+
+    @_draw_call
+    def draw_circle(self, cx, cy, r, color, thickness=G_FILLED):
+        # Midpoint circle, one octant of (x, y) points as g_draw_circle
+        points = []
+        x, y, d = r, 0, 3 - 2 * r
+        while y <= x:
+            points.append((x, y))
+            y += 1
+            if d > 0:
+                x -= 1
+                d += 4 * (y - x) + 10
+            else:
+                d += 4 * y + 6
+
+        if thickness == G_FILLED:
+            for x, y in points:
+                self.draw_hline(cx - y, cy - x, 2 * y + 1, color, 1)
+                self.draw_hline(cx - x, cy - y, 2 * x + 1, color, 1)
+                self.draw_hline(cx - x, cy + y, 2 * x + 1, color, 1)
+                self.draw_hline(cx - y, cy + x, 2 * y + 1, color, 1)
+        else:
+            x, y = np.array(points).T
+            self._plot(np.concatenate([cx + x, cx + y, cx - y, cx - x, cx - x, cx - y, cx + y, cx + x]),
+                       np.concatenate([cy - y, cy - x, cy - x, cy - y, cy + y, cy + x, cy + x, cy + y]), color)
+
+    @_draw_call
+    def draw_polygon(self, points, color, thickness=G_FILLED):
+        '''
+            Polygon through a list of (x, y) float points
+        '''
+        points = np.asarray(points, dtype=np.float32).reshape((-1, 2))
+        if thickness != G_FILLED:
+            for (xj, yj), (xi, yi) in zip(np.roll(points, 1, axis=0), points):
+                self.draw_line(int(xj), int(yj), int(xi), int(yi), color, thickness)
+            return
+
+        # Scanline fill (_draw_polygon_fill): intersections of every row with the polygon segments
+        px, py = points[:, 0], points[:, 1]
+        jx, jy = np.roll(px, 1), np.roll(py, 1)
+        y = max(int(min(self.height - 1, py.min())), self.vdb.region[1])
+        ymax = min(int(max(0, py.max())), self.vdb.region[3])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for row in range(y, ymax + 1):
+                crossing = ((py < row) & (jy >= row)) | ((jy < row) & (py >= row))
+                nodes = px[crossing] + (np.float32(row) - py[crossing]) / (jy[crossing] - py[crossing]) \
+                    * (jx[crossing] - px[crossing])
+                nodes = np.sort(np.trunc(nodes).astype(np.int64))
+                for start, end in zip(nodes[0::2], nodes[1::2]):
+                    self.draw_hline(int(start), row, int(end - start + 1), color, 1)
+
+    @_draw_call
+    def draw_bitmap_mono(self, x, y, bitmap, width, height, color):
+        width_bytes = (width + 7) // 8
+        bitmap = np.asarray(bitmap, dtype=np.uint8)[:width_bytes * height].reshape((height, width_bytes))
+        vs, us = np.nonzero(np.unpackbits(bitmap, axis=1)[:, :width])
+        self._plot(x + us, y + vs, color)
+
+    def _draw_indices(self, x, y, indices, palette, transparent_index=None):
+        palette = np.asarray(palette, dtype=np.uint16)
+        vs, us = np.indices(indices.shape)
+        if transparent_index is not None:
+            opaque = indices != transparent_index
+            vs, us, indices = vs[opaque], us[opaque], indices[opaque]
+        self._plot(x + us, y + vs, palette[indices])
+
+    @_draw_call
+    def draw_bitmap_palette(self, x, y, bitmap, width, height, palette):
+        self._draw_indices(x, y, np.asarray(bitmap, dtype=np.uint8)[:width * height].reshape((height, width)), palette)
+
+    @_draw_call
+    def draw_bitmap_palette_transparent(self, x, y, bitmap, width, height, palette, transparent_index):
+        self._draw_indices(x, y, np.asarray(bitmap, dtype=np.uint8)[:width * height].reshape((height, width)),
+                           palette, transparent_index)
+
+    @_draw_call
+    def draw_bitmap_palette_packed(self, x, y, bitmap, width, height, bits, palette):
+        row_size = Utils.row_size(width, bits)
+        packed = np.asarray(bitmap, dtype=np.uint8)[:row_size * height].reshape((height, row_size))
+        self._draw_indices(x, y, Utils.unpack_indices(packed, width, bits), palette)
+
+    @_draw_call
+    def draw_bitmap_palette_packed_transparent(self, x, y, bitmap, width, height, bits, palette, transparent_index):
+        row_size = Utils.row_size(width, bits)
+        packed = np.asarray(bitmap, dtype=np.uint8)[:row_size * height].reshape((height, row_size))
+        self._draw_indices(x, y, Utils.unpack_indices(packed, width, bits), palette, transparent_index)
+
+    @_draw_call
+    def draw_bitmap_rgb565(self, x, y, bitmap, width, height):
+        vx0, vy0, vx1, vy1 = self.vdb.region
+        x0, y0 = max(x, vx0), max(y, vy0)
+        x1, y1 = min(x + width - 1, vx1), min(y + height - 1, vy1)
+        if x0 > x1 or y0 > y1:
+            return
+
+        bitmap = np.asarray(bitmap, dtype=np.uint16)[:width * height].reshape((height, width))
+        self._fill((slice(y0 - vy0, y1 - vy0 + 1), slice(x0 - vx0, x1 - vx0 + 1)),
+                   bitmap[y0 - y:y1 - y + 1, x0 - x:x1 - x + 1])
+
+    @_draw_call
+    def draw_img(self, x, y, img, frame=0):
+        '''
+            Draw a frame of an EBG image, as g_img_draw
+        '''
+        bitmap = img.frame(frame)
+        if img.palette is None:
+            # RGB565 frames are stored in display byte order
+            return self.draw_bitmap_rgb565(x, y, bitmap.astype(np.uint16).byteswap(), img.width, img.height)
+
+        colors = img.palette.rgb_colors.astype(np.uint16)
+        palette = hex_to_color(Utils.rgb_to_rgb565(colors[:, 0], colors[:, 1], colors[:, 2]))
+        self._draw_indices(x, y, bitmap, palette, img.palette.transparent)
+
+    @_draw_call
+    def draw_char(self, x, y, character, color):
+        if isinstance(character, str):
+            character = ord(character)
+        font = self.font
+        self.draw_bitmap_mono(x, y, font.glyph(character), font.width, font.height, color)
+
+    @_draw_call
+    def draw_string(self, x, y, string, color):
+        font = self.font
+        line_gap = 1
+        char_gap = 0 if font.monospace else 1
+        empty_gap = font.width // 4
+
+        last_char_width = 0     # Width of last non-special char
+        combining_mode = False
+        cx = cy = 0
+        # Characters are signed in C: codes above 127 are below the ASCII offset and skipped
+        for c in string.encode('latin-1', 'replace'):
+            if c == 0x1B:       # Escape, combine with the last character
+                cx -= last_char_width + char_gap
+                combining_mode = True
+            elif c == ord('\n'):
+                last_char_width = 0
+                cx = 0
+                cy += font.height + line_gap
+            elif c == ord(' '):
+                combining_mode = False
+                last_char_width = empty_gap
+                cx += last_char_width + char_gap
+            elif font.ascii_offset <= c < 128:
+                char_width = font.width if font.monospace else font.glyph_width(c)
+
+                _cx = cx
+                if combining_mode and not font.monospace:
+                    _cx += _trunc_div(last_char_width - char_width + 1, 2)
+                else:
+                    last_char_width = char_width if char_width > 0 else empty_gap
+
+                if char_width > 0:
+                    self.draw_char(x + _cx, y + cy, c, color)
+
+                combining_mode = False
+                cx += last_char_width + char_gap
+
+
+def size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Play an EBG image on a model of the graphics.c pipeline, "
+                                        "counting display transfers")
+    parser.add_argument('image', type=str, help="EBG image")
+    parser.add_argument('-d', '--display', type=size, default=(240, 240),
+                        help="Display size, as WIDTHxHEIGHT. Default: 240x240")
+    parser.add_argument('-b', '--vdb-size', type=int, default=0,
+                        help="VDB size in pixels, as CONFIG_G_VDB_SIZE. Default: 0 (full screen)")
+    parser.add_argument('-x', type=int, default=0, help="Image position. Default: 0")
+    parser.add_argument('-y', type=int, default=0, help="Image position. Default: 0")
+    parser.add_argument('--region', choices=['screen', 'image'], default='screen',
+                        help="Region refreshed on every frame. Default: screen")
+    parser.add_argument('--background', type=lambda v: int(v, 0), default=0x0000,
+                        help="Background RGB565 color, cleared before drawing the image. Default: 0x0000")
+    parser.add_argument('--spi-clock', type=float, default=None,
+                        help="Display bus clock in MHz, to estimate the transfer time of a frame")
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help="Save the screen after the last frame as an image")
+    args = parser.parse_args()
+
+    img = EBG.load(args.image)
+    display = Display(*args.display, vdb_size=args.vdb_size)
+    screen = (0, 0, display.width - 1, display.height - 1)
+    image = (max(args.x, 0), max(args.y, 0),
+             min(args.x + img.width, display.width) - 1, min(args.y + img.height, display.height) - 1)
+    background = hex_to_color(args.background)
+
+    frame = 0
+    def draw(region):
+        display.draw_rect(screen, background, G_FILLED)
+        display.draw_img(args.x, args.y, img, frame)
+
+    start = time.perf_counter()
+    for frame in range(len(img)):
+        display.refresh_region(screen if args.region == 'screen' else image, draw)
+    elapsed = time.perf_counter() - start
+
+    counters = display.counters
+    frames = max(len(img), 1)
+    print(f"Frames: {len(img)}, VDB: {display.vdb_size} pixels, model time: {elapsed:.3f} s")
+    print(f"Flushes: {counters['flushes']} ({counters['flushes'] / frames:.1f}/frame)")
+    print(f"Bytes sent: {counters['bytes_sent']} ({counters['bytes_sent'] / frames:.0f}/frame)")
+    if args.spi_clock:
+        print(f"Transfer time: {counters['bytes_sent'] * 8 / frames / args.spi_clock:.0f} us/frame")
+    for name, stats in counters['draw_calls'].items():
+        print(f"{name}: {stats['calls']} calls, {stats['pixels']} pixels written")
+
+    if args.output:
+        display.save(args.output)
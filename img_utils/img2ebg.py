@@ -3,12 +3,22 @@ Convert image to Embedded Bitmap Graphics (EBG)
 '''
 import os
 import re
+import json
+import time
+import hashlib
+import tempfile
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, ArgumentTypeError
 
-import cv2
 import numpy as np
 
-from ebg import EBG, Palette, Utils
+from ebg import EBG, EBGWriter, Palette, Utils
+from quantizers import QUANTIZERS
+from palette_search import search_palette_size
+from pipeline import convert_frames
+import profiling
 
 # TODO: Implement color modes (rgb565, rgb888, etc.)
 
@@ -44,67 +54,196 @@ def sorted_alphanumeric(data):
     alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
     return sorted(data, key=alphanum_key)
 
-def get_frames(files, split_rows=1, split_cols=1):
-    frames = []
-
-    if len(files) == 1:
-        file = files[0]
-
-        if os.path.isdir(file):
-            for filename in sorted_alphanumeric(os.listdir(file)):
-                frames.append(cv2.imread(os.path.join(file, filename)))
-
-        elif file.endswith('.gif'):
+class FrameSource:
+    '''
+        Frames of the input images, decoded lazily while they are iterated. Multiple image
+        files (or a directory) are decoded by JOBS threads, keeping at most BUFFER_SIZE decoded
+        frames in memory. GIF frames are read in order and sprite sheet tiles are views of the
+        sheet. Frames are checked to have the same size as they arrive. The first frame (or the
+        whole sprite sheet) is kept once decoded, but iterating again decodes the other frames
+        again: a conversion that generates its palette decodes them twice, for the histogram and
+        for the EBG, so memory stays bounded by BUFFER_SIZE frames instead of the animation length
+    '''
+    def __init__(self, files, split_rows=1, split_cols=1, buffer_size=None, jobs=None):
+        self.split_rows = split_rows
+        self.split_cols = split_cols
+        self.jobs = jobs or os.cpu_count() or 1
+        self.buffer_size = max(1, buffer_size or 2 * self.jobs)
+
+        self.files = []     # Image files, one frame each
+        self.gif = None
+        self.sheet = None   # Single image, split in tiles
+        self._first = None          # First frame, once decoded
+        self._sheet_image = None    # Sprite sheet, once decoded
+        if len(files) == 1 and os.path.isdir(files[0]):
+            self.files = [os.path.join(files[0], filename) for filename in sorted_alphanumeric(os.listdir(files[0]))]
+        elif len(files) == 1 and files[0].endswith('.gif'):
             if split_rows * split_cols != 1:
                 raise ValueError("Can't split GIF frames by rows and columns")
+            self.gif = files[0]
+        elif len(files) == 1:
+            self.sheet = files[0]
+        else:
+            self.files = list(files)
 
-            gif = cv2.VideoCapture(file)
+    @staticmethod
+    def _read(file):
+        import cv2
+        with profiling.stage('decode', 1):
+            img = cv2.imread(file)
+        if img is None:
+            raise FileNotFoundError(f"Image file '{file}' does not exist or is not supported")
+        return img
+
+    def _tiles(self):
+        if self._sheet_image is None:
+            self._sheet_image = self._read(self.sheet)
+        img = self._sheet_image
+        row_size = img.shape[0] // self.split_rows
+        col_size = img.shape[1] // self.split_cols
+        for row in range(self.split_rows):
+            for col in range(self.split_cols):
+                yield img[row*row_size:(row+1)*row_size, col*col_size:(col+1)*col_size]
+
+    def _gif_frames(self):
+        import cv2
+        gif = cv2.VideoCapture(self.gif)
+        try:
             while True:
-                ret, img = gif.read()
+                with profiling.stage('decode', 1):
+                    ret, img = gif.read()
                 if not ret:
                     break
-                frames.append(img)
+                yield img
+        finally:
             gif.release()
 
-        else:
-            img = cv2.imread(file)
-            if img is None:
-                raise FileNotFoundError(f"Image file '{file}' does not exist or is not supported")
-
-            row_size = img.shape[0] // split_rows
-            col_size = img.shape[1] // split_cols
-
-            for row in range(split_rows):
-                for col in range(split_cols):
-                    frames.append(img[row:row+row_size, col:col+col_size])
-
-    else:
-        for file in files:
-            img = cv2.imread(file)
-            if img is None:
-                raise FileNotFoundError(f"Image file '{file}' does not exist or is not supported")
-
-            frames.append(img)
-    
-    if len(frames) == 0:
-        raise ValueError('Invalid input file(s)')
-
-    if any(f.shape != frames[0].shape for f in frames[1:]):
-        raise ValueError('All input frames must have the same size')
-    
-    return frames
+    def _file_frames(self):
+        files = self.files
+        if self._first is not None:
+            yield self._first
+            files = files[1:]
+
+        if self.jobs == 1:
+            for file in files:
+                yield self._read(file)
+            return
+
+        files = iter(files)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = deque(executor.submit(self._read, file) for file in itertools.islice(files, self.buffer_size))
+            while pending:
+                yield pending.popleft().result()
+                # The next file is only decoded once the consumer is done with this frame
+                for file in itertools.islice(files, 1):
+                    pending.append(executor.submit(self._read, file))
+
+    def __iter__(self):
+        frames = self._tiles() if self.sheet else self._gif_frames() if self.gif else self._file_frames()
+
+        shape = None
+        for frame in frames:
+            if shape is None:
+                shape = frame.shape
+            elif frame.shape != shape:
+                raise ValueError('All input frames must have the same size')
+            yield frame
+
+        if shape is None:
+            raise ValueError('Invalid input file(s)')
+
+    def first(self):
+        '''
+            First frame, without decoding any other
+        '''
+        if self._first is None:
+            if self.sheet is None and self.gif is None:
+                if len(self.files) == 0:
+                    raise ValueError('Invalid input file(s)')
+                self._first = self._read(self.files[0])
+            else:
+                self._first = next(iter(self))
+        return self._first
+
+def get_frames(files, split_rows=1, split_cols=1, buffer_size=None, jobs=None):
+    '''
+        Lazy source of the frames in the input files
+    '''
+    return FrameSource(files, split_rows, split_cols, buffer_size=buffer_size, jobs=jobs)
+
+
+# Palettes generated in this process, so long-running callers (e.g. watch mode) don't cluster
+# the same colors again when only other options of an image change
+_palettes = {}
+MAX_CACHED_PALETTES = 64
+
+# Directory where generated palettes are also kept across runs (e.g. by build_assets.py). Disabled if None
+PALETTE_CACHE_DIR = None
+
+def generate_palette(histogram, k, transparent_color=None, engine='kmeans'):
+    '''
+        Palette of K colors for an RGB565 histogram, reused if the same colors were already clustered
+    '''
+    key = (hashlib.sha1(np.ascontiguousarray(histogram, dtype=np.int64).tobytes()).hexdigest(), k,
+           None if transparent_color is None else tuple(int(c) for c in transparent_color), engine)
+    if key not in _palettes:
+        if len(_palettes) >= MAX_CACHED_PALETTES:
+            del _palettes[next(iter(_palettes))]
+        palette = _load_cached_palette(key)
+        if palette is None:
+            palette = Palette.from_histogram(histogram, k, transparent_color=transparent_color, engine=engine)
+            _save_cached_palette(key, palette)
+        # Palettes cached by older versions may hold a rounded transparent color
+        _palettes[key] = palette.set_transparent_color(transparent_color)
+    return _palettes[key]
+
+def _cached_palette_file(key):
+    return os.path.join(PALETTE_CACHE_DIR, f"palette_{hashlib.sha1(repr(key).encode()).hexdigest()}.json")
+
+def _load_cached_palette(key):
+    if PALETTE_CACHE_DIR is None:
+        return None
+    filename = _cached_palette_file(key)
+    try:
+        with open(filename, 'r') as f:
+            cached = json.load(f)
+        os.utime(filename)     # Most recently used, for cache eviction
+        return Palette(np.array(cached['colors'], dtype=np.uint8), transparent=cached['transparent'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_cached_palette(key, palette):
+    if PALETTE_CACHE_DIR is None:
+        return
+    try:
+        # Write to a temporary file first, so concurrent runs never read a partial palette
+        os.makedirs(PALETTE_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=PALETTE_CACHE_DIR, suffix='.json', delete=False) as f:
+            json.dump({'colors': palette.rgb_colors.tolist(), 'transparent': None if palette.transparent is None else int(palette.transparent)}, f)
+        os.replace(f.name, _cached_palette_file(key))
+    except OSError:
+        pass
 
 
-if __name__ == '__main__':
+def build_parser():
     parser = ArgumentParser()
     
     quantize_group = parser.add_argument_group()
     palette_group = quantize_group.add_mutually_exclusive_group()
     palette_group.add_argument('-k', '--colors', type=int, help="Number of colors in the palette", default=8)
-    quantize_group.add_argument('--first-only', action='store_true', help="Use only first frame for color quantization. Might be useful to avoid huge memory consumption for large frames.")
+    quantize_group.add_argument('-e', '--engine', choices=list(QUANTIZERS), help="Quantizer engine used to generate the palette. Default: kmeans", default='kmeans')
+    quantize_group.add_argument('--compare-engines', action='store_true', help="Report time and mean color error (delta E) of every quantizer engine")
+    quantize_group.add_argument('--first-only', action='store_true', help="Use only first frame for color quantization.")
     
     palette_group.add_argument('-p', '--palette', type=str, help="Palette file", required=False, default=None)
+    palette_group.add_argument('--rgb565', action='store_true', help="Store full-color RGB565 pixels instead of palette indices. Same as -k 0")
+    palette_group.add_argument('--auto-k', action='store_true', help="Use the smallest palette that meets the --max-delta-e/--min-psnr quality target")
+    quantize_group.add_argument('--max-delta-e', type=float, help="Maximum mean color error (delta E) allowed by --auto-k. Default: 3.0 if no PSNR target is given", default=None)
+    quantize_group.add_argument('--min-psnr', type=float, help="Minimum PSNR (dB) required by --auto-k", default=None)
+    parser.add_argument('-j', '--jobs', type=int, help="Number of worker processes used by --auto-k and frame conversion, and of threads decoding input frames. A value of 1 converts frames serially. Default: number of CPUs", default=None)
+    parser.add_argument('--frame-buffer', type=int, help="Maximum number of decoded input frames waiting to be converted. Default: twice the number of jobs", default=None)
     
+    quantize_group.add_argument('--lut', action='store_true', help="Quantize frames through a cached RGB565 lookup table. Much faster for large or many frames.")
     quantize_group.add_argument('-s', '--save-palette', action='store_true', help="Save generated palette")
     quantize_group.add_argument('-g', '--save-graphic-palette', action='store_true', help="Save a visual representation of the palette")
 
@@ -114,63 +253,173 @@ if __name__ == '__main__':
     parser.add_argument('-t', '--transparent', type=color, help="Transparent color", default=None)
 
     parser.add_argument('-o', '--output', type=str, help='Saved image filename. Default: {image_name}', default=None)
-    parser.add_argument('-c', '--export-c-header', action='store_true', help="Save C header with EBG image as byte-array")
-
-    args = parser.parse_args()
+    parser.add_argument('-c', '--export-c-header', action='store_true', help="Save C header with the EBG file as a const byte array, for g_img_from_memory")
+    parser.add_argument('-z', '--compress', choices=['rle', 'lz', 'auto'], help="Compress frames with row RLE, small-window LZ or whichever is smallest for each frame (auto)", default=None)
+    parser.add_argument('--delta', action='store_true', help="Store frames as the rectangles that changed from the previous frame, when smaller")
+    parser.add_argument('--keyframe-interval', type=int, help="Store a frame without --delta every N frames, so players can seek faster", default=None)
+    parser.add_argument('--ebg-version', type=int, choices=EBG.VERSIONS, help="EBG format version. Version 2 stores up to 65535 frames and a frame offset table for seeking. Default: 1", default=1)
+    parser.add_argument('--byte-indices', action='store_true', help="Store one byte per palette index instead of packing 1, 2 or 4-bit indices for small palettes")
+    parser.add_argument('--profile', type=str, help="Save the time, CPU time, peak memory and item count of each conversion stage to this JSON file, and a Chrome trace next to it", default=None)
+
+    return parser
+
+def target_description(args):
+    '''
+        Quality target of --auto-k, e.g. "delta E <= 3.00"
+    '''
+    targets = []
+    if args.max_delta_e is not None:
+        targets.append(f"delta E <= {args.max_delta_e:.2f}")
+    if args.min_psnr is not None:
+        targets.append(f"PSNR >= {args.min_psnr:.2f} dB")
+    return ', '.join(targets)
+
+def output_files(args):
+    '''
+        Files written by a conversion with parsed img2ebg arguments, the EBG file first
+    '''
+    output = args.output if args.output else os.path.splitext(args.image[0])[0]
+    outputs = [f"{output}.ebg"]
+    if args.export_c_header:
+        outputs.append(f"{output}.h")
+    if args.save_palette:
+        outputs.append(f"{output}_palette.json")
+    if args.save_graphic_palette:
+        outputs.append(f"{output}_palette.png")
+    return outputs
+
+def convert(args, log=print):
+    '''
+        Convert the images described by parsed img2ebg arguments. Returns the EBG filename.
+        Invalid arguments or inputs raise ValueError or FileNotFoundError
+    '''
+    if (args.max_delta_e is not None or args.min_psnr is not None) and not args.auto_k:
+        raise ValueError("Arguments --max-delta-e and --min-psnr require --auto-k")
+    if args.auto_k and args.max_delta_e is None and args.min_psnr is None:
+        args.max_delta_e = 3.0
 
     if args.save_palette and not (args.colors or args.palette):
-        parser.error("Argument -s/--save-palette only allowed when either -k/--colors or -p/--palette are provided.")
+        raise ValueError("Argument -s/--save-palette only allowed when either -k/--colors or -p/--palette are provided.")
+
+    # Full-color image, no palette applied
+    full_color = args.rgb565 or not (args.palette or args.colors or args.auto_k)
+    if full_color and (args.transparent is not None or args.save_palette or args.save_graphic_palette):
+        raise ValueError("Arguments -t/--transparent, -s/--save-palette and -g/--save-graphic-palette require a palette")
 
     output_filename = args.output if args.output else os.path.splitext(args.image[0])[0]
     output_path = os.path.dirname(output_filename)
     if len(output_path) > 0:
         os.makedirs(output_path, exist_ok=True)
 
-    try:
-        frames = get_frames(args.image, args.rows, args.cols)
-    except Exception as e:
-        parser.error(e)
+    frames = get_frames(args.image, args.rows, args.cols, buffer_size=args.frame_buffer, jobs=args.jobs)
     
-    (h, w, c) = frames[0].shape
-
-    if args.palette or args.colors:
-        if args.palette:
-            # Palette provided
-            if not os.path.isfile(args.palette):
-                parser.error(f"Palette file '{args.palette}' does not exist")
-
-            try:
-                palette = Palette.load(args.palette, transparent_color=args.transparent)
-            except:
-                parser.error(f"Invalid palette file: '{args.palette}'")
+    (h, w, c) = frames.first().shape
 
-            if palette.channels != c:
-                parser.error("Number of channels in palette colors do not match input image")
+    if full_color:
+        palette = None
 
-        else:
-            # No palette, quantize image based on number of colors
-            if args.first_only:
-                full_img = frames[0]
-            else:
-                full_img = np.hstack(frames)
+    elif args.palette:
+        # Palette provided
+        if not os.path.isfile(args.palette):
+            raise FileNotFoundError(f"Palette file '{args.palette}' does not exist")
 
-            palette = Palette.from_img(full_img, args.colors, transparent_color=args.transparent)
+        try:
+            palette = Palette.load(args.palette, transparent_color=args.transparent)
+        except:
+            raise ValueError(f"Invalid palette file: '{args.palette}'")
 
-        if args.save_palette:
-            palette.save(f'{output_filename}_palette.json')
-        
-        if args.save_graphic_palette:
-            palette.save_img(f'{output_filename}_palette.png')
+        if palette.channels != c:
+            raise ValueError("Number of channels in palette colors do not match input image")
 
-        quantized_bitmaps = [palette.quantize(frame) for frame in frames]
+    else:
+        # No palette, quantize image based on number of colors
+        histogram = Utils.frames_histogram([frames.first()] if args.first_only else frames)
+
+        if args.auto_k:
+            with profiling.stage('palette search'):
+                palette, k, report = search_palette_size(histogram,
+                                                         max_delta_e=args.max_delta_e, min_psnr=args.min_psnr,
+                                                         transparent_color=args.transparent,
+                                                         engine=args.engine, jobs=args.jobs)
+            log("    K  delta E  PSNR (dB)")
+            for candidate, (delta_e, psnr) in sorted(report.items()):
+                log(f"{'*' if candidate == k else ' '}{candidate:4d}  {delta_e:7.2f}  {psnr:9.2f}")
+            if k is None:
+                log(f"Warning: no palette meets the target ({target_description(args)}), "
+                    f"using the largest one: {max(report)} colors")
+
+        for engine in ([] if args.auto_k else QUANTIZERS if args.compare_engines else [args.engine]):
+            start = time.perf_counter()
+            engine_palette = generate_palette(histogram, args.colors, args.transparent, engine)
+            elapsed = time.perf_counter() - start
+
+            delta_e, psnr = engine_palette.histogram_error(histogram)
+            log(f"Palette '{engine}': {len(engine_palette)} colors in {elapsed:.3f} s, "
+                f"mean delta E: {delta_e:.2f}, PSNR: {psnr:.2f} dB")
+            if engine == args.engine:
+                palette = engine_palette
+
+    if args.save_palette:
+        palette.save(f'{output_filename}_palette.json')
+    
+    if args.save_graphic_palette:
+        palette.save_img(f'{output_filename}_palette.png')
+
+    # Quantized frames are written as soon as they are ready, so they don't pile up in memory
+    method = 'lut' if args.lut else 'exact'
+    encodings = None if args.compress is None else ['rle', 'lz'] if args.compress == 'auto' else [args.compress]
+    if args.delta:
+        encodings = [*(encodings or []), 'delta']
+    try:
+        with EBGWriter(f"{output_filename}.ebg", w, h, palette=palette,
+                       index_bits=8 if args.byte_indices else None, encodings=encodings,
+                       version=args.ebg_version, keyframe_interval=args.keyframe_interval) as writer:
+            if palette is None:
+                # Full-color frames only need an RGB565 conversion
+                for frame in frames:
+                    writer.write_frame(Utils.bgr_to_rgb565(frame))
+            elif args.jobs == 1:
+                for frame in frames:
+                    writer.write_frame(palette.quantize(frame, method=method))
+            else:
+                convert_frames(frames, palette, writer, method=method, jobs=args.jobs,
+                               buffer_size=args.frame_buffer)
+    except:
+        # Input frames are only checked as they are read, don't leave a partial image behind
+        if os.path.exists(f"{output_filename}.ebg"):
+            os.remove(f"{output_filename}.ebg")
+        raise
+
+    if args.export_c_header:
+        with profiling.stage('c header', 1), open(f"{output_filename}.ebg", 'rb') as f:
+            EBG.save_c_array(f"{output_filename}.h", f.read())
+
+    return f"{output_filename}.ebg"
+
+def convert_image(image, output=None, log=None, **options):
+    '''
+        Convert IMAGE (a file, a directory, a GIF or a list of frame files) to EBG, as the command
+        line would. OPTIONS are the long command line options with underscores, e.g.
+        convert_image('sprite.png', colors=16, compress='auto', transparent=(255, 0, 255)).
+        Messages go to LOG (silent by default). Returns the EBG filename
+    '''
+    args = build_parser().parse_args(list(image) if isinstance(image, (list, tuple)) else [image])
+    for name, value in options.items():
+        if name == 'image' or not hasattr(args, name):
+            raise TypeError(f"convert_image() got an unexpected option '{name}'")
+        setattr(args, name, value)
+    args.output = output
+
+    with profiling.profile(args.profile):
+        return convert(args, log=log or (lambda *_: None))
 
-        img = EBG(w, h, quantized_bitmaps, palette=palette)
-        
-        img.save(f"{output_filename}.ebg")
 
-        if args.export_c_header:
-            img.save_c_header(f"{output_filename}.h")
+if __name__ == '__main__':
+    parser = build_parser()
+    args = parser.parse_args()
 
-    else:
-        # Full-color image, no palette applied
-        parser.error("Non-quantized images not supported yet.")
+    try:
+        with profiling.profile(args.profile):
+            convert(args)
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(e)
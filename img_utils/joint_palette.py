@@ -0,0 +1,191 @@
+'''
+Build a single palette shared by a whole set of images.
+
+Pixels of every image are sampled into one RGB565 histogram, which is
+clustered into a palette saved with Palette.save, so it can be reused with
+the img2ebg -p option. Every image can then be quantized against it, and a
+report shows the color error of each image with the shared palette.
+Inputs are the same as in batch.py: glob patterns, directories or '@' list
+files with per-item img2ebg options.
+'''
+import os
+import sys
+import json
+import shlex
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import img2ebg
+from ebg import Palette, Utils
+from batch import collect_items, run_batch
+from quantizers import QUANTIZERS
+from palette_search import search_palette_size
+
+# img2ebg options that choose the palette of an image
+PALETTE_OPTIONS = ('-k', '--colors', '-p', '--palette', '--rgb565', '--auto-k')
+
+
+def image_histogram(item, sample=None, seed=0):
+    '''
+        RGB565 histogram of the frames of a batch item. With SAMPLE, at most that many
+        pixels are counted, scaled so the histogram keeps the pixel count of the item.
+        Pixels are drawn from every frame as it is decoded (uniformly over the whole
+        item, with replacement), so only SAMPLE codes are kept in memory
+    '''
+    name, arguments = item
+    args = img2ebg.build_parser().parse_args(arguments)
+    frames = img2ebg.get_frames(args.image, args.rows, args.cols)
+
+    if sample is None:
+        return Utils.frames_histogram(frames)
+
+    rng = np.random.default_rng(seed)
+    histogram = np.zeros(0x10000, dtype=np.int64)   # Every pixel, while there are at most SAMPLE
+    codes = None    # Sampled RGB565 codes, once there are more
+    total = 0
+    for frame in frames:
+        height, width = frame.shape[:2]
+        total += height * width
+        if total <= sample:
+            histogram += Utils.rgb565_histogram(frame)
+            continue
+
+        if codes is None:
+            # Start from a sample of the earlier frames, which were counted exactly
+            seen = total - height * width
+            codes = rng.choice(0x10000, sample, p=histogram / seen) if seen > 0 else np.zeros(sample, dtype=np.int64)
+        # Every sampled pixel comes from this frame with the share of the pixels it adds
+        replace = rng.random(sample) < height * width / total
+        ys, xs = np.divmod(rng.integers(0, height * width, np.count_nonzero(replace)), width)
+        codes[replace] = Utils.bgr_to_rgb565(frame[ys, xs])
+
+    if codes is None:
+        return histogram
+    return np.bincount(codes, minlength=0x10000) * (total / sample)
+
+def joint_histogram(histograms, equal_weight=False):
+    '''
+        Histogram of a set of images. With EQUAL_WEIGHT, every image counts as much as
+        any other regardless of its size
+    '''
+    histograms = np.asarray(histograms, dtype=np.float64)
+    if equal_weight:
+        sizes = histograms.sum(axis=1, keepdims=True)
+        histograms = histograms / sizes * sizes.mean()
+    # Whole counts, keeping every sampled color
+    return np.ceil(histograms.sum(axis=0)).astype(np.int64)
+
+def sets_palette(arguments):
+    '''
+        Whether img2ebg ARGUMENTS choose their own palette (or none), so the shared one can't be added
+    '''
+    return any(a.split('=')[0] in PALETTE_OPTIONS or (a[:2] in ('-k', '-p') and len(a) > 2)
+               for a in arguments)
+
+def error_report(palette, names, histograms):
+    '''
+        {name: (delta E, PSNR)} of every image quantized with the palette
+    '''
+    return {name: palette.histogram_error(histogram) for name, histogram in zip(names, histograms)}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Build one palette for a set of images, and optionally convert "
+                                        "every image with it")
+    parser.add_argument('inputs', nargs='+', type=str,
+                        help="Glob patterns, directories (searched recursively) or '@' list files")
+    parser.add_argument('-o', '--output', type=str, default='palette.json',
+                        help="Palette filename. Default: palette.json")
+
+    palette_group = parser.add_mutually_exclusive_group()
+    palette_group.add_argument('-k', '--colors', type=int, default=16,
+                               help="Number of colors in the palette. Default: 16")
+    palette_group.add_argument('--auto-k', action='store_true',
+                               help="Use the smallest palette that meets the --max-delta-e/--min-psnr target")
+    parser.add_argument('--max-delta-e', type=float, default=None,
+                        help="Maximum mean color error (delta E) allowed by --auto-k. Default: 3.0 if no PSNR target is given")
+    parser.add_argument('--min-psnr', type=float, default=None, help="Minimum PSNR (dB) required by --auto-k")
+    parser.add_argument('-e', '--engine', choices=list(QUANTIZERS), default='kmeans',
+                        help="Quantizer engine used to generate the palette. Default: kmeans")
+    parser.add_argument('-t', '--transparent', type=img2ebg.color, default=None, help="Transparent color")
+    parser.add_argument('--sample', type=int, default=None,
+                        help="Maximum number of pixels sampled from each image. Default: every pixel")
+    parser.add_argument('--equal-weight', action='store_true',
+                        help="Weight every image the same, instead of by its number of pixels")
+    parser.add_argument('-g', '--save-graphic-palette', action='store_true',
+                        help="Save a visual representation of the palette")
+
+    parser.add_argument('--convert', action='store_true',
+                        help="Convert every image to EBG with the shared palette")
+    parser.add_argument('--output-dir', type=str, default=None,
+                        help="Directory where EBG files are saved by --convert. Default: next to each input")
+    parser.add_argument('--options', type=str, default='',
+                        help="img2ebg options applied to every converted image, e.g. \"-z auto --lut\"")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes. Default: number of CPUs")
+    parser.add_argument('--report', type=str, default=None, help="Save the per-image error report as JSON")
+    args = parser.parse_args()
+
+    if (args.max_delta_e is not None or args.min_psnr is not None) and not args.auto_k:
+        parser.error("Arguments --max-delta-e and --min-psnr require --auto-k")
+    if args.auto_k and args.max_delta_e is None and args.min_psnr is None:
+        args.max_delta_e = 3.0
+
+    items = collect_items(args.inputs, args.output_dir)
+    if len(items) == 0:
+        parser.error("No input images found")
+    names = [name for name, _ in items]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        histograms = list(executor.map(image_histogram, items, [args.sample] * len(items), range(len(items))))
+    histogram = joint_histogram(histograms, args.equal_weight)
+
+    if args.auto_k:
+        palette, k, _ = search_palette_size(histogram, max_delta_e=args.max_delta_e, min_psnr=args.min_psnr,
+                                            transparent_color=args.transparent, engine=args.engine, jobs=args.jobs)
+        if k is None:
+            print(f"Warning: no palette meets the target ({img2ebg.target_description(args)}), "
+                  f"using the largest one: {len(palette)} colors")
+    else:
+        palette = Palette.from_histogram(histogram, args.colors, transparent_color=args.transparent, engine=args.engine)
+
+    if len(os.path.dirname(args.output)) > 0:
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    palette.save(args.output)
+    if args.save_graphic_palette:
+        palette.save_img(f"{os.path.splitext(args.output)[0]}.png")
+
+    report = error_report(palette, names, histograms)
+    delta_e, psnr = palette.histogram_error(histogram)
+    print(f"Palette: {len(palette)} colors from {len(items)} images, saved to '{args.output}'")
+    print(f"{'delta E':>8s}  {'PSNR (dB)':>9s}  Image")
+    for name, (image_delta_e, image_psnr) in report.items():
+        print(f"{image_delta_e:8.2f}  {image_psnr:9.2f}  {name}")
+    print(f"{delta_e:8.2f}  {psnr:9.2f}  (all images)")
+
+    failed = 0
+    if args.convert:
+        palette_options = ['-p', args.output]
+        if args.transparent is not None:
+            palette_options += ['-t', ','.join(str(int(c)) for c in args.transparent)]
+        # List items with their own palette options keep them instead of the shared palette
+        items = [(name, arguments if sets_palette(arguments) else [*palette_options, *arguments])
+                 for name, arguments in items]
+        for result in run_batch(items, shlex.split(args.options), args.jobs):
+            if result['error'] is not None:
+                failed += 1
+                print(f"FAILED {result['name']}: {result['error']}")
+        print(f"{len(items) - failed}/{len(items)} converted")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                'palette': args.output,
+                'colors': len(palette),
+                'total': {'delta_e': delta_e, 'psnr': psnr},
+                'images': {name: {'delta_e': e, 'psnr': p} for name, (e, p) in report.items()}
+            }, f, indent=4)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,90 @@
+'''
+Search for the smallest palette that meets a color quality target.
+
+Candidate palette sizes are evaluated in parallel worker processes. The colors
+of the histogram (and their LAB conversion) are computed once and shared with
+every worker, so candidates only pay for clustering and error measurement.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from ebg import Palette, Utils
+
+MIN_COLORS = 2
+MAX_COLORS = 256
+
+# Histogram colors shared by every candidate evaluated in a worker process
+_colors = None
+
+
+def _init_worker(colors):
+    global _colors
+    _colors = colors
+
+
+def _evaluate(k):
+    rgb_colors, lab_colors, counts, transparent_color, engine = _colors
+    palette = Palette.from_lab(lab_colors, k, weights=counts,
+                               transparent_color=transparent_color, engine=engine)
+    delta_e, psnr = palette.color_error(lab_colors, rgb_colors, weights=counts)
+    return k, palette, delta_e, psnr
+
+
+def search_palette_size(histogram, max_delta_e=None, min_psnr=None, transparent_color=None,
+                        engine='kmeans', min_colors=MIN_COLORS, max_colors=MAX_COLORS, jobs=None):
+    '''
+        Find the smallest palette for an RGB565 histogram whose mean delta E is at most
+        MAX_DELTA_E and whose PSNR is at least MIN_PSNR.
+        Returns the palette, its K and a {k: (delta E, PSNR)} report of every evaluated candidate.
+        If no candidate meets the target, K is None and the largest palette is returned
+    '''
+    if max_delta_e is None and min_psnr is None:
+        raise ValueError("A delta E or PSNR target is required")
+
+    def meets_target(delta_e, psnr):
+        return (max_delta_e is None or delta_e <= max_delta_e) \
+            and (min_psnr is None or psnr >= min_psnr)
+
+    rgb_transparent = transparent_color
+    if transparent_color is not None:
+        histogram, transparent_color = Utils.add_transparent(histogram, transparent_color)
+    rgb_colors, lab_colors, counts = Utils.histogram_colors(histogram)
+
+    # Palettes can't have more colors than the image itself
+    max_colors = max(min_colors, min(max_colors, len(counts)))
+
+    report = {}
+    palettes = {}
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=((rgb_colors, lab_colors, counts, transparent_color, engine),)) as executor:
+        def evaluate(candidates):
+            for k, palette, delta_e, psnr in executor.map(_evaluate, candidates):
+                report[k] = (delta_e, psnr)
+                palettes[k] = palette
+
+        # First round: powers of two, to bracket the target
+        candidates = sorted({min_colors, max_colors, *(
+            2 ** i for i in range(1, 9) if min_colors < 2 ** i < max_colors
+        )})
+        evaluate(candidates)
+
+        passing = [k for k in candidates if meets_target(*report[k])]
+        if not passing:
+            return palettes[max_colors].set_transparent_color(rgb_transparent), None, report
+
+        # Narrow down (lo, hi], evaluating up to one candidate per worker in each round
+        hi = passing[0]
+        lo = max([k for k in candidates if k < hi], default=hi)
+        while hi - lo > 1:
+            step = max(1, (hi - lo) // (workers + 1))
+            candidates = list(range(lo + step, hi, step))[:workers]
+            evaluate(candidates)
+
+            for k in candidates:
+                if meets_target(*report[k]):
+                    hi = k
+                    break
+                lo = k
+
+    return palettes[hi].set_transparent_color(rgb_transparent), hi, report
@@ -0,0 +1,109 @@
+'''
+Pipelined frame conversion.
+
+Frames are decoded in a thread, quantized in a pool of worker processes and
+written in their original order by a writer thread. Stages are connected by
+bounded queues, so each one overlaps with the next while memory stays bounded.
+'''
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+
+# Palette and quantization method used by a worker process
+_palette = None
+_method = None
+
+# End of stream marker passed between stages
+_DONE = object()
+
+
+def _init_worker(palette, method, profile):
+    global _palette, _method
+    _palette = palette
+    _method = method
+    if profile:
+        profiling.enable()
+
+
+def _quantize(frame):
+    # Stages profiled in the worker go back to the main process with the frame
+    bitmap = np.asarray(_palette.quantize(frame, method=_method), dtype=np.uint8)
+    return bitmap, profiling.drain()
+
+
+def convert_frames(frames, palette, writer, method='exact', jobs=None, buffer_size=None):
+    '''
+        Quantize every frame with the palette and append it to an EBGWriter.
+        Output is identical to quantizing and writing the frames one by one.
+        At most BUFFER_SIZE frames wait between stages (default: twice the workers)
+    '''
+    workers = jobs or os.cpu_count() or 1
+    buffer_size = buffer_size or 2 * workers
+
+    if method == 'lut':
+        # Build the table once (and cache it on disk) before workers ask for it
+        palette.rgb565_lut()
+
+    decoded = queue.Queue(maxsize=buffer_size)
+    quantized = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    errors = []
+
+    def decode():
+        try:
+            for frame in frames:
+                if stop.is_set():
+                    break
+                decoded.put(frame)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            decoded.put(_DONE)
+
+    def write():
+        while True:
+            future = quantized.get()
+            if future is _DONE:
+                return
+            if errors:
+                # Keep consuming so the quantization stage never blocks
+                future.cancel()
+                continue
+            try:
+                bitmap, records = future.result()
+                profiling.merge(records)
+                writer.write_frame(bitmap)
+            except BaseException as e:
+                errors.append(e)
+
+    decoder = threading.Thread(target=decode, daemon=True)
+    writer_thread = threading.Thread(target=write, daemon=True)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(palette, method, profiling.enabled())) as executor:
+        decoder.start()
+        writer_thread.start()
+
+        frame = None
+        try:
+            frame = decoded.get()
+            while frame is not _DONE and not errors:
+                # Futures are queued in submission order, so the writer keeps frames ordered
+                quantized.put(executor.submit(_quantize, frame))
+                frame = decoded.get()
+        finally:
+            stop.set()
+            quantized.put(_DONE)
+            writer_thread.join()
+
+            # Unblock the decoder if it is still waiting for room in the queue
+            while frame is not _DONE:
+                frame = decoded.get()
+            decoder.join()
+
+    if errors:
+        raise errors[0]
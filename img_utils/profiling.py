@@ -0,0 +1,223 @@
+'''
+Per-stage profiling of the conversion tools.
+
+Code marks its stages with `with profiling.stage(name, items):`. Until a
+profiler is enabled (the --profile option of the tools), a stage is a shared
+no-op context, so marks only cost a global lookup. Enabled, every run of a
+stage records its wall time, the CPU time of the thread running it, its item
+count and the peak RSS of the process when it ends. Stages nest and may run
+in several threads or processes at once, so their times can add up to more
+than the total.
+
+Results are saved as a JSON summary per stage, and as a Chrome trace-event
+file with every stage run (chrome://tracing or https://ui.perfetto.dev).
+'''
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak RSS is left out
+    resource = None
+
+_profiler = None
+
+
+def peak_rss(who=None):
+    '''
+        Peak resident set size of this process (or of its finished children), in bytes
+    '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024 * rss
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, items):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name, items):
+        self.profiler = profiler
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start,
+                             time.thread_time() - self.cpu, self.items)
+        return False
+
+    def add(self, items):
+        '''
+            Count ITEMS more items processed by the stage
+        '''
+        self.items += items
+
+
+class Profiler:
+    '''
+        Stage runs recorded while profiling, as (name, start, wall time, CPU time, items,
+        pid, thread id, peak RSS) tuples. Start times are time.perf_counter() values,
+        which share their origin between the processes of a machine
+    '''
+    def __init__(self):
+        self.command = list(sys.argv)
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, name, start, wall, cpu, items=0, pid=None, tid=None, rss=None):
+        record = (name, start, wall, cpu, items, os.getpid() if pid is None else pid,
+                  threading.get_ident() if tid is None else tid, peak_rss() if rss is None else rss)
+        with self._lock:
+            self.records.append(record)
+
+    def drain(self):
+        '''
+            Take the records so far, e.g. to send them from a worker process to the main one
+        '''
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        '''
+            Totals of every stage, in order of first run, and of the whole run
+        '''
+        stages = {}
+        for name, start, wall, cpu, items, pid, tid, rss in sorted(self.records, key=lambda r: r[1]):
+            stage = stages.setdefault(name, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'items': 0,
+                                             'peak_rss': None})
+            stage['calls'] += 1
+            stage['wall_time'] += wall
+            stage['cpu_time'] += cpu
+            stage['items'] += items
+            if rss is not None:
+                stage['peak_rss'] = max(stage['peak_rss'] or 0, rss)
+
+        rss = [r for r in (peak_rss(), peak_rss(getattr(resource, 'RUSAGE_CHILDREN', None))) if r]
+        return {
+            'command': self.command,
+            'wall_time': time.perf_counter() - self.start,
+            'cpu_time': time.process_time() - self.start_cpu,
+            'peak_rss': max(rss) if rss else None,
+            'stages': stages,
+        }
+
+    def trace(self):
+        '''
+            Stage runs as Chrome trace events, in microseconds from the start of profiling
+        '''
+        events = [{'name': name, 'ph': 'X', 'ts': 1e6 * (start - self.start), 'dur': 1e6 * wall,
+                   'pid': pid, 'tid': tid, 'args': {'cpu_ms': 1e3 * cpu, 'items': items, 'peak_rss': rss}}
+                  for name, start, wall, cpu, items, pid, tid, rss in self.records]
+        events += [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'main' if pid == os.getpid()
+                                                                                   else f"worker {pid}"}}
+                   for pid in sorted({event['pid'] for event in events})]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        '''
+            Save the summary to FILENAME and the trace to {FILENAME without extension}.trace.json.
+            Returns the trace filename
+        '''
+        trace_filename = f"{os.path.splitext(filename)[0]}.trace.json"
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        with open(trace_filename, 'w') as f:
+            json.dump(self.trace(), f)
+        return trace_filename
+
+
+def enable():
+    '''
+        Start recording stages in this process
+    '''
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def disable():
+    global _profiler
+    _profiler = None
+
+def enabled():
+    return _profiler is not None
+
+def stage(name, items=0):
+    '''
+        Context that records a run of stage NAME, processing ITEMS items (frames, glyphs, colors...)
+    '''
+    if _profiler is None:
+        return _NULL_STAGE
+    return _Stage(_profiler, name, items)
+
+def merge(records):
+    '''
+        Add records drained from another profiler, e.g. in a worker process
+    '''
+    if _profiler is not None:
+        for record in records:
+            _profiler.record(*record)
+
+def drain():
+    return [] if _profiler is None else _profiler.drain()
+
+@contextlib.contextmanager
+def profile(filename, name='total'):
+    '''
+        Profile the enclosed code as stage NAME if FILENAME is given, saving the results to it
+    '''
+    if filename is None:
+        yield None
+        return
+
+    profiler = enable()
+    try:
+        with stage(name):
+            yield profiler
+    finally:
+        _finish(profiler, filename)
+
+def profile_until_exit(filename, name='total'):
+    '''
+        Profile the rest of the run as stage NAME if FILENAME is given, saving the results
+        when the interpreter exits. For scripts that don't run their work in a single block
+    '''
+    if filename is None:
+        return None
+
+    profiler = enable()
+    total = stage(name).__enter__()
+    def finish():
+        total.__exit__(None, None, None)
+        _finish(profiler, filename)
+    atexit.register(finish)
+    return profiler
+
+def _finish(profiler, filename):
+    disable()
+    trace_filename = profiler.save(filename)
+    print(f"Profile saved to '{filename}' and '{trace_filename}'", file=sys.stderr)
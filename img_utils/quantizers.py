@@ -0,0 +1,108 @@
+'''
+Color quantizer engines used to generate palettes.
+
+Every engine reduces a set of (optionally weighted) 8-bit LAB colors to at
+most K representative colors.
+'''
+import numpy as np
+
+
+class Quantizer:
+    name = None
+
+    def fit(self, colors, k, weights=None):
+        '''
+            Reduce colors to at most K colors. Returns the new colors as uint8
+        '''
+        raise NotImplementedError
+
+
+class KMeansQuantizer(Quantizer):
+    name = 'kmeans'
+
+    def fit(self, colors, k, weights=None):
+        from sklearn.cluster import MiniBatchKMeans
+        clt = MiniBatchKMeans(n_clusters = k)#, verbose=True)
+        clt.fit(colors, sample_weight=weights)
+        return np.uint8(clt.cluster_centers_)
+
+
+class MedianCutQuantizer(Quantizer):
+    name = 'median-cut'
+
+    def fit(self, colors, k, weights=None):
+        weights = np.ones(len(colors)) if weights is None else np.asarray(weights, dtype=np.float64)
+        boxes = [np.arange(len(colors))]
+
+        while len(boxes) < k:
+            # Split the box with the widest channel range at its weighted median
+            ranges = np.array([np.ptp(colors[box], axis=0) for box in boxes])
+            box_index = np.argmax(ranges.max(axis=1))
+            if ranges[box_index].max() == 0:
+                break   # No box can be split any further
+
+            box = boxes[box_index]
+            channel = np.argmax(ranges[box_index])
+            box = box[np.argsort(colors[box, channel], kind='stable')]
+
+            cumulative = np.cumsum(weights[box])
+            cut = np.clip(np.searchsorted(cumulative, cumulative[-1] / 2) + 1, 1, len(box) - 1)
+            boxes[box_index:box_index+1] = [box[:cut], box[cut:]]
+
+        return np.uint8([
+            np.round(np.average(colors[box], axis=0, weights=weights[box]))
+            for box in boxes
+        ])
+
+
+class OctreeQuantizer(Quantizer):
+    name = 'octree'
+
+    @staticmethod
+    def _nodes(colors, level):
+        # Node identifier at a given tree level: the top `level` bits of each channel, interleaved
+        shift = 8 - level
+        return (colors[:, 0] >> shift) << (2 * level) | (colors[:, 1] >> shift) << level | (colors[:, 2] >> shift)
+
+    def fit(self, colors, k, weights=None):
+        weights = np.ones(len(colors)) if weights is None else np.asarray(weights, dtype=np.float64)
+        colors = colors.astype(np.int64)
+
+        # Deepest level of the tree whose nodes still fit in the palette
+        level = 0
+        for l in range(1, 9):
+            if len(np.unique(OctreeQuantizer._nodes(colors, l))) > k:
+                break
+            level = l
+
+        leaves = OctreeQuantizer._nodes(colors, level)
+        if level < 8:
+            # Expand the heaviest nodes into their children while there is room left
+            nodes, node_inverse = np.unique(leaves, return_inverse=True)
+            children = OctreeQuantizer._nodes(colors, level + 1)
+            node_weights = np.bincount(node_inverse, weights=weights)
+            node_children = np.unique(np.stack([node_inverse, children], axis=1), axis=0)
+            child_counts = np.bincount(node_children[:, 0], minlength=len(nodes))
+
+            split = np.zeros(len(nodes), dtype=bool)
+            count = len(nodes)
+            for n in np.argsort(-node_weights, kind='stable'):
+                if count + child_counts[n] - 1 <= k:
+                    split[n] = True
+                    count += child_counts[n] - 1
+
+            # Offset unsplit nodes so their identifiers never collide with child identifiers
+            leaves = np.where(split[node_inverse], children, leaves + (1 << (3 * (level + 1))))
+
+        _, leaf_inverse = np.unique(leaves, return_inverse=True)
+        leaf_weights = np.bincount(leaf_inverse, weights=weights)
+        return np.uint8(np.round(np.stack([
+            np.bincount(leaf_inverse, weights=weights * colors[:, c]) / leaf_weights
+            for c in range(colors.shape[1])
+        ], axis=1)))
+
+
+QUANTIZERS = {
+    quantizer.name: quantizer
+    for quantizer in (KMeansQuantizer, MedianCutQuantizer, OctreeQuantizer)
+}
@@ -0,0 +1,252 @@
+'''
+Rebuild EBG images and fonts whenever their sources change.
+
+Images are given as in batch.py: glob patterns, directories or '@' list files
+with per-item img2ebg options. Fonts are font2bin directories (or directories
+of them), rebuilt to .bmf and C header with bin2c.py. Sources are polled, and
+a target is rebuilt once its input files (and options, for list files) have
+been stable for one poll.
+
+Everything runs in this process, so libraries are imported once and palettes
+of unchanged colors are reused from memory. Frames are converted serially
+unless an item asks for -j, since a warm single process starts faster than a
+pool of workers. At startup, only targets with missing or outdated outputs
+are built.
+'''
+import os
+import sys
+import json
+import time
+import shlex
+from argparse import ArgumentParser
+
+import img2ebg
+from batch import collect_items, convert_item
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'font_utils'))
+from font2bin import build_font
+from bin2c import font_to_c
+
+
+class Target:
+    '''
+        An output to keep up to date: its name, the files (or directories of files) it is built
+        from, the files it writes and the function that builds it. OPTIONS are part of its fingerprint
+    '''
+    def __init__(self, name, inputs, outputs, build, options=()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.build = build
+        self.options = tuple(options)
+
+    def files(self):
+        files = []
+        for path in self.inputs:
+            if os.path.isdir(path):
+                files += [os.path.join(path, f) for f in img2ebg.sorted_alphanumeric(os.listdir(path))]
+            else:
+                files.append(path)
+        return files
+
+    def fingerprint(self):
+        stats = []
+        for path in self.files():
+            try:
+                st = os.stat(path)
+                stats.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stats.append((path, None, None))
+        return self.options, tuple(stats)
+
+    def stale(self):
+        '''
+            Whether an output is missing or older than an input
+        '''
+        try:
+            built = min(os.path.getmtime(path) for path in self.outputs)
+        except OSError:
+            return True
+        return any(os.path.exists(path) and os.path.getmtime(path) > built for path in self.files())
+
+
+def image_target(item, options):
+    '''
+        Target of a batch item, built with img2ebg OPTIONS before its own
+    '''
+    name, arguments = item
+    args = img2ebg.build_parser().parse_args([*options, *arguments])
+
+    inputs = list(args.image)
+    if args.palette:
+        inputs.append(args.palette)
+
+    outputs = img2ebg.output_files(args)
+
+    def build():
+        result = convert_item(item, options)
+        if result['error'] is not None:
+            raise RuntimeError(result['error'])
+        return f"{result['size']} B"
+
+    return Target(name, inputs, outputs, build, (*options, *arguments))
+
+def font_target(font_dir):
+    '''
+        Target of a font2bin font directory: its .bmf, charmap and C header
+    '''
+    font_name = os.path.basename(os.path.normpath(font_dir))
+    descriptor = os.path.join(font_dir, f"{font_name}.json")
+    inputs = [descriptor]
+    try:
+        with open(descriptor, 'r') as f:
+            inputs.append(os.path.join(font_dir, json.load(f)['glyphs']))
+    except (OSError, ValueError, KeyError):
+        pass    # Reported when built
+
+    root = os.path.dirname(os.path.normpath(font_dir))
+    filename = font_name.replace(' ', '_')
+    outputs = [os.path.join(font_dir, f"{filename}.bmf"), os.path.join(font_dir, f"{filename}.h")]
+
+    def build():
+        build_font(font_dir)
+        return font_to_c(font_name, root)
+
+    return Target(font_dir, inputs, outputs, build)
+
+def collect_fonts(values):
+    '''
+        Font directories among VALUES, which are font directories or directories of them
+    '''
+    fonts = []
+    for value in values:
+        if os.path.isfile(os.path.join(value, f"{os.path.basename(os.path.normpath(value))}.json")):
+            fonts.append(value)
+        elif os.path.isdir(value):
+            fonts += [os.path.join(value, d) for d in sorted(os.listdir(value))
+                      if os.path.isfile(os.path.join(value, d, f"{d}.json"))]
+    return fonts
+
+def collect_targets(inputs, fonts, output_dir=None, options=(), cache=None):
+    '''
+        {name: Target} of every image and font. Files written by a target are never
+        taken as the input of another one. Image targets are reused from CACHE
+        ({(name, arguments): Target}) while their arguments don't change
+    '''
+    cache = {} if cache is None else cache
+    targets = {}
+    for item in collect_items(inputs, output_dir):
+        key = (item[0], tuple(item[1]))
+        if key not in cache:
+            try:
+                cache[key] = image_target(item, options)
+            except SystemExit:
+                print(f"Invalid arguments: {item[0]}", file=sys.stderr)
+                cache[key] = None
+        if cache[key] is not None:
+            targets[item[0]] = cache[key]
+    for font_dir in collect_fonts(fonts):
+        targets[font_dir] = font_target(font_dir)
+
+    outputs = {os.path.normpath(path) for target in targets.values() for path in target.outputs}
+    return {name: target for name, target in targets.items() if os.path.normpath(name) not in outputs}
+
+def build(target):
+    '''
+        Build a target, reporting the result instead of raising
+    '''
+    start = time.perf_counter()
+    try:
+        result = target.build()
+        print(f"{time.perf_counter() - start:8.3f} s  {target.name} ({result})", flush=True)
+        return True
+    except Exception as e:
+        print(f"{time.perf_counter() - start:8.3f} s  FAILED {target.name}: {e}", flush=True)
+        return False
+
+def warm_up():
+    '''
+        Import what conversions need ahead of the first change
+    '''
+    import cv2
+    import sklearn.cluster
+    import sklearn.metrics
+
+def watch(inputs, fonts, output_dir=None, options=(), interval=0.1, rebuild=False, once=False):
+    '''
+        Build stale targets, then rebuild targets as their fingerprint changes, until interrupted.
+        With ONCE, return after the first pass with whether every build succeeded
+    '''
+    built = {}      # Fingerprint of every target when it was last built (or found up to date)
+    seen = {}       # Fingerprint of every target at the previous poll
+    ok = True
+
+    cache = {}
+    def collect(previous):
+        # List files may be missing or half-written while they are saved: keep the previous targets
+        try:
+            return collect_targets(inputs, fonts, output_dir, options, cache)
+        except (OSError, ValueError) as e:
+            print(f"Can't collect targets: {e}", file=sys.stderr, flush=True)
+            return previous
+
+    targets = collect(None)
+    if targets is None:
+        if once:
+            return False
+        targets = {}    # Collected again at the next poll
+    for name, target in targets.items():
+        fingerprint = target.fingerprint()
+        if rebuild or target.stale():
+            ok &= build(target)
+        built[name] = seen[name] = fingerprint
+    if once:
+        return ok
+    print(f"Watching {len(targets)} targets", flush=True)
+
+    while True:
+        time.sleep(interval)
+        targets = collect(targets)
+        for name, target in targets.items():
+            fingerprint = target.fingerprint()
+            # Build once the sources stopped changing, so half-saved files are skipped
+            if fingerprint == seen.get(name) and fingerprint != built.get(name):
+                build(target)
+                built[name] = fingerprint
+            seen[name] = fingerprint
+
+        for name in set(seen) - set(targets):
+            del seen[name]
+            built.pop(name, None)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Rebuild EBG images and fonts as their sources change")
+    parser.add_argument('inputs', nargs='*', type=str,
+                        help="Glob patterns, directories (watched recursively) or '@' list files of images")
+    parser.add_argument('-f', '--fonts', type=str, nargs='+', default=[],
+                        help="Font directories (with a font2bin JSON descriptor) or directories of them")
+    parser.add_argument('-o', '--output-dir', type=str, default=None,
+                        help="Directory where EBG files are saved. Default: next to each input")
+    parser.add_argument('--options', type=str, default='',
+                        help="img2ebg options applied to every image, e.g. \"-k 16 -c\". "
+                             "Options in list files take precedence")
+    parser.add_argument('-i', '--interval', type=float, default=0.1,
+                        help="Time between polls of the sources, in seconds. Default: 0.1")
+    parser.add_argument('-B', '--rebuild', action='store_true',
+                        help="Build every target at startup, not only missing or outdated ones")
+    parser.add_argument('--once', action='store_true', help="Build stale targets and exit, without watching")
+    args = parser.parse_args()
+
+    if len(args.inputs) == 0 and len(args.fonts) == 0:
+        parser.error("Nothing to watch, give images and/or --fonts")
+
+    options = shlex.split(args.options)
+    if not args.once:
+        warm_up()
+
+    try:
+        sys.exit(0 if watch(args.inputs, args.fonts, args.output_dir, options,
+                            args.interval, args.rebuild, args.once) else 1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,15 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+IMG_UTILS_DIR = os.path.join(TESTS_DIR, '..', 'img_utils')
+HOST_DIR = os.path.join(TESTS_DIR, '..', 'host')
+sys.path.insert(0, IMG_UTILS_DIR)
+sys.path.insert(0, HOST_DIR)
+
+# Palette lookup tables must not be read from (or written to) the user cache
+os.environ['EBG_CACHE_DIR'] = tempfile.mkdtemp(prefix='ebg_tests_')
+atexit.register(shutil.rmtree, os.environ['EBG_CACHE_DIR'], ignore_errors=True)
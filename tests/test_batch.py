@@ -0,0 +1,17 @@
+import os
+
+from batch import collect_items
+
+
+def test_list_items_named_after_first_input(tmp_path):
+    list_file = tmp_path / 'list.txt'
+    list_file.write_text("icons/wifi.png -k 4\n-k 16 -t 0,0,0 icons/battery.png\n# Comment\n\n--bogus\n")
+    items = collect_items([f"@{list_file}"], output_dir='out')
+
+    assert items == [
+        ('icons/wifi.png -k 4', ['icons/wifi.png', '-k', '4', '-o', os.path.join('out', 'wifi')]),
+        ('-k 16 -t 0,0,0 icons/battery.png',
+         ['-k', '16', '-t', '0,0,0', 'icons/battery.png', '-o', os.path.join('out', 'battery')]),
+        # Invalid arguments are reported when converted
+        ('--bogus', ['--bogus']),
+    ]
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from compression import lz_decode, lz_encode, LZ_WINDOW
+
+
+def as_bytes(data):
+    return np.frombuffer(data, dtype=np.uint8)
+
+@pytest.mark.parametrize('data', [
+    as_bytes(b''),
+    as_bytes(b'a'),
+    as_bytes(b'abc' * 50),                      # Overlapping matches repeating a period
+    np.zeros(1000, dtype=np.uint8),             # Overlapping matches of offset 1
+    np.arange(600, dtype=np.uint8),             # Non-overlapping matches, far back
+    np.tile(np.random.default_rng(0).integers(0, 256, 40, dtype=np.uint8), 30),
+    np.random.default_rng(1).integers(0, 4, LZ_WINDOW * 3, dtype=np.uint8),
+])
+def test_lz_round_trip(data):
+    assert np.array_equal(lz_decode(lz_encode(data), data.size), data)
+
+def test_lz_invalid_payloads():
+    data = as_bytes(b'abcd' * 20)
+    payload = lz_encode(data)
+
+    with pytest.raises(ValueError):
+        lz_decode(payload[:-1], data.size)          # Truncated
+    with pytest.raises(ValueError):
+        lz_decode(payload, data.size + 1)           # Wrong size
+    with pytest.raises(ValueError):
+        lz_decode(bytes([0x01, 0x05, 0x00]), 3)     # Match before the start of the frame
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from ebg import EBG, Palette, Utils
+
+ENCODINGS = [None, ['rle'], ['lz'], ['rle', 'lz', 'delta']]
+
+
+def make_image(width=20, height=12, frame=0):
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([x * 12, y * 20, (x + y + frame) * 8], axis=-1).astype(np.uint8)
+    img[3:9, 5 + frame:11 + frame] = (40, 40, 200)
+    return img
+
+@pytest.mark.parametrize('version', EBG.VERSIONS)
+@pytest.mark.parametrize('encodings', ENCODINGS)
+def test_apply_indexed_frame(tmp_path, version, encodings):
+    frames = [make_image(frame=i) for i in range(3)]
+    palette = Palette.from_frames(frames, 6)
+    filename = str(tmp_path / 'indexed.ebg')
+    EBG(20, 12, [palette.quantize(f) for f in frames], palette=palette).save(filename, encodings=encodings,
+                                                                            version=version)
+
+    ebg = EBG.load(filename)
+    for i in range(len(ebg)):
+        img = ebg.apply(ebg.frame(i))
+        assert img.shape == (12, 20, 3)
+        assert np.array_equal(img, ebg.render(i, i + 1)[0])
+
+@pytest.mark.parametrize('version', EBG.VERSIONS)
+@pytest.mark.parametrize('encodings', ENCODINGS)
+def test_rgb565_frames_are_native(tmp_path, version, encodings):
+    bitmaps = [Utils.bgr_to_rgb565(make_image(frame=i)) for i in range(3)]
+    filename = str(tmp_path / 'rgb565.ebg')
+    EBG(20, 12, bitmaps).save(filename, encodings=encodings, version=version)
+
+    ebg = EBG.load(filename)
+    assert ebg.frames.dtype == np.uint16
+    for i, bitmap in enumerate(bitmaps):
+        frame = ebg.frame(i)
+        assert frame.dtype == np.uint16
+        assert np.array_equal(frame.reshape(-1), np.asarray(bitmap).reshape(-1))
+        assert ebg.apply(frame).shape == (12, 20, 3)
+
+@pytest.mark.parametrize('build', [
+    lambda img, k, t: Palette.from_img(img, k, transparent_color=t),
+    lambda img, k, t: Palette.from_frames([img], k, transparent_color=t),
+])
+def test_single_color_palette_with_transparent_color(build):
+    # The transparent color is not in the image, so clustering can't keep it with k=1
+    palette = build(make_image(), 1, (255, 0, 255))
+    assert len(palette) == 1
+    assert palette.transparent == 0
+    assert tuple(palette.rgb_colors[0]) == (255, 0, 255)
+
+def test_from_lab_single_color_is_transparent_color():
+    img = make_image()
+    lab_transparent = Utils.rgb_to_lab(np.uint8([[255, 0, 255]]))
+    pixels = np.concatenate([lab_transparent, Utils.rgb_to_lab(img.reshape((-1, 3))[:, ::-1].copy())])
+    palette = Palette.from_lab(pixels, 1, transparent_color=lab_transparent)
+    assert len(palette) == 1
+    assert palette.transparent == 0
+    assert np.array_equal(palette.lab_colors, lab_transparent)
+
+def test_lut_cache_is_bounded():
+    Palette._rgb565_lut.cache_clear()
+    for i in range(Palette.LUT_CACHE_SIZE + 4):
+        palette = Palette(np.array([[i, 0, 0], [255, 255, 255]], dtype=np.uint8))
+        lut = palette.rgb565_lut()
+        assert lut.shape == (0x10000,)
+        assert palette.rgb565_lut() is lut
+    assert Palette._rgb565_lut.cache_info().currsize == Palette.LUT_CACHE_SIZE
+
+@pytest.mark.parametrize('seed', range(3))
+def test_transparent_refit_colors_are_distinct(seed):
+    np.random.seed(seed)
+    y, x = np.mgrid[0:64, 0:64]
+    img = np.stack([x * 4, y * 4, (x + y) * 2], axis=-1).astype(np.uint8)
+    img[20:40, 10:50] = (249, 16, 246)
+    palette = Palette.from_frames([img], 16, transparent_color=(255, 0, 255))
+
+    assert len(np.unique(palette.rgb_colors, axis=0)) == len(palette)
+    assert tuple(palette.rgb_colors[palette.transparent]) == (255, 0, 255)
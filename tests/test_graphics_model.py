@@ -0,0 +1,24 @@
+import os
+import sys
+import subprocess
+
+import numpy as np
+
+from graphics_model import Display, G_FILLED, color_to_rgb, hex_to_color
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_import_does_not_load_opencv():
+    code = "import sys, graphics_model; sys.exit('cv2' in sys.modules)"
+    subprocess.run([sys.executable, '-c', code], cwd=os.path.join(TESTS_DIR, '..', 'img_utils'), check=True)
+
+def test_save_screen(tmp_path):
+    import cv2
+    display = Display(16, 8)
+    display.refresh_region((0, 0, 15, 7), lambda region: display.draw_rect((2, 1, 9, 5), hex_to_color(0xF800),
+                                                                           G_FILLED))
+    filename = str(tmp_path / 'screen.png')
+    display.save(filename)
+    assert np.array_equal(cv2.imread(filename), display.screenshot('BGR'))
+    assert tuple(color_to_rgb(display.screen)[3, 4]) == (248, 0, 0)
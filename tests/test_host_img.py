@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+import pytest
+
+from graphics import DEFAULT_LIBRARY, G_FILLED, Graphics
+from ebg import EBG, Palette, Utils
+from ebgpack import EBGPack, build_pack
+from graphics_model import hex_to_color
+
+pytestmark = pytest.mark.skipif(not os.path.isfile(DEFAULT_LIBRARY),
+                                reason="Host library not built, see host/Makefile")
+
+ENCODINGS = [None, ['rle'], ['lz'], ['delta'], ['rle', 'lz', 'delta']]
+# (k, index bits) of indexed images, None for RGB565 pixels
+MODES = {
+    '1-bit': (2, None),
+    '2-bit': (4, None),
+    '4-bit': (16, None),
+    '8-bit': (64, None),
+    'byte indices': (4, 8),
+    'transparent': (16, None),
+    'rgb565': None,
+}
+WIDTH, HEIGHT = 21, 13      # Odd sizes, so packed rows end in padding bits
+X, Y = 5, 3
+BACKGROUND = 0x07E0         # g_color_t, not used by the test frames
+
+
+def make_frames(count=4):
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    frames = []
+    for i in range(count):
+        img = np.stack([x * 12, y * 20, (x + y) * 6], axis=-1).astype(np.uint8)
+        img[2:7, 3 + 3 * i:9 + 3 * i] = (255, 0, 255)
+        img[9:11, :4 + i] = (30, 30, 200)
+        frames.append(img)
+    return frames
+
+def make_ebg(mode, version=None, encodings=None, filename=None):
+    frames = make_frames()
+    if MODES[mode] is None:
+        ebg = EBG(WIDTH, HEIGHT, [Utils.bgr_to_rgb565(f) for f in frames])
+        index_bits = None
+    else:
+        k, index_bits = MODES[mode]
+        transparent = (255, 0, 255) if mode == 'transparent' else None
+        np.random.seed(0)
+        palette = Palette.from_frames(frames, k, transparent_color=transparent)
+        ebg = EBG(WIDTH, HEIGHT, [palette.quantize(f) for f in frames], palette=palette)
+    ebg.save(filename, index_bits=index_bits, encodings=encodings, version=version)
+    return EBG.load(filename)
+
+def expected(ebg, index):
+    '''
+        Frame of an image loaded by ebg.py, drawn over the background as g_color_t values
+    '''
+    bitmap = ebg.frame(index)
+    if ebg.palette is None:
+        return hex_to_color(bitmap)
+    colors = ebg.palette.rgb_colors.astype(np.uint16)
+    codes = hex_to_color(Utils.rgb_to_rgb565(colors[:, 0], colors[:, 1], colors[:, 2]))[bitmap]
+    if ebg.palette.transparent is not None:
+        codes[bitmap == ebg.palette.transparent] = BACKGROUND
+    return codes
+
+def drawn(graphics, img):
+    '''
+        Current frame of an image opened by the library, drawn over the background
+    '''
+    screen = (0, 0, graphics.width - 1, graphics.height - 1)
+    def draw(region):
+        graphics.draw_rect(screen, BACKGROUND, G_FILLED)
+        graphics.draw_img(X, Y, img)
+    graphics.refresh_region(screen, draw)
+    return graphics.screen[Y:Y + img.height, X:X + img.width]
+
+@pytest.fixture(scope='module')
+def graphics():
+    # The library has a single display, shared by every test
+    return Graphics()
+
+def open_image(graphics, filename, source):
+    if source == 'file':
+        return graphics.img_open(filename)
+    with open(filename, 'rb') as f:
+        return graphics.img_from_memory(f.read())
+
+@pytest.mark.parametrize('source', ['file', 'memory'])
+@pytest.mark.parametrize('version', EBG.VERSIONS)
+@pytest.mark.parametrize('encodings', ENCODINGS)
+@pytest.mark.parametrize('mode', MODES)
+def test_frames_match_ebg(graphics, tmp_path, mode, encodings, version, source):
+    filename = str(tmp_path / 'image.ebg')
+    ebg = make_ebg(mode, version, encodings, filename)
+
+    with open_image(graphics, filename, source) as img:
+        assert (img.width, img.height, len(img)) == (ebg.width, ebg.height, len(ebg))
+
+        # Frames in order, then seeking backwards
+        for i in range(len(ebg)):
+            if i > 0:
+                img.load_next()
+            assert np.array_equal(drawn(graphics, img), expected(ebg, i)), f"Frame {i}"
+        for i in reversed(range(len(ebg))):
+            img.load_frame(i)
+            assert np.array_equal(drawn(graphics, img), expected(ebg, i)), f"Frame {i}"
+
+@pytest.mark.parametrize('version', EBG.VERSIONS)
+@pytest.mark.parametrize('mode', ['1-bit', '4-bit', 'rgb565'])
+def test_dirty_regions_cover_changes(graphics, tmp_path, mode, version):
+    filename = str(tmp_path / 'image.ebg')
+    ebg = make_ebg(mode, version, ['delta'], filename)
+    full = [(X, Y, X + WIDTH - 1, Y + HEIGHT - 1)]
+
+    with graphics.img_open(filename) as img:
+        assert img.dirty_regions(X, Y) == full
+        for i in range(1, len(ebg)):
+            img.load_next()
+            regions = img.dirty_regions(X, Y)
+            assert 0 < len(regions) < 8 and regions != full
+
+            dirty = np.zeros((HEIGHT, WIDTH), dtype=bool)
+            for x0, y0, x1, y1 in regions:
+                dirty[y0 - Y:y1 - Y + 1, x0 - X:x1 - X + 1] = True
+            changed = expected(ebg, i) != expected(ebg, i - 1)
+            assert changed.any() and not np.any(changed & ~dirty)
+
+        # Frames loaded out of order are redrawn in full
+        img.load_frame(1)
+        assert img.dirty_regions(X, Y) == full
+
+@pytest.mark.parametrize('share_palette', [False, True])
+def test_pack_entries_match_ebg(graphics, tmp_path, share_palette):
+    entries = []
+    for i, mode in enumerate(['1-bit', '2-bit', '4-bit', 'transparent', 'rgb565']):
+        filename = str(tmp_path / f"{i}.ebg")
+        make_ebg(mode, EBG.VERSIONS[i % 2], ['rle', 'lz', 'delta'][:i % 4], filename)
+        entries.append((f"images/{mode}", filename))
+    filename = str(tmp_path / 'images.ebp')
+    build_pack(filename, entries, share_palette=share_palette, encodings=['lz', 'delta'])
+    pack = EBGPack(filename)
+
+    with graphics.img_pack_open(filename) as host_pack:
+        assert len(host_pack) == len(entries)
+        with pytest.raises(KeyError):
+            host_pack.find('images/missing')
+
+        for name, _ in entries:
+            assert graphics.img_pack_hash(name) == EBGPack.hash(name)
+            index = host_pack.find(name)
+            assert index == pack.index(name)
+
+            ebg = pack[name]
+            with host_pack.get(index) as img:
+                for i in range(len(ebg)):
+                    if i > 0:
+                        img.load_next()
+                    assert np.array_equal(drawn(graphics, img), expected(ebg, i)), f"{name}, frame {i}"
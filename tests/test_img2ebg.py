@@ -0,0 +1,101 @@
+import os
+import types
+
+import cv2
+import numpy as np
+
+import img2ebg
+import pipeline
+from ebg import EBG, Utils
+
+
+def make_frames(directory, count=4):
+    os.makedirs(directory)
+    for i in range(count):
+        img = np.zeros((16, 16, 3), dtype=np.uint8)
+        img[:, :8] = (40 * i, 100, 200)
+        img[4:12, 4:12] = (0, 255 - 40 * i, 0)
+        cv2.imwrite(os.path.join(directory, f"{i}.png"), img)
+
+def convert(*arguments):
+    return img2ebg.convert(img2ebg.build_parser().parse_args(list(arguments)), log=lambda *_: None)
+
+def count_decodes(monkeypatch):
+    decodes = []
+    read = img2ebg.FrameSource._read
+    monkeypatch.setattr(img2ebg.FrameSource, '_read', staticmethod(lambda file: decodes.append(file) or read(file)))
+    return decodes
+
+def test_frame_buffer_bounds_pipeline_queues(tmp_path, monkeypatch):
+    make_frames(tmp_path / 'frames', count=6)
+    sizes = []
+
+    class Queue(pipeline.queue.Queue):
+        def __init__(self, maxsize=0):
+            sizes.append(maxsize)
+            super().__init__(maxsize)
+
+    monkeypatch.setattr(pipeline, 'queue', types.SimpleNamespace(Queue=Queue))
+    convert(str(tmp_path / 'frames'), '-k', '4', '-j', '2', '--frame-buffer', '3', '-o', str(tmp_path / 'out'))
+    assert sizes == [3, 3]
+
+def test_frames_decoded_once_per_pass(tmp_path, monkeypatch):
+    make_frames(tmp_path / 'frames', count=4)
+    decodes = count_decodes(monkeypatch)
+
+    # The first frame is reused, the others are decoded for the histogram and the conversion
+    convert(str(tmp_path / 'frames'), '-k', '4', '-j', '1', '-s', '-o', str(tmp_path / 'generated'))
+    assert len(decodes) == 2 * 4 - 1
+
+    # A given palette skips the histogram pass
+    decodes.clear()
+    convert(str(tmp_path / 'frames'), '-p', str(tmp_path / 'generated_palette.json'), '-j', '1',
+            '-o', str(tmp_path / 'given'))
+    assert len(decodes) == 4
+
+def test_sprite_sheet_decoded_once(tmp_path, monkeypatch):
+    sheet = np.zeros((32, 64, 3), dtype=np.uint8)
+    sheet[:, 32:] = (0, 0, 255)
+    cv2.imwrite(str(tmp_path / 'sheet.png'), sheet)
+    decodes = count_decodes(monkeypatch)
+
+    convert(str(tmp_path / 'sheet.png'), '-k', '2', '--cols', '2', '-j', '1', '-o', str(tmp_path / 'sheet'))
+    assert len(decodes) == 1
+
+def test_single_color_with_transparent_color(tmp_path):
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    img[:, :4] = (255, 0, 255)
+    img[:, 4:] = (0, 128, 0)
+    cv2.imwrite(str(tmp_path / 'image.png'), img)
+
+    filename = convert(str(tmp_path / 'image.png'), '-k', '1', '-t', '255,0,255', '-o', str(tmp_path / 'out'))
+    palette = EBG.load(filename).palette
+    assert len(palette) == 1
+    assert palette.transparent == 0
+    assert Utils.rgb_to_rgb565(*(int(c) for c in palette.rgb_colors[0])) == Utils.rgb_to_rgb565(255, 0, 255)
+
+def auto_k_report(*arguments):
+    lines = []
+    img2ebg.convert(img2ebg.build_parser().parse_args(['--auto-k', '-j', '1', *arguments]), log=lines.append)
+    rows = [line for line in lines if line[1:5].strip().isdigit()]
+    return [int(row[1:5]) for row in rows if row.startswith('*')], [line for line in lines if 'Warning' in line]
+
+def test_auto_k_marks_chosen_k(tmp_path):
+    img = np.zeros((16, 16, 3), dtype=np.uint8)
+    for i in range(4):
+        img[4 * i:4 * i + 4] = (50 * i, 255 - 50 * i, 20 * i)
+    cv2.imwrite(str(tmp_path / 'image.png'), img)
+
+    # Four colors and the transparent one
+    marked, warnings = auto_k_report(str(tmp_path / 'image.png'), '-t', '255,0,255', '--max-delta-e', '0.5')
+    assert marked == [5] and warnings == []
+    assert len(EBG.load(str(tmp_path / 'image.ebg')).palette) == 5
+
+def test_auto_k_target_not_met(tmp_path):
+    y, x = np.mgrid[0:64, 0:64]
+    img = np.stack([x * 4, y * 4, (x + y) * 2], axis=-1).astype(np.uint8)
+    cv2.imwrite(str(tmp_path / 'gradient.png'), img)
+
+    marked, warnings = auto_k_report(str(tmp_path / 'gradient.png'), '--max-delta-e', '0.01')
+    assert marked == []
+    assert len(warnings) == 1 and 'delta E <= 0.01' in warnings[0]
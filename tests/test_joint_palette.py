@@ -0,0 +1,61 @@
+import os
+import sys
+import subprocess
+
+import cv2
+import numpy as np
+
+from conftest import IMG_UTILS_DIR
+from ebg import EBG, Utils
+from joint_palette import image_histogram
+
+MAGENTA = (255, 0, 255)
+
+
+def make_images(directory, count=3):
+    os.makedirs(directory)
+    for i in range(count):
+        img = np.zeros((24, 32, 3), dtype=np.uint8)
+        img[:] = MAGENTA[::-1]
+        img[4:20, 4 + 3 * i:20 + 3 * i] = (30 * i, 200, 90)
+        img[10:14, :] = (0, 0, 200 - 40 * i)
+        cv2.imwrite(os.path.join(directory, f"image{i}.png"), img)
+
+def joint_palette(*arguments, cwd):
+    return subprocess.run([sys.executable, os.path.join(IMG_UTILS_DIR, 'joint_palette.py'), *arguments],
+                          cwd=cwd, capture_output=True, text=True, env=os.environ.copy())
+
+def test_sampled_histogram(tmp_path):
+    make_images(tmp_path / 'images')
+    item = ('images', [str(tmp_path / 'images')])
+    full = image_histogram(item)
+    assert np.array_equal(image_histogram(item, sample=full.sum()), full)
+
+    sampled = image_histogram(item, sample=500)
+    assert np.isclose(sampled.sum(), full.sum())
+    assert np.count_nonzero(sampled) <= 500
+    assert np.all(full[sampled > 0] > 0)
+    # Close to the distribution of every pixel
+    assert np.abs(sampled / sampled.sum() - full / full.sum()).sum() < 0.2
+
+def test_convert_with_transparent_color(tmp_path):
+    make_images(tmp_path / 'images')
+    result = joint_palette('images', '-k', '4', '-t', '255,0,255', '--convert', '-o', 'palette.json', cwd=tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert '3/3 converted' in result.stdout
+
+    for i in range(3):
+        palette = EBG.load(str(tmp_path / 'images' / f"image{i}.ebg")).palette
+        assert palette.transparent is not None
+        # EBG files store RGB565 colors
+        assert Utils.rgb_to_rgb565(*(int(c) for c in palette.rgb_colors[palette.transparent])) == \
+            Utils.rgb_to_rgb565(*MAGENTA)
+
+def test_convert_keeps_item_palette_options(tmp_path):
+    make_images(tmp_path / 'images', count=2)
+    (tmp_path / 'list.txt').write_text("images/image0.png\nimages/image1.png -k 2\n")
+    result = joint_palette('@list.txt', '-k', '4', '-t', '255,0,255', '--convert', '-o', 'palette.json',
+                           cwd=tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert len(EBG.load(str(tmp_path / 'images' / 'image0.ebg')).palette) == 4
+    assert len(EBG.load(str(tmp_path / 'images' / 'image1.ebg')).palette) == 2
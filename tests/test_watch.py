@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+import pytest
+
+import watch
+from ebg import EBG
+
+
+class StopWatching(Exception):
+    pass
+
+def test_watch_survives_list_file_changes(tmp_path, monkeypatch, capsys):
+    img = np.zeros((8, 8, 3), dtype=np.uint8)
+    img[:, 4:] = (255, 255, 255)
+    img[2:6, 2:6] = (0, 0, 255)
+    cv2.imwrite(str(tmp_path / 'image.png'), img)
+    list_file = tmp_path / 'list.txt'
+    list_file.write_text(f"{tmp_path / 'image.png'} -k 3\n")
+
+    # Every poll rewrites the list file: missing, unreadable, then back with other options
+    polls = [
+        lambda: list_file.unlink(),
+        lambda: list_file.write_text(f"{tmp_path / 'image.png'} \"-k 2\n"),
+        lambda: list_file.write_text(f"{tmp_path / 'image.png'} -k 2\n"),
+        lambda: None,
+    ]
+    def sleep(interval):
+        if len(polls) == 0:
+            raise StopWatching()
+        polls.pop(0)()
+    monkeypatch.setattr(watch.time, 'sleep', sleep)
+
+    with pytest.raises(StopWatching):
+        watch.watch([f"@{list_file}"], [])
+
+    assert capsys.readouterr().err.count("Can't collect targets") == 2
+    assert len(EBG.load(str(tmp_path / 'image.ebg')).palette) == 2